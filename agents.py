@@ -0,0 +1,768 @@
+#!/usr/bin/env python3
+"""
+Distributed execution: worker agents that run jobs for a Scripter server.
+
+An agent is a small daemon around `dispatcher.py` on another machine (or the
+same one). It connects to the server's agent port, registers with its name,
+number of slots and tags ("boto3", "gpu", ...), and then runs the jobs the
+server hands it, each in a fresh dispatcher subprocess. The server keeps
+track of free slots and places a queued job on whichever host (itself or an
+agent with matching tags) has the most free slots.
+
+Protocol: TCP with the worker pool's framing (1-byte kind, 4-byte length,
+payload). Each agent keeps one control connection:
+
+    agent  -> server   H  hello {name, slots, tags, token}
+    server -> agent    W  welcome {id, heartbeat, timeout} (or E error)
+    agent <-> server   b  heartbeat {running}, echoed by the server
+    server -> agent    J  job {job_id, script, function, args, sha1, limits}
+
+and opens one data connection per job, which carries the run back like the
+worker pool's socket does:
+
+    agent  -> server   A  attach {agent, job_id, token}
+    server -> agent    W  go ahead (or E)
+    agent  -> server   O output chunks, U resource usage, B files of the
+                       result channel, R result channel bytes, X exit code
+    server -> agent    C cancel: stop the run (so does closing the connection)
+
+An agent whose control connection drops or that misses heartbeats for
+AGENT_TIMEOUT seconds is considered dead; its jobs are requeued (up to
+MAX_REQUEUES times; a `@side_effects` function that had already started is
+failed instead). A data connection that drops without an exit code makes
+its agent suspect: it gets no new jobs until its next heartbeat, and the
+first such loss of a job is not counted against MAX_REQUEUES, since the
+agent may have died (and will be dropped) or merely lost that connection. The protocol is not encrypted: run agents on a trusted
+network, and set SCRIPTER_AGENT_TOKEN on both ends.
+
+Run an agent with:
+    python agents.py --server scripter-host:8765 --slots 4 --tags boto3
+"""
+import argparse
+import hashlib
+import hmac
+import importlib.util
+import itertools
+import json
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import channel
+import pump
+import resources
+from workers import (
+    FRAME_CANCEL, FRAME_EXIT, FRAME_JOB, FRAME_OUTPUT, FRAME_RESULT, FRAME_USAGE, read_frame, watch_cancel,
+    write_frame,
+)
+
+logger = logging.getLogger(__name__)
+
+# Where the server listens for agents; no port disables distributed execution.
+AGENT_HOST = os.environ.get("SCRIPTER_AGENT_HOST", "127.0.0.1")
+AGENT_PORT = int(os.environ.get("SCRIPTER_AGENT_PORT", "0"))
+# Shared secret agents must present (empty = no check).
+AGENT_TOKEN = os.environ.get("SCRIPTER_AGENT_TOKEN", "")
+# Agents send a heartbeat every HEARTBEAT_INTERVAL seconds and are dropped
+# after AGENT_TIMEOUT seconds of silence.
+HEARTBEAT_INTERVAL = float(os.environ.get("SCRIPTER_AGENT_HEARTBEAT", "2"))
+AGENT_TIMEOUT = float(os.environ.get("SCRIPTER_AGENT_TIMEOUT", "10"))
+# How often a job is requeued after losing its agent before it fails.
+MAX_REQUEUES = int(os.environ.get("SCRIPTER_AGENT_MAX_REQUEUES", "2"))
+# Tags the server itself offers to `@requires(...)` functions.
+LOCAL_TAGS = frozenset(t.strip() for t in os.environ.get("SCRIPTER_LOCAL_TAGS", "").split(",") if t.strip())
+# Dispatcher options that refer to files on the server; such jobs run locally.
+LOCAL_ONLY_OPTIONS = ("batch-file", "inputs", "checkpoint")
+
+# Seconds to wait for the first frame of a connection, and for an agent to
+# pick up a job it was sent.
+HANDSHAKE_TIMEOUT = 10.0
+ASSIGN_TIMEOUT = 30.0
+# Seconds between reconnection attempts of an agent (doubling up to the max).
+RECONNECT_DELAY = 1.0
+RECONNECT_MAX_DELAY = 30.0
+
+FRAME_HELLO = b"H"
+FRAME_WELCOME = b"W"
+FRAME_ERROR = b"E"
+FRAME_HEARTBEAT = b"b"
+FRAME_ATTACH = b"A"
+FRAME_BLOB = b"B"  # payload: file path, b"\n", file contents
+
+
+class AgentLost(Exception):
+    """
+    Raised by a remote run whose agent went away. `started` tells whether
+    the agent had begun running the job; `confirmed` is False when only
+    the run's data connection dropped and the agent is still registered.
+    """
+
+    def __init__(self, message, started=False, confirmed=True):
+        super().__init__(message)
+        self.started = started
+        self.confirmed = confirmed
+
+
+def required_tags(func_entry):
+    """
+    Tags named by a function's `@requires(...)` decorator (catalog entry).
+    """
+    from catalog import find_decorator
+
+    node = find_decorator(func_entry, "requires") if func_entry else None
+    args = getattr(node, "args", [])
+    return frozenset(a.value for a in args if isinstance(getattr(a, "value", None), str))
+
+
+def local_only(options):
+    return any(name in options for name in LOCAL_ONLY_OPTIONS)
+
+
+def _check_token(given):
+    return not AGENT_TOKEN or hmac.compare_digest(str(given or ""), AGENT_TOKEN)
+
+
+def _dumps(value):
+    return json.dumps(value).encode("utf-8")
+
+
+# -----------------------------------------------------------------------------
+# Server side
+# -----------------------------------------------------------------------------
+class _Assignment:
+    """
+    A job placed on an agent, until the job's thread releases it.
+    """
+
+    def __init__(self, job_id, agent):
+        self.job_id = job_id
+        self.agent = agent
+        self.attached = threading.Event()
+        self.sock = None  # data connection, once the agent attached
+        self.lost = None  # why the agent was dropped
+        self.closed = False
+        self.cancelled = False
+
+
+class RemoteAgent:
+    """
+    A registered agent and the jobs placed on it.
+    """
+
+    def __init__(self, agent_id, name, address, slots, tags, sock):
+        self.id = agent_id
+        self.name = name
+        self.address = address
+        self.slots = slots
+        self.tags = frozenset(tags)
+        self.sock = sock
+        self.jobs = {}  # job id -> _Assignment
+        self.registered_at = time.time()
+        self.last_seen = time.monotonic()
+        self.reported_running = 0
+        self.suspect = False  # lost a data connection; no jobs until it heartbeats
+        self._send_lock = threading.Lock()
+
+    @property
+    def free(self):
+        return self.slots - len(self.jobs)
+
+    def send(self, kind, payload=b""):
+        with self._send_lock:
+            write_frame(self.sock, kind, payload)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "address": self.address,
+            "slots": self.slots,
+            "free": self.free,
+            "running": sorted(self.jobs),
+            "reported_running": self.reported_running,
+            "suspect": self.suspect,
+            "tags": sorted(self.tags),
+            "registered_at": self.registered_at,
+            "seconds_since_heartbeat": round(time.monotonic() - self.last_seen, 3),
+        }
+
+
+class AgentHub:
+    """
+    Server end: accepts agents, reserves their slots for the job queue and
+    streams remote runs back.
+    """
+
+    def __init__(self, host=AGENT_HOST, port=AGENT_PORT):
+        self.host = host
+        self.port = port
+        self.on_change = None  # called (without locks held) when capacity grows
+        self._agents = {}  # id -> RemoteAgent
+        self._assignments = {}  # job id -> _Assignment
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def start(self):
+        listener = socket.create_server((self.host, self.port))
+        self.port = listener.getsockname()[1]
+        self._listener = listener
+        threading.Thread(target=self._accept_loop, name="agent-hub", daemon=True).start()
+        threading.Thread(target=self._reap_loop, name="agent-reaper", daemon=True).start()
+        logger.info("Accepting worker agents on %s:%d", self.host, self.port)
+
+    # -------------------------------------------------------------------------
+    # Placement (called by the job queue)
+    # -------------------------------------------------------------------------
+    def reserve(self, job, better_than=0):
+        """
+        Reserve a slot for `job` on the agent with the most free slots among
+        those with all of `job.requires`, if it has more than `better_than`
+        free. Returns the agent or None.
+        """
+        with self._lock:
+            candidates = [
+                a for a in self._agents.values()
+                if not a.suspect and a.free > better_than and job.requires <= a.tags
+            ]
+            if not candidates:
+                return None
+            agent = max(candidates, key=lambda a: (a.free, -a.reported_running))
+            assignment = _Assignment(job.id, agent)
+            agent.jobs[job.id] = assignment
+            self._assignments[job.id] = assignment
+            return agent
+
+    def release(self, job_id):
+        with self._lock:
+            assignment = self._assignments.pop(job_id, None)
+            if assignment is not None:
+                assignment.agent.jobs.pop(job_id, None)
+
+    def cancel(self, job_id):
+        """
+        Ask the agent running `job_id` to stop it (once it has attached, if
+        it hasn't yet).
+        """
+        with self._lock:
+            assignment = self._assignments.get(job_id)
+            if assignment is None:
+                return
+            assignment.cancelled = True
+            sock = assignment.sock if assignment.closed else None
+        if sock is not None:
+            try:
+                write_frame(sock, FRAME_CANCEL)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            agents = list(self._agents.values())
+            return {
+                "agents": len(agents),
+                "slots": sum(a.slots for a in agents),
+                "busy": sum(len(a.jobs) for a in agents),
+            }
+
+    def describe(self):
+        with self._lock:
+            return [agent.to_dict() for agent in self._agents.values()]
+
+    # -------------------------------------------------------------------------
+    # Remote runs
+    # -------------------------------------------------------------------------
+    def stream(self, job, spec, on_result=None, on_usage=None):
+        """
+        Send `spec` to the agent reserved for `job` and yield the run's output
+        chunks (bytes); the generator's return value is the exit code.
+        `on_result` receives the run's result channel bytes and `on_usage`
+        its JSON resource usage. Raises AgentLost if the agent goes away
+        before the run finished.
+        """
+        with self._lock:
+            assignment = self._assignments.get(job.id)
+        if assignment is None:
+            raise AgentLost("no agent reserved for the job")
+        agent = assignment.agent
+        try:
+            agent.send(FRAME_JOB, _dumps(spec))
+        except OSError as e:
+            self._drop(agent, f"could not send the job: {e}")
+            raise AgentLost(f"could not send the job: {e}") from e
+
+        assignment.attached.wait(ASSIGN_TIMEOUT)
+        with self._lock:
+            assignment.closed = True
+            sock = assignment.sock
+            cancelled = assignment.cancelled
+        if sock is None:
+            raise AgentLost(assignment.lost or f"agent did not pick up the job within {ASSIGN_TIMEOUT:.0f}s")
+        if cancelled:
+            try:
+                write_frame(sock, FRAME_CANCEL)
+            except OSError:
+                pass
+
+        blobs = {}  # path on the agent -> path in channel.TMP_DIR
+        return_code = None
+        try:
+            while True:
+                try:
+                    frame = read_frame(sock)
+                except (OSError, EOFError):
+                    frame = None
+                if frame is None:
+                    break
+                kind, payload = frame
+                if kind == FRAME_OUTPUT:
+                    yield payload
+                elif kind == FRAME_BLOB:
+                    remote_path, _, data = payload.partition(b"\n")
+                    blobs[remote_path.decode("utf-8")] = _store_blob(remote_path.decode("utf-8"), data)
+                elif kind == FRAME_RESULT:
+                    if on_result is not None:
+                        on_result(_rewrite_channel(payload, blobs))
+                elif kind == FRAME_USAGE:
+                    if on_usage is not None:
+                        on_usage(payload)
+                elif kind == FRAME_EXIT:
+                    return_code = int(payload)
+                    break
+        finally:
+            sock.close()
+            for path in blobs.values():
+                if os.path.exists(path):
+                    os.unlink(path)
+        if return_code is None:
+            with self._lock:
+                confirmed = assignment.lost is not None or agent.id not in self._agents
+                agent.suspect = agent.suspect or not confirmed
+            if not confirmed:
+                logger.warning(
+                    "Agent %s (%s) lost the connection of job %s; no new jobs until it heartbeats",
+                    agent.id, agent.name, assignment.job_id,
+                )
+            raise AgentLost(assignment.lost or "connection to the agent was lost", started=True, confirmed=confirmed)
+        if return_code != 0:
+            yield f"\n[Process exited with code {return_code}]\n".encode("utf-8")
+        return return_code
+
+    # -------------------------------------------------------------------------
+    # Connections
+    # -------------------------------------------------------------------------
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, addr = self._listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn, addr), name="agent-conn", daemon=True).start()
+
+    def _handle(self, conn, addr):
+        try:
+            conn.settimeout(HANDSHAKE_TIMEOUT)
+            frame = read_frame(conn)
+            conn.settimeout(None)
+            if frame is None:
+                conn.close()
+                return
+            kind, payload = frame
+            message = json.loads(payload)
+            if not _check_token(message.get("token")):
+                write_frame(conn, FRAME_ERROR, b"invalid agent token")
+                conn.close()
+            elif kind == FRAME_HELLO:
+                self._session(conn, f"{addr[0]}:{addr[1]}", message)
+            elif kind == FRAME_ATTACH:
+                self._attach(conn, message)
+            else:
+                conn.close()
+        except (OSError, EOFError, ValueError) as e:
+            logger.warning("Agent connection from %s failed: %s", addr[0], e)
+            conn.close()
+
+    def _session(self, conn, address, hello):
+        agent = RemoteAgent(
+            f"a{next(self._ids)}",
+            str(hello.get("name") or address),
+            address,
+            max(0, int(hello.get("slots", 1))),
+            hello.get("tags", []),
+            conn,
+        )
+        agent.send(FRAME_WELCOME, _dumps({"id": agent.id, "heartbeat": HEARTBEAT_INTERVAL, "timeout": AGENT_TIMEOUT}))
+        with self._lock:
+            self._agents[agent.id] = agent
+        logger.info(
+            "Agent %s (%s) registered from %s with %d slots, tags: %s",
+            agent.id, agent.name, address, agent.slots, ", ".join(sorted(agent.tags)) or "none",
+        )
+        self._notify()
+        reason = "connection closed"
+        try:
+            while True:
+                frame = read_frame(conn)
+                if frame is None:
+                    break
+                kind, payload = frame
+                if kind == FRAME_HEARTBEAT:
+                    agent.last_seen = time.monotonic()
+                    agent.reported_running = json.loads(payload).get("running", 0)
+                    agent.send(FRAME_HEARTBEAT)
+                    if agent.suspect:
+                        agent.suspect = False
+                        self._notify()
+        except (OSError, EOFError, ValueError) as e:
+            reason = str(e)
+        self._drop(agent, reason)
+
+    def _attach(self, conn, message):
+        with self._lock:
+            assignment = self._assignments.get(message.get("job_id"))
+            ok = (
+                assignment is not None
+                and assignment.agent.id == message.get("agent")
+                and assignment.agent.id in self._agents
+                and not assignment.closed
+            )
+            if ok:
+                assignment.sock = conn
+        if not ok:
+            write_frame(conn, FRAME_ERROR, b"unknown or withdrawn job")
+            conn.close()
+            return
+        write_frame(conn, FRAME_WELCOME)
+        assignment.attached.set()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            deadline = time.monotonic() - AGENT_TIMEOUT
+            with self._lock:
+                stale = [a for a in self._agents.values() if a.last_seen < deadline]
+            for agent in stale:
+                self._drop(agent, f"no heartbeat for {AGENT_TIMEOUT:.0f}s")
+
+    def _drop(self, agent, reason):
+        """
+        Forget a dead agent: its runs fail with AgentLost (the job queue then
+        requeues them) and its sockets are shut down to wake their readers.
+        """
+        with self._lock:
+            if self._agents.pop(agent.id, None) is None:
+                return
+            assignments = list(agent.jobs.values())
+            for assignment in assignments:
+                assignment.lost = f"agent {agent.name} lost: {reason}"
+        logger.warning("Agent %s (%s) dropped: %s; %d running job(s) affected", agent.id, agent.name, reason, len(assignments))
+        for sock in [agent.sock] + [a.sock for a in assignments if a.sock is not None]:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        agent.sock.close()
+        for assignment in assignments:
+            assignment.attached.set()
+
+    def _notify(self):
+        if self.on_change is not None:
+            self.on_change()
+
+
+def _store_blob(remote_path, data):
+    os.makedirs(channel.TMP_DIR, exist_ok=True)
+    path = os.path.join(channel.TMP_DIR, uuid.uuid4().hex + os.path.splitext(remote_path)[1])
+    with open(path, "wb") as fh:
+        fh.write(data)
+    return path
+
+
+def _rewrite_channel(data, blobs):
+    """
+    Point the file references of an agent's result channel bytes at the
+    copies received here.
+    """
+    out = []
+    for kind, payload in channel.read_frames(data):
+        if kind == channel.FRAME_FILE:
+            ref = json.loads(payload)
+            ref["path"] = blobs.get(ref["path"], "")
+            payload = _dumps(ref)
+        elif kind == channel.FRAME_PROFILE:
+            report = json.loads(payload)
+            report["files"] = {name: blobs.get(path, "") for name, path in report["files"].items()}
+            payload = _dumps(report)
+        out.append(channel.pack_frame(kind, payload))
+    return b"".join(out)
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_hub():
+    """
+    Return the process-wide agent hub, listening on AGENT_PORT, or None if
+    distributed execution is not enabled.
+    """
+    global _hub
+    with _hub_lock:
+        if _hub is None and AGENT_PORT:
+            _hub = AgentHub()
+            _hub.start()
+        return _hub
+
+
+# -----------------------------------------------------------------------------
+# Agent side (run inside `python agents.py`)
+# -----------------------------------------------------------------------------
+class AgentRejected(Exception):
+    """
+    Raised when the server refuses the agent (e.g. a wrong token).
+    """
+
+
+def _file_sha1(path):
+    try:
+        with open(path, "rb") as fh:
+            return hashlib.sha1(fh.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def _channel_files(data):
+    """
+    Paths of the files referenced by result channel bytes.
+    """
+    paths = []
+    for kind, payload in channel.read_frames(data):
+        if kind == channel.FRAME_FILE:
+            paths.append(json.loads(payload)["path"])
+        elif kind == channel.FRAME_PROFILE:
+            paths.extend(json.loads(payload)["files"].values())
+    return list(dict.fromkeys(paths))
+
+
+class Agent:
+    """
+    The agent daemon: keeps a registration with the server and runs the jobs
+    it is sent.
+    """
+
+    def __init__(self, server, name, slots, tags, token=AGENT_TOKEN):
+        self.server = server
+        self.name = name
+        self.slots = slots
+        self.tags = sorted(tags)
+        self.token = token
+        self.id = None
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def run_forever(self):
+        delay = RECONNECT_DELAY
+        while True:
+            started = time.monotonic()
+            try:
+                self._session()
+            except AgentRejected:
+                raise
+            except (OSError, EOFError, ValueError) as e:
+                logger.warning("Connection to %s:%d lost: %s", *self.server, e)
+            if time.monotonic() - started > AGENT_TIMEOUT:
+                delay = RECONNECT_DELAY
+            time.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def _connect(self, kind, message):
+        sock = socket.create_connection(self.server, timeout=HANDSHAKE_TIMEOUT)
+        try:
+            write_frame(sock, kind, _dumps(dict(message, token=self.token)))
+            frame = read_frame(sock)
+        except BaseException:
+            sock.close()
+            raise
+        if frame is None or frame[0] != FRAME_WELCOME:
+            sock.close()
+            if frame is None:
+                raise ConnectionError("server closed the connection")
+            raise AgentRejected(frame[1].decode("utf-8", "replace"))
+        return sock, frame[1]
+
+    def _session(self):
+        hello = {"name": self.name, "slots": self.slots, "tags": self.tags}
+        sock, payload = self._connect(FRAME_HELLO, hello)
+        welcome = json.loads(payload)
+        self.id = welcome["id"]
+        sock.settimeout(welcome["timeout"])
+        logger.info("Registered with %s:%d as %s", *self.server, self.id)
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(welcome["heartbeat"]):
+                with self._lock:
+                    running = len(self._running)
+                try:
+                    write_frame(sock, FRAME_HEARTBEAT, _dumps({"running": running}))
+                except OSError:
+                    return
+
+        threading.Thread(target=heartbeat, name="agent-heartbeat", daemon=True).start()
+        try:
+            while True:
+                frame = read_frame(sock)  # heartbeat echoes arrive at least every interval
+                if frame is None:
+                    raise ConnectionError("server closed the connection")
+                kind, payload = frame
+                if kind == FRAME_JOB:
+                    spec = json.loads(payload)
+                    threading.Thread(
+                        target=self._run_job, args=(self.id, spec), name=f"job-{spec['job_id']}", daemon=True
+                    ).start()
+        finally:
+            stop.set()
+            sock.close()
+
+    def _run_job(self, agent_id, spec):
+        job_id = spec["job_id"]
+        with self._lock:
+            self._running.add(job_id)
+        try:
+            sock, _ = self._connect(FRAME_ATTACH, {"agent": agent_id, "job_id": job_id})
+        except (OSError, EOFError, AgentRejected) as e:
+            logger.warning("Could not attach to job %s: %s", job_id, e)
+            with self._lock:
+                self._running.discard(job_id)
+            return
+        try:
+            sock.settimeout(None)
+            self._execute(sock, spec)
+        except Exception:
+            logger.exception("Job %s failed on this agent", job_id)
+        finally:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)  # wakes up the cancel watcher
+            except OSError:
+                pass
+            sock.close()
+            with self._lock:
+                self._running.discard(job_id)
+
+    def _execute(self, sock, spec):
+        from executors import SCRIPTS_DIR, build_command, split_script
+
+        script_module_arg, workdir = split_script(spec["script"])
+        cmd = build_command(script_module_arg, spec["function"], spec["args"])
+        local_sha1 = _file_sha1(os.path.join(SCRIPTS_DIR, spec["script"]))
+        if spec.get("sha1") and local_sha1 != spec["sha1"]:
+            write_frame(sock, FRAME_OUTPUT, (
+                f"[Warning: agent {self.name}'s copy of {spec['script']} differs from the server's]\n"
+            ).encode("utf-8"))
+        logger.info("Running job %s: %s", spec["job_id"], " ".join(cmd))
+
+        read_fd, write_fd = channel.open_channel()
+        try:
+            proc = subprocess.Popen(
+                cmd,
+                cwd=workdir,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                bufsize=0,
+                pass_fds=(write_fd,),
+                env=dict(resources.child_env(spec.get("limits")), **{channel.RESULT_FD_ENV: str(write_fd)}),
+                start_new_session=True,
+            )
+        except OSError:
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+        group = resources.ProcessGroup(proc.pid)
+        watch_cancel(sock, group.terminate)
+        deadline = resources.Deadline(spec.get("limits"), group.terminate)
+        try:
+            for chunk in pump.read_chunks(proc.stdout.fileno()):
+                write_frame(sock, FRAME_OUTPUT, chunk)
+        except OSError:
+            # The server went away; don't leave the run going unattended.
+            group.terminate()
+        finally:
+            proc.stdout.close()
+            deadline.cancel()
+        usage = resources.reap(proc)
+        group.close()
+        return_code = proc.returncode
+        data = channel.read_available(read_fd)
+        try:
+            note = resources.exit_note(spec.get("limits"), return_code, deadline)
+            if note:
+                write_frame(sock, FRAME_OUTPUT, note.encode("utf-8"))
+            write_frame(sock, FRAME_USAGE, _dumps(usage))
+            for path in _channel_files(data):
+                if os.path.dirname(os.path.abspath(path)) != os.path.abspath(channel.TMP_DIR):
+                    continue
+                try:
+                    with open(path, "rb") as fh:
+                        write_frame(sock, FRAME_BLOB, path.encode("utf-8") + b"\n" + fh.read())
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            if data:
+                write_frame(sock, FRAME_RESULT, data)
+            write_frame(sock, FRAME_EXIT, str(return_code).encode())
+        except OSError:
+            pass
+
+
+def detect_tags(modules):
+    """
+    The subset of `modules` that can be imported here, used as tags.
+    """
+    return [name for name in modules if importlib.util.find_spec(name) is not None]
+
+
+def _address(text):
+    host, _, port = text.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s [agent]: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    parser = argparse.ArgumentParser(description="Worker agent that runs Scripter jobs for a server.")
+    parser.add_argument(
+        "--server",
+        default=f"{AGENT_HOST}:{AGENT_PORT or 8765}",
+        help="Server's agent address, host:port (its SCRIPTER_AGENT_PORT).",
+    )
+    parser.add_argument("--name", default=f"{socket.gethostname()}-{os.getpid()}", help="Name shown by the server.")
+    parser.add_argument("--slots", type=int, default=os.cpu_count() or 4, help="Jobs run at the same time.")
+    parser.add_argument("--tags", default="", help="Comma-separated tags to advertise (e.g. 'boto3,gpu').")
+    parser.add_argument(
+        "--detect",
+        default="",
+        help="Comma-separated modules to advertise as tags if they can be imported here.",
+    )
+    cli = parser.parse_args()
+    tags = {t for t in cli.tags.split(",") if t}
+    tags.update(detect_tags([m for m in cli.detect.split(",") if m]))
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    agent = Agent(_address(cli.server), cli.name, cli.slots, tags)
+    try:
+        agent.run_forever()
+    except AgentRejected as e:
+        logger.error("Server refused this agent: %s", e)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
@@ -1,14 +1,107 @@
 import os
-import sys
+import json
+import hashlib
 import inspect
-import subprocess
 import datetime
-from flask import send_from_directory
+import select
+import shutil
+import socket
+import tempfile
+import time
+import uuid
+from flask import send_from_directory, send_file
 
-from flask import Flask, render_template, request, Response, url_for, redirect
+from flask import Flask, render_template, request, Response, url_for, redirect, jsonify
+from flask import Request
+from werkzeug.utils import secure_filename
+
+import executors
+import handoff
+import pagecache
+import paramtypes
+
+from agents import get_hub
+from catalog import LISTING_PAGE_SIZE, SEARCH_LIMIT, get_catalog
+from channel import PAGE_SIZE, ResultFile
+from executors import stream_subprocess  # noqa: F401  (kept importable from app)
+from history import BadQuery, get_history
+from jobs import QueueFull, get_queue
+from metrics import run_metrics
+from pipelines import PipelineError, get_runner
+from profiling import PROFILERS
+from runlog import STATE_DIR, RunLog
 
 app = Flask(__name__, static_folder="static", template_folder="templates")
-SCRIPTS_DIR = os.path.join(os.path.dirname(__file__), "scripts")
+# Largest request body accepted, in bytes (unset: no limit).
+if os.environ.get("SCRIPTER_MAX_CONTENT_LENGTH"):
+    app.config["MAX_CONTENT_LENGTH"] = int(os.environ["SCRIPTER_MAX_CONTENT_LENGTH"])
+
+
+# Files uploaded for file parameters, and inputs files of typed values.
+UPLOAD_DIR = paramtypes.UPLOAD_DIR
+# Hours after which leftovers there (of runs that never finished, say) are deleted.
+UPLOAD_KEEP_HOURS = float(os.environ.get("SCRIPTER_UPLOAD_KEEP_HOURS", "24"))
+
+
+class StreamingRequest(Request):
+    """
+    Writes uploaded files straight into UPLOAD_DIR, chunk by chunk, while
+    the multipart body is parsed, instead of buffering them in memory or a
+    temporary file. `claim_upload()` then moves one into place (a rename,
+    no copy); the ones not claimed are deleted when the request ends.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        fh = tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, prefix=".upload-", delete=False)
+        self.__dict__.setdefault("spooled_uploads", []).append(fh.name)
+        return fh
+
+
+app.request_class = StreamingRequest
+
+
+@app.teardown_request
+def remove_unclaimed_uploads(exc):
+    for path in request.__dict__.get("spooled_uploads", ()):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+SCRIPTS_DIR = os.environ.get("SCRIPTER_SCRIPTS_DIR", os.path.join(os.path.dirname(__file__), "scripts"))
+
+
+def cached_page(key, render):
+    """
+    `render()` cached per `key` and template version (see pagecache.py),
+    with an ETag, 304s and compression.
+    """
+    return pagecache.cached_page((key, datetime.date.today().year), render, app.template_folder)
+
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    # url_for("static", ...) -> /static/<file>?v=<content hash>
+    if endpoint == "static" and "filename" in values and "v" not in values:
+        version = pagecache.fingerprint(app.static_folder, values["filename"])
+        if version:
+            values["v"] = version
+
+
+def static_file(filename):
+    """
+    Files under static/: cached for a year when requested under their
+    current fingerprint, revalidated otherwise.
+    """
+    version = request.args.get("v")
+    immutable = version is not None and version == pagecache.fingerprint(app.static_folder, filename)
+    cache_control = pagecache.IMMUTABLE if immutable else pagecache.REVALIDATE
+    return pagecache.send_cached_file(app.static_folder, filename, cache_control)
+
+
+app.view_functions["static"] = static_file
 
 
 @app.route("/docs", methods=["GET"])
@@ -16,42 +109,31 @@ def docs():
     """
     Render the Documentation page.
     """
-    return render_template("docs.html")
+    return cached_page(None, lambda: render_template("docs.html"))
 
 @app.route("/about", methods=["GET"])
 def about():
     """
     Render the About page.
     """
-    return render_template("about.html")
+    return cached_page(None, lambda: render_template("about.html"))
 
 @app.route("/scripts/<path:filename>")
 def serve_script_file(filename):
     """
     Serve any file under the `scripts/` folder so that
-    /scripts/<folder_path>/icon.png resolves.
+    /scripts/<folder_path>/icon.png resolves (from the response cache, with
+    an ETag).
     """
-    return send_from_directory(SCRIPTS_DIR, filename)
+    return pagecache.send_cached_file(SCRIPTS_DIR, filename)
 
 
 def build_script_tree(base_path):
     """
-    Recursively build:
+    Build the nested tree from the script catalog (no modules are imported):
       { files: [ { name, functions: [...] } ], subdirs: {...} }
     """
-    tree = {"files": [], "subdirs": {}}
-    for entry in sorted(os.listdir(base_path)):
-        full = os.path.join(base_path, entry)
-        if os.path.isdir(full) and not entry.startswith("__"):
-            tree["subdirs"][entry] = build_script_tree(full)
-        elif entry.endswith(".py") and not entry.startswith("__"):
-            module_name, _ = os.path.splitext(entry)
-            funcs = list_functions(module_name, base_path)
-            tree["files"].append({
-                "name": entry,
-                "functions": list(funcs.keys())
-            })
-    return tree
+    return get_catalog(base_path).tree()
 
 
 @app.context_processor
@@ -62,29 +144,79 @@ def inject_current_year():
 @app.route("/", methods=["GET"])
 def index():
     """
-    Build a nested folder→scripts tree and pass into the template.
+    Dashboard shell: catalog totals only. The tree itself is loaded folder
+    by folder from /tree and searched through /search.
+    """
+    catalog = get_catalog(SCRIPTS_DIR)
+    return cached_page(catalog.etag(), lambda: render_template("index.html", summary=catalog.summary()))
+
+
+def catalog_response(etag, build):
+    """
+    JSON from `build()`, or 304 if the client already has this catalog
+    version. Clients must revalidate (no-cache) so new scripts show up.
+    """
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        body = build()
+        if body is None:
+            return jsonify(error="Unknown folder"), 404
+        response = jsonify(body)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@app.route("/tree", methods=["GET"])
+def script_tree():
+    """
+    One page of a folder's children (`?path=AWS/Lambda&offset=0&limit=200`),
+    subfolders first, with recursive script/function counts per subfolder.
     """
-    tree = build_script_tree(SCRIPTS_DIR)
-    return render_template("index.html", script_tree=tree, parent_path="") 
+    catalog = get_catalog(SCRIPTS_DIR)
+    folder = request.args.get("path", "")
+    offset = max(0, request.args.get("offset", 0, type=int))
+    limit = max(1, min(request.args.get("limit", LISTING_PAGE_SIZE, type=int), 5 * LISTING_PAGE_SIZE))
+
+    def build():
+        page = catalog.listing(folder, offset, limit)
+        if page is not None:
+            for entry in page["entries"]:
+                if entry["type"] == "folder":
+                    entry["icon"] = os.path.isfile(os.path.join(SCRIPTS_DIR, entry["path"], "icon.png"))
+        return page
+
+    return catalog_response(catalog.etag(), build)
+
+
+@app.route("/search", methods=["GET"])
+def search_scripts():
+    """
+    Scripts and functions matching `?q=` by prefix, substring or fuzzy match.
+    """
+    catalog = get_catalog(SCRIPTS_DIR)
+    query = request.args.get("q", "")
+    limit = max(1, min(request.args.get("limit", SEARCH_LIMIT, type=int), 5 * SEARCH_LIMIT))
+
+    def build():
+        results = catalog.search(query, limit)
+        for result in results:
+            result["url"] = url_for("select_script", folder_and_script=result["script"])
+        return {"query": query, "results": results}
+
+    return catalog_response(f"{catalog.etag()}.{hashlib.sha1(query.encode('utf-8')).hexdigest()[:12]}", build)
 
 
 # (Other routes like /select/<...> and /run remain unchanged)
 
 
 def list_functions(module_name: str, module_folder: str):
-    # existing implementation
-    sys.path.insert(0, module_folder)
-    try:
-        module = __import__(module_name)
-    except Exception:
-        return {}
-    finally:
-        sys.path.pop(0)
-    funcs = {}
-    for attr_name, attr_val in vars(module).items():
-        if inspect.isfunction(attr_val) and attr_val.__module__ == module_name:
-            funcs[attr_name] = inspect.signature(attr_val)
-    return funcs
+    """
+    Return {func_name: signature} for a script, read from the catalog.
+    """
+    script_path = os.path.join(module_folder, module_name + ".py")
+    return get_catalog().signatures(os.path.relpath(script_path, SCRIPTS_DIR))
 
 @app.context_processor
 def inject_current_year():
@@ -111,11 +243,20 @@ def select_script(folder_and_script):
         return redirect(url_for("index"))
 
     module_name, _ = os.path.splitext(script_filename)
-    sys.path.insert(0, module_folder)
-    try:
-        funcs_signatures = list_functions(module_name, module_folder)
-    finally:
-        sys.path.pop(0)
+    entry = get_catalog().file(folder_and_script)
+    key = (folder_and_script, entry["sha1"] if entry else None)
+    return cached_page(key, lambda: render_run_page(folder_and_script, module_name, module_folder))
+
+
+def render_run_page(folder_and_script, module_name, module_folder):
+    """
+    The run page of a script: a form per function, typed by annotation.
+    """
+    funcs_signatures = list_functions(module_name, module_folder)
+    funcs_docs = {
+        fname: entry["doc"]
+        for fname, entry in get_catalog().functions(folder_and_script).items()
+    }
 
     # Build metadata for each function (same as before)
     def build_funcs_meta(functions_signatures):
@@ -127,7 +268,21 @@ def select_script(folder_and_script):
                 ann = param_obj.annotation
                 default_val = None if param_obj.default is _empty else param_obj.default
 
-                if ann == int:
+                kind = paramtypes.kind(ann)
+                if kind == "bool":
+                    input_type = "checkbox"
+                    step = None
+                    dtype = "bool"
+                    type_name = "bool"
+                elif kind in ("json", "path", "buffer"):
+                    # JSON text, or an upload for file parameters.
+                    input_type = "json" if kind == "json" else "file"
+                    step = None
+                    dtype = input_type
+                    type_name = ann.__name__ if isinstance(ann, type) else str(ann)
+                    if kind == "json" and default_val is not None:
+                        default_val = json.dumps(default_val)
+                elif ann == int:
                     input_type = "number"
                     step = "1"
                     dtype = "int"
@@ -165,25 +320,721 @@ def select_script(folder_and_script):
         "run_script.html",
         script_name=folder_and_script,
         functions_signatures=funcs_signatures,
-        functions_meta=funcs_meta
+        functions_meta=funcs_meta,
+        functions_docs=funcs_docs,
+    )
+
+
+def resolve_script(full_script):
+    """
+    Normalize a script path relative to scripts/ (with or without ".py").
+    Returns e.g. "Category/Subcategory/sample_script.py", or None if the
+    script does not exist or points outside scripts/.
+    """
+    if not full_script:
+        return None
+    if not full_script.endswith(".py"):
+        full_script += ".py"
+    relpath = os.path.normpath(full_script).replace(os.sep, "/")
+    if relpath.startswith("../") or os.path.isabs(relpath):
+        return None
+    if not os.path.isfile(os.path.join(SCRIPTS_DIR, relpath)):
+        return None
+    return relpath
+
+
+def claim_upload(storage, path):
+    """
+    Move an uploaded file (see StreamingRequest) to `path`.
+    """
+    spooled = getattr(storage.stream, "name", None)
+    if isinstance(spooled, str) and os.path.dirname(spooled) == UPLOAD_DIR:
+        storage.stream.flush()
+        os.replace(spooled, path)
+        storage.stream.close()
+    else:
+        storage.save(path)
+
+
+_last_upload_sweep = 0.0
+
+
+def sweep_uploads():
+    """
+    Delete uploads, inputs files and batch items files older than
+    UPLOAD_KEEP_HOURS (at most once an hour). Those of finished runs are
+    deleted right away.
+    """
+    global _last_upload_sweep
+    now = time.time()
+    if not UPLOAD_KEEP_HOURS or now - _last_upload_sweep < 3600:
+        return
+    _last_upload_sweep = now
+    cutoff = now - UPLOAD_KEEP_HOURS * 3600
+    entries = []
+    for directory in (UPLOAD_DIR, BATCH_DIR):
+        try:
+            entries += os.scandir(directory)
+        except OSError:
+            continue
+    for entry in entries:
+        try:
+            if entry.stat().st_mtime >= cutoff:
+                continue
+            if entry.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                os.remove(entry.path)
+        except OSError:
+            continue
+
+
+def typed_params(script, function, params, files):
+    """
+    Split a run's parameters by kind (see paramtypes.py). int/float/str
+    values stay command-line flags; bool, JSON and uploaded files (`files`,
+    name -> FileStorage) go to the dispatcher in an inputs file. Returns
+    (params, options, upload_dir, error_response); `upload_dir` holds the
+    run's uploads, to delete once it finished.
+    """
+    entry = get_catalog().file(script)
+    func = entry["functions"].get(function) if entry and not entry["error"] else None
+    if func is None:
+        return params, {}, None, None  # the run reports the unknown function
+    kinds = {p["name"]: paramtypes.kind(p["annotation"]) for p in func["params"]}
+    params, inputs, uploads = dict(params), {}, {}
+    for name, value in list(params.items()):
+        kind = kinds.get(name)
+        try:
+            if kind == "bool":
+                inputs[name] = paramtypes.boolean(params.pop(name))
+            elif kind == "json":
+                inputs[name] = paramtypes.json_value(params.pop(name))
+        except ValueError as e:
+            return None, None, None, (jsonify(error=f"Invalid value for '{name}': {e}"), 400)
+
+    upload_dir = None
+    for name, storage in files.items():
+        if kinds.get(name) not in paramtypes.FILE_KINDS:
+            return None, None, None, (jsonify(error=f"Parameter '{name}' does not take a file"), 400)
+        if upload_dir is None:
+            upload_dir = os.path.join(UPLOAD_DIR, uuid.uuid4().hex)
+            os.makedirs(upload_dir)
+        os.makedirs(os.path.join(upload_dir, name))
+        path = os.path.join(upload_dir, name, secure_filename(storage.filename) or "upload")
+        claim_upload(storage, path)
+        params.pop(name, None)
+        inputs.pop(name, None)
+        uploads[name] = {"$file": path, "as": kinds[name]}
+    if not inputs and not uploads:
+        return params, {}, None, None
+
+    # Typed values alone are stored by content, so identical runs still
+    # share one inputs file (and coalesce). Client values only ever go in
+    # its "values", which are passed as they are (see handoff.py).
+    if upload_dir is not None:
+        path = os.path.join(upload_dir, "inputs.json")
+    else:
+        sweep_uploads()
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        digest = hashlib.sha1(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+        path = os.path.join(UPLOAD_DIR, f"inputs-{digest}.json")
+    handoff.write_inputs(path, inputs, files=uploads)
+    return params, {"inputs": path}, upload_dir, None
+
+
+# Form fields that are not function parameters ("_priority" etc. are
+# prefixed so they can't clash with parameters of the same name).
+RESERVED_FIELDS = ("script", "function", "_priority", "_profile", "_timeout", "_cancel_on_disconnect")
+
+
+def submit_job(payload, options=None):
+    """
+    Validate a run request and queue it, or attach it to an identical run
+    that is still in flight. Returns (job, attached, error_response).
+    `payload` has "script", "function", optional "priority", "profile" (a
+    profiler name), "timeout" (seconds), "cancel_on_disconnect", "params"
+    and "files" (uploads for file parameters); `options` are extra
+    dispatcher flags for the job.
+    """
+    script = resolve_script(payload.get("script"))
+    function = payload.get("function")
+    if script is None:
+        return None, False, (jsonify(error=f"Unknown script: {payload.get('script')}"), 404)
+    if not function:
+        return None, False, (jsonify(error="Missing 'function'"), 400)
+    try:
+        priority = int(payload.get("priority") or 0)
+    except ValueError:
+        return None, False, (jsonify(error="'priority' must be an integer"), 400)
+    try:
+        timeout = float(payload.get("timeout") or 0) or None
+    except ValueError:
+        timeout = -1
+    if timeout is not None and timeout <= 0:
+        return None, False, (jsonify(error="'timeout' must be a positive number of seconds"), 400)
+    profile = payload.get("profile") or None
+    if profile is not None:
+        if profile not in PROFILERS:
+            error = f"Unknown profiler '{profile}', expected one of: {', '.join(PROFILERS)}"
+            return None, False, (jsonify(error=error), 400)
+        options = dict(options or {}, profile=profile)
+    reserved = [name for name in payload.get("params", {}) if name in executors.DISPATCHER_OPTIONS]
+    if reserved:
+        return None, False, (jsonify(error=f"Reserved parameter names: {', '.join(reserved)}"), 400)
+    params, typed_options, upload_dir, error = typed_params(
+        script, function, payload.get("params", {}), payload.get("files", {})
+    )
+    if error:
+        return None, False, error
+    if typed_options:
+        options = dict(options or {}, **typed_options)
+    try:
+        job, attached = get_queue().submit_or_attach(
+            script, function, params, priority, options,
+            timeout=timeout, cancel_on_disconnect=bool(payload.get("cancel_on_disconnect")),
+        )
+    except QueueFull as e:
+        if upload_dir is not None:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+        return None, False, (jsonify(error=str(e)), 429)
+    if upload_dir is not None:
+        job.add_done_callback(lambda _job: shutil.rmtree(upload_dir, ignore_errors=True))
+    return job, attached, None
+
+
+def accepted(job, attached):
+    """
+    202 response for a queued (or attached-to) job.
+    """
+    body = job.to_dict()
+    body["attached_to_existing"] = attached
+    body["stream_url"] = url_for("stream_job", job_id=job.id)
+    return jsonify(body), 202, {"Location": url_for("job_status", job_id=job.id)}
+
+
+def payload_from_request():
+    if request.is_json:
+        return request.get_json(silent=True) or {}
+    payload = {
+        "script": request.form.get("script"),
+        "function": request.form.get("function"),
+        "priority": request.form.get("_priority"),
+        "profile": request.form.get("_profile"),
+        "timeout": request.form.get("_timeout"),
+        "cancel_on_disconnect": request.form.get("_cancel_on_disconnect") in ("1", "true", "on"),
+    }
+    payload["params"] = {
+        key: val
+        for key, val in request.form.items()
+        if key not in RESERVED_FIELDS
+    }
+    payload["files"] = {key: upload for key, upload in request.files.items() if upload.filename}
+    return payload
+
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    """
+    Queue a run and return its job ID immediately (202 Accepted).
+    Accepts the same form fields as /run (multipart with files for file
+    parameters), or JSON:
+      { "script": ..., "function": ..., "params": {...}, "priority": 0,
+        "timeout": 60, "cancel_on_disconnect": false }
+    bool and list/dict parameters take JSON values (or their text form).
+    If an identical run is already queued or running, the response is that
+    job, with "attached_to_existing": true.
+    """
+    job, attached, error = submit_job(payload_from_request())
+    if error:
+        return error
+    return accepted(job, attached)
+
+
+# Uploaded / posted batch item files, passed to the dispatcher by path.
+BATCH_DIR = os.path.join(STATE_DIR, "batches")
+BATCH_FILE_TYPES = (".csv", ".jsonl", ".ndjson", ".json")
+# Batch-only form fields.
+BATCH_FIELDS = ("_grid", "_parallel", "items")
+
+
+def remove_file(path):
+    if path is None:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def batch_options():
+    """
+    Dispatcher batch flags for the current /batch request. Returns
+    (options, error_response). Items come from an uploaded "items" file
+    (CSV / JSONL / JSON), a JSON "items" list and/or a JSON "grid".
+    """
+    body = (request.get_json(silent=True) or {}) if request.is_json else {}
+    grid = body.get("grid") if request.is_json else request.form.get("_grid")
+    items = body.get("items")
+    upload = request.files.get("items")
+    parallel = body.get("parallel") if request.is_json else request.form.get("_parallel")
+
+    options = {}
+    if parallel:
+        try:
+            options["batch-parallel"] = max(1, int(parallel))
+        except ValueError:
+            return None, (jsonify(error="'parallel' must be an integer"), 400)
+    if grid:
+        try:
+            if isinstance(grid, str):
+                grid = json.loads(grid)
+            if not isinstance(grid, dict):
+                raise ValueError("expected a JSON object of {param: [values]}")
+        except ValueError as e:
+            return None, (jsonify(error=f"Invalid grid: {e}"), 400)
+        options["batch-grid"] = json.dumps(grid)
+
+    if upload is not None and upload.filename:
+        ext = os.path.splitext(upload.filename)[1].lower()
+        if ext not in BATCH_FILE_TYPES:
+            return None, (jsonify(error=f"Unsupported items file type '{ext}'"), 400)
+        os.makedirs(BATCH_DIR, exist_ok=True)
+        path = os.path.join(BATCH_DIR, uuid.uuid4().hex + ext)
+        claim_upload(upload, path)
+        options["batch-file"] = path
+    elif items:
+        if not isinstance(items, list) or not all(isinstance(i, dict) for i in items):
+            return None, (jsonify(error="'items' must be a list of objects"), 400)
+        os.makedirs(BATCH_DIR, exist_ok=True)
+        path = os.path.join(BATCH_DIR, uuid.uuid4().hex + ".jsonl")
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.writelines(json.dumps(item) + "\n" for item in items)
+        options["batch-file"] = path
+
+    if "batch-grid" not in options and "batch-file" not in options:
+        return None, (jsonify(error="A batch needs a 'grid' and/or 'items'"), 400)
+    return options, None
+
+
+@app.route("/batch", methods=["POST"])
+def create_batch():
+    """
+    Queue a batch run: one function called over many parameter sets on a
+    process pool inside a single dispatcher. Form / multipart fields are the
+    /jobs fields plus "_grid" (JSON), "_parallel" and an "items" file; other
+    fields are shared by every item. JSON:
+      { "script": ..., "function": ..., "params": {...},
+        "grid": {...}, "items": [{...}, ...], "parallel": 4 }
+    Output is tagged "[item N]" and ends with a summary.
+    """
+    payload = payload_from_request()
+    # Checked before any items file is written.
+    script = resolve_script(payload.get("script"))
+    if script is None:
+        return jsonify(error=f"Unknown script: {payload.get('script')}"), 404
+    if payload.get("function") not in get_catalog().functions(script):
+        return jsonify(error=f"Unknown function: {payload.get('function')}"), 404
+    options, error = batch_options()
+    if error:
+        return error
+    items_file = options.get("batch-file")
+    payload["params"] = {
+        key: val for key, val in payload.get("params", {}).items() if key not in BATCH_FIELDS
+    }
+    payload["files"] = {
+        key: upload for key, upload in payload.get("files", {}).items() if key not in BATCH_FIELDS
+    }
+    try:
+        job, attached, error = submit_job(payload, options)
+    except Exception:
+        remove_file(items_file)
+        raise
+    if error or attached:
+        remove_file(items_file)
+    else:
+        job.add_done_callback(lambda _job: remove_file(items_file))
+    if error:
+        return error
+    return accepted(job, attached)
+
+
+def find_run(job_id):
+    """
+    Return (job, run_log) for a job ID. Jobs evicted from memory (or from
+    before a restart) still resolve to their log on disk with job=None.
+    """
+    job = get_queue().get(job_id)
+    if job is not None:
+        return job, job.log
+    return None, RunLog.open(job_id)
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job, log = find_run(job_id)
+    if job is not None:
+        body = job.to_dict()
+        body["queue_position"] = get_queue().position(job)
+    elif log is not None and log.meta:
+        body = dict(log.meta)
+    elif get_history() is not None and get_history().get(job_id) is not None:
+        body = get_history().get(job_id)  # output evicted, metadata kept
+    else:
+        return jsonify(error=f"Unknown job: {job_id}"), 404
+    return jsonify(body)
+
+
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    """
+    Cancel a queued or running job. A running job's process group gets
+    SIGTERM, then SIGKILL after SCRIPTER_TERM_GRACE seconds; the job's
+    status becomes "cancelled" once it has exited. 409 if it already
+    finished.
+    """
+    job, log = find_run(job_id)
+    if job is None:
+        if log is not None and log.meta:
+            return jsonify(error=f"Job {job_id} already finished", status=log.meta.get("status")), 409
+        return jsonify(error=f"Unknown job: {job_id}"), 404
+    if not get_queue().cancel(job):
+        return jsonify(error=f"Job {job_id} already finished", status=job.status), 409
+    return jsonify(job.to_dict()), 202
+
+
+# Seconds between checks whether the client of a silent stream is still
+# connected.
+DISCONNECT_POLL = 2
+
+
+def client_socket():
+    """
+    The connection of the current request where the server exposes it (the
+    werkzeug server does), so a stream can notice that its client left
+    before it has anything to write. None elsewhere; a disconnect then
+    shows up on the next write.
+    """
+    return request.environ.get("werkzeug.socket")
+
+
+def client_gone(sock):
+    """
+    True if the client on `sock` (see `client_socket`) has closed the
+    connection.
+    """
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and not sock.recv(1, socket.MSG_PEEK)
+    except ValueError:
+        return False  # e.g. a TLS socket, which can't peek
+    except OSError:
+        return True
+
+
+def follow_run(job, log, offset, sock, keepalive=None, tick=None):
+    """
+    Yield (offset, bytes) chunks of `log` from `offset` while counting as a
+    viewer of `job`, and stop early once the client on `sock` has gone.
+    With `keepalive`, also yields (offset, b"") after that many idle
+    seconds. With `tick`, also yields (offset, None) every `tick` seconds,
+    output or not (for periodic updates such as progress).
+    """
+    poll = min(DISCONNECT_POLL, tick) if tick else DISCONNECT_POLL
+    idle = 0
+    next_tick = time.monotonic() + (tick or 0)
+    with get_queue().following(job):
+        for start, data in log.follow(offset, timeout=poll):
+            if data:
+                idle = 0
+                yield start, data
+            elif client_gone(sock):
+                return
+            else:
+                idle += poll
+                if keepalive and idle >= keepalive:
+                    idle = 0
+                    yield start, data
+            if tick and time.monotonic() >= next_tick:
+                next_tick = time.monotonic() + tick
+                yield start, None
+
+
+@app.route("/jobs/<job_id>/stream", methods=["GET"])
+def stream_job(job_id):
+    """
+    Attach to a job's output: everything produced so far, then live output
+    until the job finishes. `?offset=N` starts at byte N.
+    """
+    job, log = find_run(job_id)
+    if log is None:
+        return jsonify(error=f"Unknown job: {job_id}"), 404
+    offset = max(0, request.args.get("offset", 0, type=int))
+    sock = client_socket()
+
+    def generate():
+        for _, data in follow_run(job, log, offset, sock):
+            yield data.decode("utf-8", errors="replace")
+
+    return Response(generate(), mimetype="text/plain")
+
+
+# Seconds of silence before an SSE comment is sent to keep proxies from
+# closing the connection.
+SSE_KEEPALIVE = 15
+
+
+def sse_offset(headers, args):
+    """
+    Byte offset to resume an event stream from (Last-Event-ID or ?offset=).
+    """
+    try:
+        return max(0, int(headers.get("Last-Event-ID") or args.get("offset") or 0))
+    except ValueError:
+        return 0
+
+
+def sse_chunk(start, data):
+    """
+    Format one chunk of run output as an SSE message (empty data = keep-alive).
+    """
+    if not data:
+        return ": keep-alive\n\n"
+    text = json.dumps(data.decode("utf-8", errors="replace"))
+    return f"id: {start + len(data)}\ndata: {text}\n\n"
+
+
+def sse_end(job, log):
+    status = job.to_dict() if job is not None else (log.meta or {})
+    return f"event: end\ndata: {json.dumps(status)}\n\n"
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# Seconds between two progress events sent to one viewer; the run's updates
+# in between are coalesced into the latest state.
+PROGRESS_EVENT_INTERVAL = float(os.environ.get("SCRIPTER_PROGRESS_EVENT_INTERVAL", "0.5"))
+
+
+class ProgressEvents:
+    """
+    The progress a run reports (see `scripter.progress`), throttled for one
+    viewer: at most one `progress` event per PROGRESS_EVENT_INTERVAL, and
+    only when the state changed since the last one sent.
+    """
+
+    def __init__(self, log, interval=PROGRESS_EVENT_INTERVAL):
+        self.log = log
+        self.interval = interval
+        self.message = None
+        self._seq = None
+        self._sent = 0.0
+
+    def due(self, force=False):
+        """
+        Whether an event is due; if so, `message` is the SSE message with
+        the latest state.
+        """
+        now = time.monotonic()
+        if not force and now - self._sent < self.interval:
+            return False
+        state = self.log.read_progress()
+        if state is None or state.get("seq") == self._seq:
+            return False
+        self._seq, self._sent = state.get("seq"), now
+        self.message = f"event: progress\ndata: {json.dumps(state)}\n\n"
+        return True
+
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """
+    Server-Sent Events view of a job's output. Each event's id is the byte
+    offset just past its data, so a reconnecting EventSource resumes exactly
+    where it left off via the Last-Event-ID header (or `?offset=N`).
+    `progress` events carry the progress the run reports, at most every
+    PROGRESS_EVENT_INTERVAL. A final `end` event carries the job's status.
+    """
+    job, log = find_run(job_id)
+    if log is None:
+        return jsonify(error=f"Unknown job: {job_id}"), 404
+    offset = sse_offset(request.headers, request.args)
+    sock = client_socket()
+    progress = ProgressEvents(log)
+
+    def generate():
+        yield "retry: 2000\n\n"
+        for start, data in follow_run(
+            job, log, offset, sock, keepalive=SSE_KEEPALIVE, tick=PROGRESS_EVENT_INTERVAL
+        ):
+            if data is not None:
+                yield sse_chunk(start, data)
+            elif progress.due():
+                yield progress.message
+        if progress.due(force=True):
+            yield progress.message
+        yield sse_end(job, log)
+
+    return Response(generate(), mimetype="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.route("/jobs/<job_id>/progress", methods=["GET"])
+def job_progress(job_id):
+    """
+    The latest progress the run reported: bars, counters and its most
+    recent partial results (404 if it reported none).
+    """
+    _, log = find_run(job_id)
+    if log is None:
+        return jsonify(error=f"Unknown job: {job_id}"), 404
+    state = log.read_progress()
+    if state is None:
+        return jsonify(error=f"Job {job_id} has reported no progress"), 404
+    response = jsonify(state)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@app.route("/jobs/<job_id>/log", methods=["GET"])
+def job_log(job_id):
+    """
+    The raw output file, with HTTP Range support for byte offsets.
+    """
+    _, log = find_run(job_id)
+    if log is None:
+        return jsonify(error=f"Unknown job: {job_id}"), 404
+    return send_file(
+        log.path,
+        mimetype="text/plain",
+        conditional=True,
+        etag=False,
+        max_age=0,
+        download_name=f"{job_id}.log",
     )
 
 
-def stream_subprocess(cmd, workdir):
-    proc = subprocess.Popen(
-        cmd,
-        cwd=workdir,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        bufsize=1,
-        universal_newlines=True,
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    """
+    The structured return value of a finished job. List results are paged
+    with `?offset=N&limit=M` (default limit PAGE_SIZE); the response's
+    "next_offset" is null on the last page.
+    """
+    job, log = find_run(job_id)
+    if log is None:
+        return jsonify(error=f"Unknown job: {job_id}"), 404
+    if not os.path.isfile(log.result_path):
+        if job is not None and not job.finished:
+            return jsonify(error=f"Job {job_id} has not finished yet", status=job.status), 404
+        return jsonify(error=f"Job {job_id} returned no structured result"), 404
+    offset = request.args.get("offset", 0, type=int)
+    limit = request.args.get("limit", PAGE_SIZE, type=int)
+    body = ResultFile(log.result_path).render(offset, limit)
+    return Response(body, mimetype="application/json")
+
+
+def load_profile(job_id):
+    """
+    Return (report, error_response) for a job's profile.
+    """
+    job, log = find_run(job_id)
+    if log is None:
+        return None, (jsonify(error=f"Unknown job: {job_id}"), 404)
+    try:
+        with open(log.profile_prefix + ".json", "r", encoding="utf-8") as fh:
+            return json.load(fh), None
+    except (OSError, ValueError):
+        if job is not None and not job.finished:
+            return None, (jsonify(error=f"Job {job_id} has not finished yet", status=job.status), 404)
+        return None, (jsonify(error=f"Job {job_id} was not profiled"), 404)
+
+
+@app.route("/jobs/<job_id>/profile", methods=["GET"])
+def job_profile(job_id):
+    """
+    The profile of a run submitted with a profiler: its hotspots table,
+    totals and download URLs for the raw artifact (pstats / tracemalloc
+    snapshot / collapsed stacks) and the flamegraph-ready collapsed stacks.
+    """
+    report, error = load_profile(job_id)
+    if error:
+        return error
+    report["files"] = {
+        name: url_for("job_profile_file", job_id=job_id, name=name) for name in report["files"]
+    }
+    return jsonify(report)
+
+
+@app.route("/jobs/<job_id>/profile/<name>", methods=["GET"])
+def job_profile_file(job_id, name):
+    """
+    Download a profile file: `artifact` or `collapsed`.
+    """
+    report, error = load_profile(job_id)
+    if error:
+        return error
+    filename = report["files"].get(name)
+    if filename is None:
+        return jsonify(error=f"Unknown profile file '{name}'"), 404
+    _, log = find_run(job_id)
+    return send_from_directory(
+        log.directory,
+        filename,
+        mimetype="text/plain" if filename.endswith(".collapsed") else "application/octet-stream",
+        as_attachment=True,
     )
-    for line in proc.stdout:
-        yield line
-    proc.stdout.close()
-    return_code = proc.wait()
-    if return_code != 0:
-        yield f"\n[Process exited with code {return_code}]\n"
+
+
+@app.route("/agents", methods=["GET"])
+def list_agents():
+    """
+    Connected worker agents with their slots, tags and running jobs.
+    """
+    hub = get_hub()
+    if hub is None:
+        return jsonify(enabled=False, agents=[])
+    return jsonify(enabled=True, port=hub.port, agents=hub.describe())
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """
+    Prometheus text-format metrics: queue and catalog gauges plus run
+    counters, per-script duration summaries and phase histograms.
+    """
+    queue = get_queue().stats()
+    catalog = get_catalog().stats()
+    gauges = [
+        ("scripter_runs_in_flight", "Runs currently executing.", queue["running"]),
+        ("scripter_queue_depth", "Jobs waiting to run.", queue["queued"]),
+        ("scripter_max_concurrent", "Configured limit of concurrent runs.", queue["max_concurrent"]),
+        ("scripter_catalog_files", "Scripts in the catalog.", catalog["files"]),
+        ("scripter_catalog_scan_seconds", "Duration of the last catalog scan.", catalog["last_scan_seconds"]),
+    ]
+    pages = pagecache.get_cache().stats()
+    gauges.append(("scripter_page_cache_bytes", "Bytes of cached pages and files (with compressed copies).", pages["bytes"]))
+    counters = [
+        ("scripter_page_cache_hits_total", "Page cache hits.", pages["hits"]),
+        ("scripter_page_cache_misses_total", "Page cache misses (renders and file reads).", pages["misses"]),
+    ]
+    gauges.append(("scripter_admission_held_back", "1 while new runs wait for host load to drop.", int(bool(queue["held_back"]))))
+    host = queue.get("host", {})
+    for key, name, text in (
+        ("load_per_cpu", "scripter_host_load_per_cpu", "1-minute load average per CPU."),
+        ("memory_available", "scripter_host_memory_available_ratio", "Fraction of memory available."),
+        ("memory_pressure", "scripter_host_memory_pressure", "Memory pressure (PSI some avg10, %)."),
+    ):
+        if host.get(key) is not None:
+            gauges.append((name, text, host[key]))
+    if "agents" in queue:
+        gauges += [
+            ("scripter_agents", "Connected worker agents.", queue["agents"]["agents"]),
+            ("scripter_agent_slots", "Job slots offered by worker agents.", queue["agents"]["slots"]),
+            ("scripter_agent_slots_busy", "Agent job slots in use.", queue["agents"]["busy"]),
+        ]
+    return Response(run_metrics.render(gauges, counters), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/run", methods=["POST"])
@@ -193,46 +1044,215 @@ def run_script():
       - 'script': e.g. "Category/Subcategory/sample_script.py"
       - 'function': function name
       - plus all parameter fields
-    Build a dispatcher command: python dispatcher.py --script Category/Subcategory/sample_script --function ...
+    Queue it as a job and stream that job's output back. The run belongs to
+    this request: it is cancelled if the client disconnects (see
+    jobs.DISCONNECT_GRACE).
     """
-    full_script = request.form.get("script")  # includes ".py"
-    function = request.form.get("function")
+    payload = dict(payload_from_request(), cancel_on_disconnect=True)
+    job, attached, error = submit_job(payload)
+    if error:
+        body, status = error
+        return Response(body.get_json()["error"] + "\n", status=status, mimetype="text/plain")
+    sock = client_socket()
 
-    folder_part, script_filename = os.path.split(full_script)
-    module_name, _ = os.path.splitext(script_filename)
+    def generate():
+        if attached:
+            yield f"[Attached to identical run {job.id} already in progress]\n"
+        position = get_queue().position(job)
+        if position:
+            yield f"[Queued as job {job.id}, {position} ahead]\n"
+        for _, data in follow_run(job, job.log, 0, sock):
+            yield data.decode("utf-8", errors="replace")
 
-    if folder_part == "":
-        workdir = SCRIPTS_DIR
-        script_module_arg = module_name
-    else:
-        workdir = os.path.join(SCRIPTS_DIR, folder_part)
-        script_module_arg = f"{folder_part}/{module_name}"
+    return Response(generate(), mimetype="text/plain", headers={"X-Job-Id": job.id})
 
-    # Collect parameters
-    params = {
-        key: val
-        for key, val in request.form.items()
-        if key not in ("script", "function")
+
+def parse_time(value, end=False):
+    """
+    A time filter: Unix seconds or an ISO 8601 date/time (local time unless
+    it has an offset); a bare date as `end` means the end of that day. None
+    if empty; ValueError if neither.
+    """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        parsed = datetime.datetime.fromisoformat(value)
+        if end and len(value) == 10:
+            parsed += datetime.timedelta(days=1)
+        return parsed.timestamp()
+
+
+def history_filters():
+    """
+    Filters shared by the history endpoints, from the query string.
+    """
+    return {
+        "script": request.args.get("script") or None,
+        "function": request.args.get("function") or None,
+        "status": request.args.get("status") or None,
+        "since": parse_time(request.args.get("since")),
+        "until": parse_time(request.args.get("until"), end=True),
+        "before": request.args.get("before") or None,
+        "limit": request.args.get("limit", 50, type=int),
     }
 
-    dispatcher_path = os.path.join(os.path.dirname(__file__), "dispatcher.py")
-    full_cmd = [
-        sys.executable,
-        dispatcher_path,
-        "--script",
-        script_module_arg,
-        "--function",
-        function,
-    ]
-    for k, v in params.items():
-        full_cmd.extend([f"--{k}", str(v)])
 
-    def generate():
-        yield f"Running: {' '.join(full_cmd)}\n\n"
-        for out in stream_subprocess(full_cmd, workdir):
-            yield out
+def history_or_error():
+    store = get_history()
+    if store is None:
+        return None, (jsonify(error="Run history is disabled"), 404)
+    return store, None
 
-    return Response(generate(), mimetype="text/plain")
+
+@app.route("/history", methods=["GET"])
+def history_page():
+    """
+    Past runs, filterable by script/function/status/time, and a full-text
+    search over their output. The page loads both from the JSON endpoints.
+    """
+    store = get_history()
+    return render_template("history.html", enabled=store is not None, stats=store.stats() if store else None)
+
+
+@app.route("/history/runs", methods=["GET"])
+def history_runs():
+    """
+    One page of past runs, newest first: `?script=&function=&status=`,
+    `?since=&until=` (Unix seconds or ISO dates), `?limit=`, and
+    `?before=<next>` for the following page.
+    """
+    store, error = history_or_error()
+    if error:
+        return error
+    try:
+        return jsonify(store.runs(**history_filters()))
+    except (BadQuery, ValueError) as e:
+        return jsonify(error=str(e)), 400
+
+
+@app.route("/history/runs/<run_id>", methods=["GET"])
+def history_run(run_id):
+    store, error = history_or_error()
+    if error:
+        return error
+    run = store.get(run_id)
+    if run is None:
+        return jsonify(error=f"Unknown run: {run_id}"), 404
+    return jsonify(run)
+
+
+@app.route("/history/search", methods=["GET"])
+def history_search():
+    """
+    Output lines of past runs matching `?q=`, newest first, with the
+    history filters. Words must all appear (`word*` for a prefix,
+    "quoted phrases" as written); `?syntax=fts` takes an FTS5 query as is.
+    """
+    store, error = history_or_error()
+    if error:
+        return error
+    try:
+        return jsonify(store.search(request.args.get("q", ""), raw=request.args.get("syntax") == "fts",
+                                    **history_filters()))
+    except (BadQuery, ValueError) as e:
+        return jsonify(error=str(e)), 400
+
+
+@app.route("/pipelines", methods=["POST"])
+def create_pipeline():
+    """
+    Start a pipeline (202 Accepted): a JSON spec of named steps whose kwargs
+    may reference other steps' results (see pipelines.py):
+      { "name": ..., "priority": 0, "steps": {
+          "fetch": {"script": ..., "function": ..., "kwargs": {...}},
+          "report": {"script": ..., "function": ...,
+                     "kwargs": {"rows": {"$ref": "fetch.rows"}}, "after": [...]} } }
+    """
+    spec = request.get_json(silent=True)
+    if not isinstance(spec, dict):
+        return jsonify(error="Expected a JSON pipeline spec"), 400
+    try:
+        priority = int(spec.get("priority", 0))
+        pipeline = get_runner().submit(spec, priority)
+    except (PipelineError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    body = pipeline.to_dict()
+    body["status_url"] = url_for("pipeline_status", pipeline_id=pipeline.id)
+    return jsonify(body), 202, {"Location": body["status_url"]}
+
+
+@app.route("/pipelines", methods=["GET"])
+def list_pipelines():
+    limit = min(request.args.get("limit", 50, type=int), 500)
+    return jsonify(pipelines=[pipeline.to_dict() for pipeline in get_runner().list(limit)])
+
+
+@app.route("/pipelines/<pipeline_id>", methods=["GET"])
+def pipeline_status(pipeline_id):
+    """
+    A pipeline's status with each step's job ID, status and timings (queue
+    wait, run time, dispatcher phases).
+    """
+    pipeline = get_runner().get(pipeline_id)
+    if pipeline is None:
+        return jsonify(error=f"Unknown pipeline: {pipeline_id}"), 404
+    return jsonify(pipeline.to_dict())
+
+
+@app.route("/pipelines/<pipeline_id>/resume", methods=["POST"])
+def resume_pipeline(pipeline_id):
+    """
+    Run a failed or cancelled pipeline again from where it stopped; steps
+    that succeeded are not run again. 409 if it is running or succeeded.
+    """
+    try:
+        pipeline = get_runner().resume(pipeline_id)
+    except KeyError:
+        return jsonify(error=f"Unknown pipeline: {pipeline_id}"), 404
+    except PipelineError as e:
+        return jsonify(error=str(e)), 409
+    return jsonify(pipeline.to_dict()), 202
+
+
+@app.route("/pipelines/<pipeline_id>", methods=["DELETE"])
+def cancel_pipeline(pipeline_id):
+    """
+    Cancel a running pipeline (202), or delete a finished one and its
+    checkpoints (200).
+    """
+    runner = get_runner()
+    try:
+        if runner.cancel(pipeline_id):
+            return jsonify(runner.get(pipeline_id).to_dict()), 202
+        runner.delete(pipeline_id)
+    except KeyError:
+        return jsonify(error=f"Unknown pipeline: {pipeline_id}"), 404
+    except PipelineError as e:
+        return jsonify(error=str(e)), 409
+    return jsonify(deleted=pipeline_id)
+
+
+@app.route("/pipelines/<pipeline_id>/steps/<step>/result", methods=["GET"])
+def pipeline_step_result(pipeline_id, step):
+    """
+    The structured result of a step's latest run (see /jobs/<id>/result).
+    """
+    pipeline = get_runner().get(pipeline_id)
+    if pipeline is None or step not in pipeline.steps:
+        return jsonify(error=f"Unknown pipeline step: {pipeline_id}/{step}"), 404
+    job_id = pipeline.steps[step]["job_id"]
+    if job_id is None:
+        return jsonify(error=f"Step {step} has not run"), 404
+    return redirect(url_for("job_result", job_id=job_id, **request.args))
+
+
+# Accept worker agents from startup, not only once the first job is submitted
+# (in the serving process; not in the debug reloader's file watcher).
+if __name__ != "__main__" or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+    if get_hub() is not None:
+        get_queue()
 
 
 if __name__ == "__main__":
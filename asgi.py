@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+ASGI (async) serving mode for Scripter.
+
+Log streams (`/run`, `/jobs/<id>/stream`, `/jobs/<id>/events`) are served
+natively on the event loop: they tail run logs with `RunLog.afollow()` and
+jobs run over asyncio subprocess pipes, so hundreds of concurrent streams
+don't each pin a thread. Every other route (`index`, `select_script`,
+`serve_script_file`, the JSON API, ...) is the regular Flask view, called
+through a small WSGI bridge on a bounded thread pool.
+
+Run with any ASGI server, e.g.:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+or simply `python asgi.py` (needs `pip install uvicorn`).
+"""
+import asyncio
+import os
+import re
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import Headers, MultiDict
+
+import app as web
+from jobs import get_queue
+
+# Threads available to Flask views called through the WSGI bridge.
+WSGI_THREADS = int(os.environ.get("SCRIPTER_WSGI_THREADS", "16"))
+# Request bodies larger than this are spooled to a temp file instead of memory.
+SPOOL_BYTES = int(os.environ.get("SCRIPTER_SPOOL_BYTES", str(1024 * 1024)))
+
+_STREAM_ROUTES = [
+    ("POST", re.compile(r"^/run$"), "run_script"),
+    ("GET", re.compile(r"^/jobs/(?P<job_id>[^/]+)/stream$"), "stream_job"),
+    ("GET", re.compile(r"^/jobs/(?P<job_id>[^/]+)/events$"), "job_events"),
+]
+
+
+def _environ(scope, body):
+    """
+    Build a WSGI environ for an ASGI HTTP scope; `body` is a rewound file.
+    """
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "CONTENT_LENGTH": str(body.seek(0, os.SEEK_END)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    body.seek(0)
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _request_meta(scope):
+    """
+    (headers, query args) of an ASGI scope, with Flask-like lookups.
+    """
+    headers = Headers([(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope.get("headers", [])])
+    args = MultiDict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+    return headers, args
+
+
+def _headers(pairs):
+    return [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in pairs]
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+async def _read_body(receive, limit=None):
+    """
+    Spool the request body into a temp file, chunk by chunk as `receive()`
+    delivers it, so an upload never sits in memory as a whole. Returns None
+    if the client disconnects and raises BodyTooLarge past `limit` bytes.
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    size = 0
+    try:
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                body.close()
+                return None
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if limit is not None and size > limit:
+                raise BodyTooLarge(size)
+            body.write(chunk)
+            if not message.get("more_body"):
+                return body
+    except BaseException:
+        body.close()
+        raise
+
+
+class ScripterASGI:
+    """
+    ASGI application wrapping the Flask app.
+    """
+
+    def __init__(self, flask_app=web.app, threads=WSGI_THREADS):
+        self.flask_app = flask_app
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="wsgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        for method, pattern, name in _STREAM_ROUTES:
+            match = pattern.match(scope["path"])
+            if match and scope["method"] == method:
+                await getattr(self, name)(scope, receive, send, **match.groupdict())
+                return
+        await self.call_wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                get_queue().attach_loop(asyncio.get_running_loop())
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.pool.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _body(self, receive, send):
+        """
+        The request body as a spooled file, or None once a response (413)
+        has been sent or the client went away.
+        """
+        try:
+            return await _read_body(receive, self.flask_app.config.get("MAX_CONTENT_LENGTH"))
+        except BodyTooLarge:
+            await self._respond(send, 413, "Request body too large\n")
+            return None
+
+    # -------------------------------------------------------------------------
+    # WSGI bridge for regular (non-streaming) Flask views
+    # -------------------------------------------------------------------------
+    async def call_wsgi(self, scope, receive, send):
+        body = await self._body(receive, send)
+        if body is None:
+            return
+        with body:
+            await self._call_wsgi(_environ(scope, body), send)
+
+    async def _call_wsgi(self, environ, send):
+        loop = asyncio.get_running_loop()
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = headers
+
+        def call():
+            result = self.flask_app(environ, start_response)
+            return result, iter(result)
+
+        result, chunks = await loop.run_in_executor(self.pool, call)
+        try:
+            chunk = await loop.run_in_executor(self.pool, next, chunks, None)
+            await send({
+                "type": "http.response.start",
+                "status": started["status"],
+                "headers": _headers(started["headers"]),
+            })
+            while chunk is not None:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                chunk = await loop.run_in_executor(self.pool, next, chunks, None)
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(result, "close"):
+                await loop.run_in_executor(self.pool, result.close)
+
+    # -------------------------------------------------------------------------
+    # Native streaming routes
+    # -------------------------------------------------------------------------
+    async def _respond(self, send, status, body, content_type="text/plain; charset=utf-8"):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": _headers([("Content-Type", content_type)]),
+        })
+        await send({"type": "http.response.body", "body": body.encode("utf-8")})
+
+    async def _stream(self, receive, send, chunks, content_type, headers=()):
+        """
+        Send text chunks from an async iterator until it ends or the client
+        disconnects. Each `send` waits for the transport, so a slow client
+        only slows down its own reader of the run log.
+        """
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": _headers([("Content-Type", content_type), *headers]),
+        })
+
+        async def pump():
+            async for text in chunks:
+                await send({"type": "http.response.body", "body": text.encode("utf-8"), "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+
+        async def disconnected():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        pump_task = asyncio.ensure_future(pump())
+        watch_task = asyncio.ensure_future(disconnected())
+        try:
+            await asyncio.wait({pump_task, watch_task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (pump_task, watch_task):
+                task.cancel()
+            await asyncio.gather(pump_task, watch_task, return_exceptions=True)
+            if pump_task.done() and not pump_task.cancelled() and pump_task.exception():
+                raise pump_task.exception()
+
+    def _submit(self, environ):
+        with self.flask_app.request_context(environ):
+            payload = dict(web.payload_from_request(), cancel_on_disconnect=True)
+            job, attached, error = web.submit_job(payload)
+            if error:
+                body, status = error
+                return None, False, (status, body.get_json()["error"])
+        return job, attached, None
+
+    async def run_script(self, scope, receive, send):
+        body = await self._body(receive, send)
+        if body is None:
+            return
+        loop = asyncio.get_running_loop()
+        with body:
+            job, attached, error = await loop.run_in_executor(self.pool, self._submit, _environ(scope, body))
+        if job is None:
+            status, message = error
+            await self._respond(send, status, message + "\n")
+            return
+
+        async def chunks():
+            if attached:
+                yield f"[Attached to identical run {job.id} already in progress]\n"
+            position = get_queue().position(job)
+            if position:
+                yield f"[Queued as job {job.id}, {position} ahead]\n"
+            async for _, data in job.log.afollow(0):
+                if data:
+                    yield data.decode("utf-8", errors="replace")
+
+        with get_queue().following(job):
+            await self._stream(receive, send, chunks(), "text/plain; charset=utf-8", [("X-Job-Id", job.id)])
+
+    async def stream_job(self, scope, receive, send, job_id):
+        job, log = web.find_run(job_id)
+        if log is None:
+            await self._respond(send, 404, f"Unknown job: {job_id}\n")
+            return
+        _, args = _request_meta(scope)
+        offset = max(0, args.get("offset", 0, type=int))
+
+        async def chunks():
+            async for _, data in log.afollow(offset):
+                if data:
+                    yield data.decode("utf-8", errors="replace")
+
+        with get_queue().following(job):
+            await self._stream(receive, send, chunks(), "text/plain; charset=utf-8")
+
+    async def job_events(self, scope, receive, send, job_id):
+        job, log = web.find_run(job_id)
+        if log is None:
+            await self._respond(send, 404, f"Unknown job: {job_id}\n")
+            return
+        offset = web.sse_offset(*_request_meta(scope))
+
+        progress = web.ProgressEvents(log)
+
+        async def chunks():
+            yield "retry: 2000\n\n"
+            idle = 0
+            async for start, data in log.afollow(offset, timeout=web.PROGRESS_EVENT_INTERVAL):
+                if progress.due():
+                    yield progress.message
+                if data:
+                    idle = 0
+                    yield web.sse_chunk(start, data)
+                else:
+                    idle += web.PROGRESS_EVENT_INTERVAL
+                    if idle >= web.SSE_KEEPALIVE:
+                        idle = 0
+                        yield web.sse_chunk(start, data)
+            if progress.due(force=True):
+                yield progress.message
+            yield web.sse_end(job, log)
+
+        with get_queue().following(job):
+            await self._stream(receive, send, chunks(), "text/event-stream", list(web.SSE_HEADERS.items()))
+
+
+application = ScripterASGI()
+
+
+if __name__ == "__main__":
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("The async serving mode needs an ASGI server: pip install uvicorn")
+    uvicorn.run(application, host="0.0.0.0", port=int(os.environ.get("PORT", "5000")))
@@ -0,0 +1,195 @@
+"""
+Batch (fan-out) runs for the dispatcher.
+
+Calls one function over many parameter sets -- a parameter grid or a
+CSV / JSONL file of kwargs -- across a process pool. The target module is
+imported once in the dispatcher and inherited by the forked pool workers.
+Results are printed as each item finishes, tagged with the item number,
+followed by an aggregated summary; the run's progress (see
+`scripter.progress`) counts the items done, succeeded and failed.
+"""
+import contextlib
+import csv
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import paramtypes
+import scripter
+from resultcache import capture_logging
+
+# Longest repr of a return value printed per item.
+MAX_RESULT_CHARS = 500
+# Parameter kinds whose string values (e.g. from a CSV) are converted.
+COERCED_KINDS = ("int", "float", "bool", "json")
+
+
+def expand_grid(grid):
+    """
+    {"a": [1, 2], "b": "x"} -> [{"a": 1, "b": "x"}, {"a": 2, "b": "x"}]
+    Scalars are treated as single-value axes.
+    """
+    if not isinstance(grid, dict):
+        raise ValueError("a parameter grid must be a JSON object of {param: [values]}")
+    names = list(grid)
+    axes = [v if isinstance(v, list) else [v] for v in grid.values()]
+    return [dict(zip(names, combo)) for combo in itertools.product(*axes)]
+
+
+def load_items(path):
+    """
+    Read kwargs from a .csv (header row = parameter names), .jsonl/.ndjson
+    (one object per line) or .json (list of objects, or a grid object) file.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, "r", encoding="utf-8", newline="") as fh:
+        if ext == ".csv":
+            return [
+                {k: v for k, v in row.items() if k is not None and v not in ("", None)}
+                for row in csv.DictReader(fh)
+            ]
+        if ext in (".jsonl", ".ndjson"):
+            return [json.loads(line) for line in fh if line.strip()]
+        if ext == ".json":
+            data = json.load(fh)
+            if isinstance(data, dict):
+                return expand_grid(data)
+            if not isinstance(data, list):
+                raise ValueError("a .json batch file must hold a list of objects or a grid object")
+            return data
+    raise ValueError(f"unsupported batch file type '{ext}' (use .csv, .jsonl or .json)")
+
+
+def coerce_kwargs(kwargs, sig):
+    """
+    Convert string values to the parameter's annotation (int/float/bool
+    and list/dict from JSON), the same conversions the dispatcher applies to
+    command-line flags.
+    """
+    out = {}
+    for name, value in kwargs.items():
+        param = sig.parameters.get(name)
+        if param is not None and isinstance(value, str) and paramtypes.kind(param.annotation) in COERCED_KINDS:
+            value = paramtypes.parser(param.annotation)(value)
+        out[name] = value
+    return out
+
+
+def _call_item(module_name, func_name, index, kwargs):
+    """
+    Runs in a pool worker: call the function with its output (prints and
+    log records) captured.
+    """
+    func = getattr(sys.modules[module_name], func_name)
+    buf = io.StringIO()
+    started = time.perf_counter()
+    ok, result, error = True, None, None
+    with capture_logging(buf.write, exclusive=True), \
+            contextlib.redirect_stdout(buf), contextlib.redirect_stderr(buf):
+        try:
+            value = func(**kwargs)
+            result = None if value is None else repr(value)[:MAX_RESULT_CHARS]
+        except Exception:
+            ok = False
+            error = traceback.format_exc()
+    return {
+        "index": index,
+        "ok": ok,
+        "result": result,
+        "error": error,
+        "output": buf.getvalue(),
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def _print_item(item):
+    tag = f"[item {item['index']}]"
+    lines = item["output"].splitlines()
+    if item["error"]:
+        lines += item["error"].rstrip().splitlines()
+    for line in lines:
+        print(f"{tag} {line}")
+    if item["ok"]:
+        suffix = f" -> {item['result']}" if item["result"] is not None else ""
+        print(f"{tag} OK in {item['seconds']:.3f}s{suffix}", flush=True)
+    else:
+        print(f"{tag} FAILED in {item['seconds']:.3f}s", flush=True)
+
+
+def _finish_item(item, finished, total):
+    _print_item(item)
+    finished.append(item)
+    progress = scripter.current_progress()
+    progress.count("succeeded" if item["ok"] else "failed")
+    progress.update(len(finished), total=total, bar="batch")
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def run_batch(module, func_name, sig, base_kwargs, items, parallel, label):
+    """
+    Run `module.func_name` once per item (merged over `base_kwargs`) on a
+    pool of `parallel` processes. Returns the dispatcher exit code.
+    """
+    parallel = max(1, parallel or os.cpu_count() or 1)
+    print(f"=== Batch: {label} over {len(items)} items (parallel={parallel})", flush=True)
+
+    started = time.perf_counter()
+    finished = []
+    jobs = []
+    for index, item in enumerate(items, start=1):
+        try:
+            if not isinstance(item, dict):
+                raise TypeError(f"an item must be an object of {{parameter: value}}, not {type(item).__name__}")
+            kwargs = coerce_kwargs(dict(base_kwargs, **item), sig)
+            sig.bind(**kwargs)
+        except (TypeError, ValueError) as e:
+            failed = {"index": index, "ok": False, "result": None, "output": "",
+                      "error": f"Invalid parameters {item}: {e}", "seconds": 0.0}
+            _finish_item(failed, finished, len(items))
+            continue
+        jobs.append((index, kwargs))
+
+    # Fork so workers inherit the already-imported script module.
+    ctx = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(max_workers=min(parallel, max(1, len(jobs))), mp_context=ctx) as pool:
+        futures = {
+            pool.submit(_call_item, module.__name__, func_name, index, kwargs): index
+            for index, kwargs in jobs
+        }
+        for future in as_completed(futures):
+            try:
+                item = future.result()
+            except Exception as e:
+                # The worker itself died (e.g. killed, unpicklable result).
+                item = {"index": futures[future], "ok": False, "result": None, "output": "",
+                        "error": f"{type(e).__name__}: {e}", "seconds": 0.0}
+            _finish_item(item, finished, len(items))
+
+    wall = time.perf_counter() - started
+    failed = sorted(i["index"] for i in finished if not i["ok"])
+    timings = sorted(i["seconds"] for i in finished if i["seconds"])
+    print(
+        f"=== Batch summary: {len(finished)} items, {len(finished) - len(failed)} succeeded, "
+        f"{len(failed)} failed in {wall:.2f}s (parallel={parallel})"
+    )
+    if timings:
+        print(
+            f"    per item: min {timings[0]:.3f}s  mean {sum(timings) / len(timings):.3f}s  "
+            f"p95 {_percentile(timings, 95):.3f}s  max {timings[-1]:.3f}s"
+        )
+    if failed:
+        print(f"    failed items: {', '.join(map(str, failed))}")
+    sys.stdout.flush()
+    return 1 if failed else 0
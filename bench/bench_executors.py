@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Compare per-run latency of the two executors:
+  - subprocess: one cold `python dispatcher.py ...` per run
+  - pool: a job handed to the pre-forked warm worker pool
+
+Usage:
+    python bench/bench_executors.py --runs 30 --preload boto3
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from app import SCRIPTS_DIR, stream_subprocess  # noqa: E402
+from workers import WorkerPool  # noqa: E402
+
+
+def _summary(name, samples):
+    samples = sorted(samples)
+    p95 = samples[max(0, int(len(samples) * 0.95) - 1)]
+    print(
+        f"{name:<11} runs={len(samples):<4} "
+        f"mean={statistics.mean(samples) * 1000:8.1f} ms  "
+        f"p50={statistics.median(samples) * 1000:8.1f} ms  "
+        f"p95={p95 * 1000:8.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--script", default="AWS/Lambda/sample_script")
+    parser.add_argument("--function", default="add")
+    parser.add_argument("--args", nargs="*", default=["--a", "1", "--b", "2"])
+    parser.add_argument("--preload", default="", help="Comma-separated modules for the pool to preload.")
+    cli = parser.parse_args()
+
+    folder, _ = os.path.split(cli.script)
+    workdir = os.path.join(SCRIPTS_DIR, folder)
+    cmd = [
+        sys.executable,
+        os.path.join(BASE_DIR, "dispatcher.py"),
+        "--script", cli.script,
+        "--function", cli.function,
+    ] + cli.args
+
+    subprocess_samples = []
+    for _ in range(cli.runs):
+        started = time.perf_counter()
+        for _ in stream_subprocess(cmd, workdir):
+            pass
+        subprocess_samples.append(time.perf_counter() - started)
+
+    socket_path = os.path.join(BASE_DIR, ".scripter", f"bench-{os.getpid()}.sock")
+    pool = WorkerPool(socket_path, size=2, preload=[m for m in cli.preload.split(",") if m])
+    pool.start()
+    try:
+        pool_samples = []
+        for _ in range(cli.runs):
+            started = time.perf_counter()
+            sock = pool.submit(cli.script, cli.function, cli.args, workdir)
+            for _ in pool.stream(sock):
+                pass
+            pool_samples.append(time.perf_counter() - started)
+    finally:
+        pool.stop()
+
+    _summary("subprocess", subprocess_samples)
+    _summary("pool", pool_samples)
+    print(f"speedup (p50): {statistics.median(subprocess_samples) / statistics.median(pool_samples):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Measure the run history (history.py): how fast finished runs are recorded
+and indexed, and full-text search latency over their output.
+
+Writes `--runs` synthetic run logs of `--lines` lines each into a temporary
+state folder, records them, then times a set of searches (a rare token, a
+common word, a phrase, a prefix, and a search filtered by script).
+
+Usage:
+    python bench/bench_history.py --runs 100 --lines 10000
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from history import History  # noqa: E402
+from runlog import RunLog  # noqa: E402
+
+WORDS = (
+    "request processed bucket object upload download retry timeout connection user account region "
+    "instance lambda invoke queue message batch record error warning info debug cache hit miss"
+).split()
+
+
+def _write_runs(runs_dir, runs, lines, seed=1):
+    rng = random.Random(seed)
+    now = time.time()
+    metas = []
+    for run in range(runs):
+        run_id = f"bench{run:06d}"
+        log = RunLog.create(run_id, runs_dir)
+        out = []
+        for number in range(lines):
+            words = " ".join(rng.choice(WORDS) for _ in range(8))
+            out.append(f"2026-01-01 00:00:00 INFO: step {number} {words} id={rng.getrandbits(48):x}\n")
+        if run == runs // 2:
+            out[lines // 2] = "ERROR: needle-in-haystack checksum mismatch for shard 7\n"
+        log.append("".join(out))
+        log.close({
+            "id": run_id,
+            "script": f"bench/script{run % 10}.py",
+            "function": "work",
+            "params": {"run": run},
+            "status": "succeeded",
+            "exit_code": 0,
+            "created_at": now - (runs - run),
+            "started_at": now - (runs - run),
+            "finished_at": now - (runs - run) + 1,
+        })
+        metas.append(log.meta)
+    return metas
+
+
+def _time(search, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = search()
+        samples.append(time.perf_counter() - started)
+    return samples, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--lines", type=int, default=10000, help="Lines per run.")
+    parser.add_argument("--repeat", type=int, default=20)
+    cli = parser.parse_args()
+
+    state = tempfile.mkdtemp(prefix="scripter-history-bench-")
+    try:
+        runs_dir = os.path.join(state, "runs")
+        # Created first, so it doesn't backfill the runs written below.
+        history = History(os.path.join(state, "history.db"), runs_dir)
+        metas = _write_runs(runs_dir, cli.runs, cli.lines)
+        started = time.perf_counter()
+        for meta in metas:
+            history.record(meta)
+        history.flush()
+        elapsed = time.perf_counter() - started
+        total = cli.runs * cli.lines
+        print(f"recorded {cli.runs} runs / {total} lines in {elapsed:.2f}s ({total / elapsed:,.0f} lines/s)")
+        print(f"database {os.path.getsize(os.path.join(state, 'history.db')) / 1024 ** 2:.1f} MiB")
+
+        searches = {
+            "rare token": lambda: history.search("needle"),
+            "common word": lambda: history.search("timeout"),
+            "phrase": lambda: history.search('"checksum mismatch"'),
+            "prefix": lambda: history.search("needle*"),
+            "two words": lambda: history.search("retry lambda"),
+            "by script": lambda: history.search("timeout", script="bench/script3.py"),
+            "runs page": lambda: history.runs(function="work"),
+        }
+        for name, search in searches.items():
+            samples, result = _time(search, cli.repeat)
+            found = len(result.get("hits", result.get("runs", [])))
+            print(
+                f"{name:<12} p50={statistics.median(samples) * 1000:7.2f} ms  "
+                f"max={max(samples) * 1000:7.2f} ms  results={found}"
+            )
+    finally:
+        shutil.rmtree(state, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
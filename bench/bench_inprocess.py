@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Compare the throughput of in-process runs with subprocess runs:
+  - subprocess: every run starts `python dispatcher.py ...`
+  - in-process: runs call the function on the server's thread pool (see
+    inprocess.py); the function is listed in SCRIPTER_IN_PROCESS here, so
+    the script needs no `@in_process` decorator
+
+Both go through a JobQueue with the same concurrency limit, so the numbers
+include queueing, output capture and the run log. Reports runs per second
+and per-run latency (submit to finished).
+
+Usage:
+    python bench/bench_inprocess.py --runs 200 --concurrency 4
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+
+def _run_all(queue, script, function, params, runs):
+    started = time.perf_counter()
+    submitted = [queue.submit(script, function, params) for _ in range(runs)]
+    while not all(job.finished for job in submitted):
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - started
+    failed = sum(1 for job in submitted if job.exit_code != 0)
+    return elapsed, [job.finished_at - job.created_at for job in submitted], failed, submitted
+
+
+def _summary(name, runs, elapsed, samples, failed):
+    samples = sorted(samples)
+    p95 = samples[max(0, int(len(samples) * 0.95) - 1)]
+    print(
+        f"{name:<11} runs={runs:<5} {runs / elapsed:8.1f} runs/s  "
+        f"p50={statistics.median(samples) * 1000:8.1f} ms  "
+        f"p95={p95 * 1000:8.1f} ms  failed={failed}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--script", default="AWS/Lambda/sample_script.py")
+    parser.add_argument("--function", default="add")
+    parser.add_argument("--params", nargs="*", default=["a=1", "b=2"], help="name=value pairs")
+    cli = parser.parse_args()
+
+    os.environ["SCRIPTER_IN_PROCESS"] = f"{cli.script}:{cli.function}"
+    os.environ.setdefault("SCRIPTER_IN_PROCESS_THREADS", str(cli.concurrency))
+    import executors  # noqa: E402
+    from jobs import JobQueue  # noqa: E402
+
+    params = dict(pair.split("=", 1) for pair in cli.params)
+    results = {}
+    for name, execute in (("subprocess", executors.run_subprocess), ("in-process", executors.execute)):
+        queue = JobQueue(max_concurrent=cli.concurrency, max_queued=cli.runs, execute=execute, coalesce=False)
+        # One warm-up run (catalog scan, module import, pool threads).
+        _run_all(queue, cli.script, cli.function, params, 1)
+        elapsed, samples, failed, submitted = _run_all(queue, cli.script, cli.function, params, cli.runs)
+        if name == "in-process" and not submitted[0].in_process:
+            sys.exit(f"{cli.script}:{cli.function} cannot run in-process (limits, @cached or @requires?)")
+        results[name] = (elapsed, samples, failed)
+
+    for name, (elapsed, samples, failed) in results.items():
+        _summary(name, cli.runs, elapsed, samples, failed)
+    print(f"throughput: {results['subprocess'][0] / results['in-process'][0]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Measure the response cache for pages and files (pagecache.py):
+  - uncached: every request renders its template (the cache is bypassed)
+  - cached: rendered once, then served from the LRU (compressed if accepted)
+  - revalidated: the client sends its ETag and gets 304
+
+Requests go through the Flask test client, so the numbers are the app's own
+cost per request (no network). Also reports the bytes sent per encoding.
+
+Usage:
+    python bench/bench_pages.py --requests 500
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+import pagecache  # noqa: E402
+from app import app  # noqa: E402
+from catalog import get_catalog  # noqa: E402
+
+
+def _time(client, path, requests, headers):
+    samples = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = client.get(path, headers=headers)
+        response.get_data()
+        samples.append(time.perf_counter() - started)
+    return samples, response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--script", default="AWS/Lambda/sample_script.py", help="Script whose run page is fetched.")
+    cli = parser.parse_args()
+
+    client = app.test_client()
+    get_catalog().refresh(force=True)
+    paths = ["/", f"/select/{cli.script}", "/docs", "/static/dp.png"]
+    cache = pagecache.get_cache()
+    for path in paths:
+        print(path)
+        cache.max_bytes = 0  # entries are built but never kept
+        cache.clear()
+        samples, response = _time(client, path, cli.requests, {"Accept-Encoding": "gzip, br"})
+        print(f"  uncached         p50={statistics.median(samples) * 1000:7.3f} ms  {len(response.data):>8} B")
+        cache.max_bytes = pagecache.MAX_BYTES
+        for encoding in ("identity", "gzip", "br") if pagecache.brotli else ("identity", "gzip"):
+            samples, response = _time(client, path, cli.requests, {"Accept-Encoding": encoding})
+            coding = response.headers.get("Content-Encoding", "identity")
+            print(f"  cached {coding:<9} p50={statistics.median(samples) * 1000:7.3f} ms  {len(response.data):>8} B")
+        etag = client.get(path, headers={"Accept-Encoding": "gzip"}).headers["ETag"]
+        samples, response = _time(client, path, cli.requests, {"Accept-Encoding": "gzip", "If-None-Match": etag})
+        print(f"  revalidated      p50={statistics.median(samples) * 1000:7.3f} ms  status {response.status_code}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for Scripter.
+
+Generates synthetic `scripts/` trees (100, 1k and 10k files by default, plus
+a deeply nested one; every 10th module has slow "heavy" top-level imports
+that browsing must never trigger) and measures, per tree:
+  - index.*   `/` latency (catalog summary): cold, warm, and after a
+              restart with the persisted catalog cache
+  - tree.*    `/tree` first page of the root folder, and a 304 revalidation
+  - search.*  `/search` for a function name prefix and a fuzzy query
+  - select.*  `/select/<path>` latency (build_funcs_meta)
+  - run.*     `/run` of a no-op function: time to first byte, to the
+              function's first output, and total
+  - stream.*  sustained log throughput through `stream_subprocess`
+              (smallest tree only)
+
+Each tree is measured in fresh processes (SCRIPTER_SCRIPTS_DIR /
+SCRIPTER_STATE_DIR point at the synthetic tree), driving the Flask app
+in-process. Results are JSON; `--compare` prints the change against a stored
+baseline and exits with 1 if any metric regressed beyond `--threshold`.
+
+Usage:
+    python bench/bench_suite.py --save-baseline bench/baseline.json
+    python bench/bench_suite.py --compare bench/baseline.json --output bench/latest.json
+    python bench/bench_suite.py --sizes 100,1000 --repeat 10
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FUNCTIONS_PER_FILE = 5
+HEAVY_EVERY = 10
+DEEP_DEPTH = 20
+
+HEAVY_IMPORTS = """\
+import time
+time.sleep(0.2)  # simulated heavy import (boto3, pandas, ...)
+import decimal, email.mime.multipart, http.server, xml.dom.minidom  # noqa
+"""
+
+TOOLS_SCRIPT = '''\
+import sys
+
+
+def noop():
+    """
+    Does nothing but print one line.
+    """
+    print("noop-output")
+
+
+def spew(lines: int = 100000, width: int = 100):
+    """
+    Write `lines` lines of `width` characters as fast as possible.
+    """
+    row = "x" * (width - 1) + "\\n"
+    write = sys.stdout.write
+    for _ in range(lines):
+        write(row)
+'''
+
+
+# -----------------------------------------------------------------------------
+# Synthetic trees
+# -----------------------------------------------------------------------------
+def _module_source(index, heavy):
+    parts = [f'"""\nSynthetic module {index}.\n"""\n']
+    if heavy:
+        parts.append(HEAVY_IMPORTS)
+    for f in range(FUNCTIONS_PER_FILE):
+        parts.append(
+            f'\n\ndef func_{f}(name: str, count: int = {f}, ratio: float = 0.5, tag="t{index}"):\n'
+            f'    """\n    Function {f} of module {index}.\n    """\n'
+            f"    return name * count\n"
+        )
+    return "".join(parts)
+
+
+def _folder_for(index, files):
+    # One folder level per decimal digit, so leaf folders hold ~10 files:
+    # index 523 of 1000 -> dir_5/dir_2/
+    digits = str(index).zfill(len(str(max(files - 1, 1))))
+    return os.path.join(*[f"dir_{d}" for d in digits[:-1]]) if len(digits) > 1 else ""
+
+
+def generate_tree(root, files, deep=False):
+    """
+    Write `files` synthetic modules (plus tools.py) under `root`.
+    Returns the relative path of one module, used for /select.
+    """
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, "tools.py"), "w") as fh:
+        fh.write(TOOLS_SCRIPT)
+    sample = None
+    for index in range(files):
+        if deep:
+            folder = os.path.join(*[f"level_{d}" for d in range(index % DEEP_DEPTH + 1)])
+        else:
+            folder = _folder_for(index, files)
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+        relpath = os.path.join(folder, f"module_{index}.py")
+        with open(os.path.join(root, relpath), "w") as fh:
+            fh.write(_module_source(index, heavy=index % HEAVY_EVERY == 0))
+        if index % HEAVY_EVERY == 0:
+            sample = relpath
+    return sample.replace(os.sep, "/")
+
+
+# -----------------------------------------------------------------------------
+# Measurements (run inside a child process, see `--case`)
+# -----------------------------------------------------------------------------
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+def _p(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))]
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+
+def measure_web(sample, repeat):
+    import app as web
+
+    client = web.app.test_client()
+    out = {}
+
+    elapsed, resp = _timed(lambda: client.get("/"))
+    assert resp.status_code == 200, resp.status_code
+    out["index.first_ms"] = _ms(elapsed)
+    warm = [_timed(lambda: client.get("/"))[0] for _ in range(repeat)]
+    out["index.warm_p50_ms"] = _ms(statistics.median(warm))
+    out["index.warm_p95_ms"] = _ms(_p(warm, 95))
+
+    elapsed, resp = _timed(lambda: client.get("/tree"))
+    assert resp.status_code == 200, resp.status_code
+    out["tree.first_ms"] = _ms(elapsed)
+    etag = resp.headers["ETag"]
+    warm = [_timed(lambda: client.get("/tree"))[0] for _ in range(repeat)]
+    out["tree.warm_p50_ms"] = _ms(statistics.median(warm))
+    revalidate = [_timed(lambda: client.get("/tree", headers={"If-None-Match": etag}))[0] for _ in range(repeat)]
+    out["tree.not_modified_p50_ms"] = _ms(statistics.median(revalidate))
+
+    for name, query in (("prefix", "func_3"), ("fuzzy", "fnc4")):
+        warm = [_timed(lambda: client.get("/search", query_string={"q": query}))[0] for _ in range(repeat)]
+        out[f"search.{name}_p50_ms"] = _ms(statistics.median(warm))
+
+    url = f"/select/{sample}"
+    elapsed, resp = _timed(lambda: client.get(url))
+    assert resp.status_code == 200, resp.status_code
+    out["select.first_ms"] = _ms(elapsed)
+    warm = [_timed(lambda: client.get(url))[0] for _ in range(repeat)]
+    out["select.warm_p50_ms"] = _ms(statistics.median(warm))
+    out["select.warm_p95_ms"] = _ms(_p(warm, 95))
+
+    ttfb, first_output, total = [], [], []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        resp = client.post("/run", data={"script": "tools", "function": "noop"}, buffered=False)
+        seen_first = seen_output = None
+        for chunk in resp.response:
+            now = time.perf_counter()
+            if seen_first is None:
+                seen_first = now
+            if seen_output is None and b"noop-output" in (chunk if isinstance(chunk, bytes) else chunk.encode()):
+                seen_output = now
+        resp.close()
+        end = time.perf_counter()
+        ttfb.append(seen_first - started)
+        first_output.append((seen_output or end) - started)
+        total.append(end - started)
+    out["run.ttfb_p50_ms"] = _ms(statistics.median(ttfb))
+    out["run.first_output_p50_ms"] = _ms(statistics.median(first_output))
+    out["run.total_p50_ms"] = _ms(statistics.median(total))
+    out["run.total_p95_ms"] = _ms(_p(total, 95))
+    return out
+
+
+def measure_stream(lines, width):
+    from executors import SCRIPTS_DIR, build_command, stream_subprocess
+
+    cmd = build_command("tools", "spew", ["--lines", str(lines), "--width", str(width)])
+    started = time.perf_counter()
+    received = 0
+    for chunk in stream_subprocess(cmd, SCRIPTS_DIR):
+        received += len(chunk)
+    elapsed = time.perf_counter() - started
+    return {
+        "stream.lines_per_s": round(lines / elapsed),
+        "stream.mb_per_s": round(received / elapsed / 1e6, 2),
+    }
+
+
+# -----------------------------------------------------------------------------
+# Orchestration
+# -----------------------------------------------------------------------------
+UNITS = {"_ms": ("ms", "lower"), "lines_per_s": ("lines/s", "higher"), "mb_per_s": ("MB/s", "higher")}
+
+
+def _describe(name, value):
+    for suffix, (unit, better) in UNITS.items():
+        if name.endswith(suffix):
+            return {"value": value, "unit": unit, "better": better}
+    return {"value": value, "unit": "", "better": "lower"}
+
+
+def _child(case, tree, state, **options):
+    env = dict(os.environ, SCRIPTER_SCRIPTS_DIR=tree, SCRIPTER_STATE_DIR=state)
+    cmd = [sys.executable, os.path.abspath(__file__), "--case", case, "--tree", tree]
+    for key, value in options.items():
+        cmd += [f"--{key}", str(value)]
+    proc = subprocess.run(cmd, env=env, cwd=BASE_DIR, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"benchmark case '{case}' failed:\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def run_suite(cli):
+    trees = [(f"files_{n}", n, False) for n in cli.sizes]
+    if cli.deep:
+        trees.append((f"deep_{cli.deep}", cli.deep, True))
+
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="scripter-bench-")
+    try:
+        for position, (name, files, deep) in enumerate(trees):
+            tree = os.path.join(workdir, name, "scripts")
+            state = os.path.join(workdir, name, "state")
+            started = time.perf_counter()
+            sample = generate_tree(tree, files, deep)
+            print(f"[{name}] generated in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+            cold = _child("web", tree, state, sample=sample, repeat=cli.repeat)
+            # Second process: the catalog cache persisted by the first one.
+            restart = _child("web", tree, state, sample=sample, repeat=cli.repeat)
+            metrics = dict(cold)
+            metrics["index.cold_ms"] = metrics.pop("index.first_ms")
+            metrics["select.cold_ms"] = metrics.pop("select.first_ms")
+            metrics["index.restart_ms"] = restart["index.first_ms"]
+            metrics["select.restart_ms"] = restart["select.first_ms"]
+            if position == 0:
+                metrics.update(_child("stream", tree, state, lines=cli.stream_lines, width=cli.stream_width))
+            for metric, value in sorted(metrics.items()):
+                results[f"{name}/{metric}"] = _describe(metric, value)
+            print(f"[{name}] done", file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, threshold, min_ms):
+    """
+    Print a comparison table; returns the names of regressed metrics.
+    Millisecond metrics must also move by at least `min_ms` to count, so
+    jitter on sub-millisecond timings isn't reported.
+    """
+    regressions = []
+    print(f"{'metric':<44} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name, current in results.items():
+        before = baseline.get(name)
+        if before is None or not before["value"]:
+            print(f"{name:<44} {'-':>12} {current['value']:>12} {'new':>9}")
+            continue
+        change = (current["value"] - before["value"]) / before["value"]
+        worse = change > threshold if current["better"] == "lower" else change < -threshold
+        if current["unit"] == "ms" and abs(current["value"] - before["value"]) < min_ms:
+            worse = False
+        flag = "  REGRESSION" if worse else ""
+        print(f"{name:<44} {before['value']:>12} {current['value']:>12} {change:>+8.1%}{flag}")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000,10000", help="Comma-separated tree sizes (files).")
+    parser.add_argument("--deep", type=int, default=200, help="Files in the deeply nested tree (0 = skip).")
+    parser.add_argument("--repeat", type=int, default=20, help="Samples per warm measurement.")
+    parser.add_argument("--stream-lines", type=int, default=200000)
+    parser.add_argument("--stream-width", type=int, default=100)
+    parser.add_argument("--output", help="Write results JSON here.")
+    parser.add_argument("--save-baseline", help="Write results JSON as the new baseline.")
+    parser.add_argument("--compare", help="Baseline JSON to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Relative change counted as a regression.")
+    parser.add_argument("--min-ms", type=float, default=2.0, help="Smallest timing change counted as a regression.")
+    # Internal: run one measurement inside a child process.
+    parser.add_argument("--case", choices=("web", "stream"), help=argparse.SUPPRESS)
+    parser.add_argument("--tree", help=argparse.SUPPRESS)
+    parser.add_argument("--sample", help=argparse.SUPPRESS)
+    parser.add_argument("--lines", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--width", type=int, help=argparse.SUPPRESS)
+    cli = parser.parse_args()
+
+    if cli.case:
+        sys.path.insert(0, BASE_DIR)
+        if cli.case == "web":
+            out = measure_web(cli.sample, cli.repeat)
+        else:
+            out = measure_stream(cli.lines, cli.width)
+        print(json.dumps(out))
+        return 0
+
+    cli.sizes = [int(n) for n in cli.sizes.split(",") if n]
+    results = run_suite(cli)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+    for path in filter(None, (cli.output, cli.save_baseline)):
+        with open(path, "w") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"Results written to {path}", file=sys.stderr)
+
+    if cli.compare:
+        with open(cli.compare) as fh:
+            baseline = json.load(fh)["results"]
+        regressions = compare(results, baseline, cli.threshold, cli.min_ms)
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed by more than {cli.threshold:.0%}")
+            return 1
+        return 0
+
+    for name, metric in results.items():
+        print(f"{name:<44} {metric['value']:>12} {metric['unit']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
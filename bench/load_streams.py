@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Load test for the async serving mode: hold N concurrent log streams on the
+ASGI app and report thread count and memory while they are all attached.
+
+The ASGI application is driven in-process (no HTTP server needed): `--jobs`
+long-running jobs are started, then `--streams` SSE viewers are spread over
+them and kept open until every job finishes.
+
+Usage:
+    python bench/load_streams.py --streams 500 --jobs 10 --repeat 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from asgi import application  # noqa: E402
+
+
+def _scope(method, path, query=b"", headers=()):
+    return {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": query,
+        "headers": list(headers),
+        "http_version": "1.1",
+        "scheme": "http",
+        "server": ("bench", 80),
+        "client": ("127.0.0.1", 0),
+    }
+
+
+async def _request(scope, body=b""):
+    """
+    Call the app once and collect the whole response body.
+    """
+    received = []
+    sent = False
+    done = asyncio.Event()
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            received.append(message.get("body", b""))
+            if not message.get("more_body"):
+                done.set()
+
+    await application(scope, receive, send)
+    done.set()
+    return b"".join(received)
+
+
+async def _lifespan():
+    """
+    Start the app's lifespan; returns a coroutine function that shuts it down.
+    """
+    queue = asyncio.Queue()
+    await queue.put({"type": "lifespan.startup"})
+
+    async def send(message):
+        pass
+
+    task = asyncio.ensure_future(application({"type": "lifespan"}, queue.get, send))
+    await asyncio.sleep(0)
+
+    async def shutdown():
+        await queue.put({"type": "lifespan.shutdown"})
+        await task
+
+    return shutdown
+
+
+async def main(cli):
+    shutdown = await _lifespan()
+    tracemalloc.start()
+    threads_before = threading.active_count()
+
+    form = f"script={cli.script}&function={cli.function}&repeat={cli.repeat}".encode()
+    job_ids = []
+    for _ in range(cli.jobs):
+        body = await _request(
+            _scope("POST", "/jobs", headers=[(b"content-type", b"application/x-www-form-urlencoded")]),
+            form,
+        )
+        job_ids.append(json.loads(body)["id"])
+
+    peak_threads = 0
+    streams_done = 0
+
+    async def viewer(job_id):
+        nonlocal streams_done
+        body = await _request(_scope("GET", f"/jobs/{job_id}/events"))
+        streams_done += 1
+        return len(body)
+
+    async def sample():
+        nonlocal peak_threads
+        while streams_done < cli.streams:
+            peak_threads = max(peak_threads, threading.active_count())
+            await asyncio.sleep(0.1)
+
+    started = time.perf_counter()
+    sampler = asyncio.ensure_future(sample())
+    sizes = await asyncio.gather(*(viewer(job_ids[i % cli.jobs]) for i in range(cli.streams)))
+    await sampler
+    elapsed = time.perf_counter() - started
+
+    _, peak_heap = tracemalloc.get_traced_memory()
+    print(f"streams held concurrently : {cli.streams} over {cli.jobs} jobs")
+    print(f"wall time                 : {elapsed:.1f} s")
+    print(f"bytes delivered           : {sum(sizes)}")
+    print(f"threads before / peak     : {threads_before} / {peak_threads}")
+    print(f"peak traced heap          : {peak_heap / 1024 / 1024:.1f} MiB")
+    print(f"peak RSS                  : {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+    await shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=500)
+    parser.add_argument("--jobs", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=6, help="greet() iterations per job (0.5 s each).")
+    parser.add_argument("--script", default="AWS/Lambda/sample_script.py")
+    parser.add_argument("--function", default="greet")
+    asyncio.run(main(parser.parse_args()))
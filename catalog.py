@@ -0,0 +1,633 @@
+"""
+Import-free catalog of the scripts under `scripts/`.
+
+Function names, signatures, annotations, defaults and docstrings are pulled
+from each file's AST, so browsing the dashboard never executes script code.
+Parsed entries are cached per file (keyed on mtime + content hash) and
+persisted to disk, so a restarted server starts warm and only re-parses the
+files that actually changed. Folder listings and the name search index are
+derived from the entries once per catalog version.
+"""
+import ast
+import bisect
+import collections
+import hashlib
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.environ.get("SCRIPTER_SCRIPTS_DIR", os.path.join(BASE_DIR, "scripts"))
+STATE_DIR = os.environ.get("SCRIPTER_STATE_DIR", os.path.join(BASE_DIR, ".scripter"))
+CACHE_PATH = os.path.join(STATE_DIR, "catalog.json")
+
+# Bump whenever the shape of a parsed entry changes; stale caches are dropped.
+CACHE_FORMAT = 2
+
+# Minimum number of seconds between two full directory scans.
+SCAN_INTERVAL = float(os.environ.get("SCRIPTER_SCAN_INTERVAL", "1.0"))
+
+# Entries per page of a folder listing, and the most search results returned.
+LISTING_PAGE_SIZE = 200
+SEARCH_LIMIT = 50
+
+# Annotation names we can map back to real types without importing anything.
+BUILTIN_ANNOTATIONS = {
+    "int": int,
+    "float": float,
+    "str": str,
+    "bool": bool,
+    "bytes": bytes,
+    "list": list,
+    "dict": dict,
+}
+
+
+class SourceDefault:
+    """
+    Placeholder for a default value that is not a literal (e.g. `os.getcwd()`).
+    It renders as its source text; callers should let the function's own
+    default apply instead of passing it through.
+    """
+
+    def __init__(self, source):
+        self.source = source
+
+    def __repr__(self):
+        return self.source
+
+
+def _is_script(entry):
+    return entry.endswith(".py") and not entry.startswith("__")
+
+
+def _is_folder(entry):
+    return not entry.startswith("__")
+
+
+def _parse_default(node):
+    if node is None:
+        return None
+    try:
+        value = ast.literal_eval(node)
+        # Only keep values that survive the JSON cache unchanged.
+        if json.loads(json.dumps(value)) == value:
+            return {"value": value}
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        pass
+    return {"source": ast.unparse(node)}
+
+
+def _parse_params(args):
+    params = []
+    positional = args.posonlyargs + args.args
+    defaults = [None] * (len(positional) - len(args.defaults)) + list(args.defaults)
+    for idx, (arg, default) in enumerate(zip(positional, defaults)):
+        kind = "POSITIONAL_ONLY" if idx < len(args.posonlyargs) else "POSITIONAL_OR_KEYWORD"
+        params.append((arg, kind, default))
+    if args.vararg:
+        params.append((args.vararg, "VAR_POSITIONAL", None))
+    for arg, default in zip(args.kwonlyargs, args.kw_defaults):
+        params.append((arg, "KEYWORD_ONLY", default))
+    if args.kwarg:
+        params.append((args.kwarg, "VAR_KEYWORD", None))
+
+    return [
+        {
+            "name": arg.arg,
+            "kind": kind,
+            "annotation": ast.unparse(arg.annotation) if arg.annotation else None,
+            "default": _parse_default(default),
+        }
+        for arg, kind, default in params
+    ]
+
+
+def _top_level_functions(body):
+    """
+    Yield function definitions that end up as module attributes, including
+    those nested in top-level `if` / `try` blocks.
+    """
+    for node in body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            yield node
+        elif isinstance(node, ast.If):
+            yield from _top_level_functions(node.body)
+            yield from _top_level_functions(node.orelse)
+        elif isinstance(node, ast.Try):
+            for block in (node.body, node.orelse, node.finalbody):
+                yield from _top_level_functions(block)
+            for handler in node.handlers:
+                yield from _top_level_functions(handler.body)
+
+
+def parse_source(source, filename="<script>"):
+    """
+    Parse Python source and return ({func_name: entry}, [async_names]) for
+    its top-level functions. Later definitions win, matching what an import
+    would expose; `async def` functions can't be run and are only named.
+    """
+    tree = ast.parse(source, filename=filename)
+    funcs = {}
+    async_funcs = {}
+    for node in _top_level_functions(tree.body):
+        funcs.pop(node.name, None)
+        async_funcs.pop(node.name, None)
+        if isinstance(node, ast.AsyncFunctionDef):
+            async_funcs[node.name] = node.lineno
+            continue
+        funcs[node.name] = {
+            "name": node.name,
+            "lineno": node.lineno,
+            "params": _parse_params(node.args),
+            "returns": ast.unparse(node.returns) if node.returns else None,
+            "doc": ast.get_docstring(node),
+            "decorators": [ast.unparse(d) for d in node.decorator_list],
+        }
+    return funcs, list(async_funcs)
+
+
+def find_decorator(func_entry, name):
+    """
+    Return the parsed decorator `name` of a function entry (`@name`,
+    `@name(...)` or `@module.name(...)`), or None. Lets the dispatcher and
+    the app read `scripter` decorators without importing the script.
+    """
+    for source in func_entry.get("decorators", []):
+        try:
+            node = ast.parse(source, mode="eval").body
+        except SyntaxError:
+            continue
+        target = node.func if isinstance(node, ast.Call) else node
+        found = target.attr if isinstance(target, ast.Attribute) else getattr(target, "id", None)
+        if found == name:
+            return node
+    return None
+
+
+def signature(entry):
+    """
+    Build an `inspect.Signature` from a catalog entry. Builtin annotations are
+    mapped back to their types; anything else is kept as its source string.
+    """
+    params = []
+    for p in entry["params"]:
+        ann = p["annotation"]
+        if ann is None:
+            annotation = inspect.Parameter.empty
+        else:
+            annotation = BUILTIN_ANNOTATIONS.get(ann, ann)
+
+        default = p["default"]
+        if default is None:
+            default_val = inspect.Parameter.empty
+        elif "value" in default:
+            default_val = default["value"]
+        else:
+            default_val = SourceDefault(default["source"])
+
+        params.append(inspect.Parameter(
+            p["name"],
+            getattr(inspect.Parameter, p["kind"]),
+            default=default_val,
+            annotation=annotation,
+        ))
+    return inspect.Signature(params)
+
+
+def _hash_bytes(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def _parsed_entry(data, digest, filename):
+    try:
+        functions, async_functions = parse_source(data, filename=filename)
+        error = None
+    except (SyntaxError, ValueError) as e:
+        functions, async_functions = {}, []
+        error = f"{type(e).__name__}: {e}"
+    return {
+        "sha1": digest,
+        "functions": functions,
+        "async_functions": async_functions,
+        "error": error,
+    }
+
+
+def parse_file(path):
+    """
+    Catalog entry for a single script file, parsed without a Catalog (and
+    without reading the cache of the whole scripts tree). Returns None if
+    the file can't be read.
+    """
+    try:
+        with open(path, "rb") as fh:
+            st = os.fstat(fh.fileno())
+            data = fh.read()
+    except OSError:
+        return None
+    return dict(_parsed_entry(data, _hash_bytes(data), path), mtime_ns=st.st_mtime_ns, size=st.st_size)
+
+
+def _fuzzy_score(query, text):
+    """
+    Lower is better: substrings score by position (< 1), otherwise the
+    query's characters must appear in order and score by the gaps between
+    them. None if `text` doesn't match at all.
+    """
+    pos = text.find(query)
+    if pos >= 0:
+        return pos / (len(text) + 1)
+    gaps = 0
+    last = -1
+    for ch in query:
+        idx = text.find(ch, last + 1)
+        if idx < 0:
+            return None
+        if last >= 0:
+            gaps += idx - last - 1
+        last = idx
+    return 1 + gaps
+
+
+class _Index:
+    """
+    Views of one catalog version: per-folder children, recursive script and
+    function counts, and a sorted name index for search.
+    """
+
+    def __init__(self, files, folders):
+        self.children = collections.defaultdict(lambda: {"folders": [], "files": []})
+        self.children[""]
+        for folder in folders:
+            parent, _, name = folder.rpartition("/")
+            self.children[parent]["folders"].append(name)
+            self.children[folder]
+        self.functions = {}
+        self.counts = collections.defaultdict(lambda: [0, 0])  # folder -> [scripts, functions]
+        names = []
+        for relpath, entry in sorted(files.items()):
+            parent, _, name = relpath.rpartition("/")
+            self.children[parent]["files"].append(name)
+            funcs = list(entry["functions"])
+            self.functions[relpath] = funcs
+            folder = parent
+            while True:
+                self.counts[folder][0] += 1
+                self.counts[folder][1] += len(funcs)
+                if not folder:
+                    break
+                folder = folder.rpartition("/")[0]
+            names.append((name[:-3].lower(), relpath, None))
+            names.extend((func.lower(), relpath, func) for func in funcs)
+        names.sort()
+        self.names = names
+        self.keys = [key for key, _, _ in names]
+        self.children.default_factory = None
+
+    def listing(self, folder, offset, limit):
+        node = self.children.get(folder)
+        if node is None:
+            return None
+        prefix = f"{folder}/" if folder else ""
+        folders, files = node["folders"], node["files"]
+        entries = []
+        for name in folders[offset:offset + limit]:
+            path = prefix + name
+            scripts, functions = self.counts.get(path, (0, 0))
+            entries.append({
+                "type": "folder",
+                "name": name,
+                "path": path,
+                "folders": len(self.children[path]["folders"]),
+                "scripts": scripts,
+                "functions": functions,
+            })
+        start = max(0, offset - len(folders))
+        for name in files[start:start + limit - len(entries)]:
+            path = prefix + name
+            entries.append({"type": "script", "name": name, "path": path, "functions": self.functions[path]})
+        total = len(folders) + len(files)
+        end = offset + len(entries)
+        return {
+            "path": folder,
+            "total": total,
+            "total_folders": len(folders),
+            "total_scripts": len(files),
+            "offset": offset,
+            "limit": limit,
+            "next_offset": end if end < total else None,
+            "entries": entries,
+        }
+
+    def search(self, query, limit):
+        query = query.strip().lower()
+        if not query:
+            return []
+        by_path = "/" in query
+        results = []
+        seen = set()
+
+        def add(item, match):
+            _, relpath, func = item
+            seen.add((relpath, func))
+            results.append({
+                "type": "function" if func else "script",
+                "name": func or relpath.rpartition("/")[2],
+                "script": relpath,
+                "function": func,
+                "match": match,
+            })
+
+        # Prefix matches straight from the sorted keys...
+        if not by_path:
+            idx = bisect.bisect_left(self.keys, query)
+            while idx < len(self.keys) and self.keys[idx].startswith(query) and len(results) < limit:
+                add(self.names[idx], "prefix")
+                idx += 1
+        # ... then the best substring / fuzzy matches.
+        if len(results) < limit:
+            scored = []
+            for item in self.names:
+                key, relpath, func = item
+                if (relpath, func) in seen:
+                    continue
+                text = relpath.lower() if by_path and func is None else key
+                score = _fuzzy_score(query, text)
+                if score is not None:
+                    scored.append((score, len(text), item))
+            scored.sort(key=lambda s: s[:2])
+            for score, _, item in scored[:limit - len(results)]:
+                add(item, "substring" if score < 1 else "fuzzy")
+        return results
+
+
+class Catalog:
+    """
+    Per-file cache of parsed script metadata, keyed by the path relative to
+    the scripts directory (e.g. "AWS/Lambda/sample_script.py").
+    """
+
+    def __init__(self, scripts_dir=SCRIPTS_DIR, cache_path=CACHE_PATH, persist=True):
+        self.scripts_dir = scripts_dir
+        self.cache_path = cache_path
+        self.persist = persist
+        self.version = 0
+        self.last_scan = 0.0
+        self.last_scan_seconds = 0.0
+        self._files = {}
+        self._folders = []
+        self._index = None
+        self._index_version = None
+        # Distinguishes this instance's versions from an earlier process's.
+        self._token = uuid.uuid4().hex[:8]
+        self._dirty = False
+        self._lock = threading.RLock()
+        self._load()
+
+    # -------------------------------------------------------------------------
+    # Disk cache
+    # -------------------------------------------------------------------------
+    def _load(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return
+        if data.get("format") != CACHE_FORMAT or data.get("scripts_dir") != self.scripts_dir:
+            return
+        self._files = data.get("files", {})
+        self._folders = data.get("folders", [])
+
+    def save(self):
+        """
+        Atomically write the cache to disk if anything changed since last save.
+        """
+        with self._lock:
+            if not (self.persist and self._dirty):
+                return
+            payload = json.dumps({
+                "format": CACHE_FORMAT,
+                "scripts_dir": self.scripts_dir,
+                "files": self._files,
+                "folders": self._folders,
+            })
+            self._dirty = False
+        tmp_path = f"{self.cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as fh:
+                fh.write(payload)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning("Could not persist catalog cache to '%s': %s", self.cache_path, e)
+
+    # -------------------------------------------------------------------------
+    # Refreshing entries
+    # -------------------------------------------------------------------------
+    def _refresh_file(self, relpath, st=None):
+        """
+        Make sure the entry for `relpath` matches the file on disk.
+        Returns True if the cached entry changed.
+        """
+        full = os.path.join(self.scripts_dir, relpath)
+        if st is None:
+            try:
+                st = os.stat(full)
+            except OSError:
+                return self._files.pop(relpath, None) is not None
+
+        cached = self._files.get(relpath)
+        if cached and cached["mtime_ns"] == st.st_mtime_ns and cached["size"] == st.st_size:
+            return False
+
+        try:
+            with open(full, "rb") as fh:
+                data = fh.read()
+        except OSError:
+            return self._files.pop(relpath, None) is not None
+
+        digest = _hash_bytes(data)
+        if cached and cached["sha1"] == digest:
+            # Touched but not modified: keep the parse, remember the new stat.
+            cached["mtime_ns"] = st.st_mtime_ns
+            cached["size"] = st.st_size
+            self._dirty = True
+            return False
+
+        self._files[relpath] = dict(_parsed_entry(data, digest, full), mtime_ns=st.st_mtime_ns, size=st.st_size)
+        self._dirty = True
+        return True
+
+    def _walk(self, folder, rel, seen, folders):
+        changed = False
+        try:
+            entries = sorted(os.scandir(folder), key=lambda e: e.name)
+        except OSError:
+            return False
+        for entry in entries:
+            relpath = f"{rel}/{entry.name}" if rel else entry.name
+            if entry.is_dir() and _is_folder(entry.name):
+                folders.append(relpath)
+                changed |= self._walk(entry.path, relpath, seen, folders)
+            elif _is_script(entry.name):
+                seen.add(relpath)
+                changed |= self._refresh_file(relpath, entry.stat())
+        return changed
+
+    def refresh(self, force=False):
+        """
+        Re-scan the scripts directory, re-parsing only files whose mtime/size
+        and content hash changed. Scans are throttled to SCAN_INTERVAL.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and self.last_scan and now - self.last_scan < SCAN_INTERVAL:
+                return
+            started = time.perf_counter()
+            seen = set()
+            folders = []
+            changed = self._walk(self.scripts_dir, "", seen, folders)
+            for relpath in set(self._files) - seen:
+                del self._files[relpath]
+                changed = True
+            if folders != self._folders:
+                self._folders = folders
+                self._dirty = changed = True
+            if changed:
+                self.version += 1
+            self.last_scan = now
+            self.last_scan_seconds = time.perf_counter() - started
+        self.save()
+
+    # -------------------------------------------------------------------------
+    # Queries
+    # -------------------------------------------------------------------------
+    def file(self, relpath):
+        """
+        Return the cached entry for one script, refreshing just that file.
+        Returns None if the script does not exist.
+        """
+        relpath = relpath.replace(os.sep, "/")
+        with self._lock:
+            if self._refresh_file(relpath):
+                self.version += 1
+            entry = self._files.get(relpath)
+        self.save()
+        return entry
+
+    def functions(self, relpath):
+        """
+        Return {func_name: entry} for one script ({} if missing or unparsable).
+        """
+        entry = self.file(relpath)
+        return dict(entry["functions"]) if entry else {}
+
+    def signatures(self, relpath):
+        """
+        Return {func_name: inspect.Signature} for one script.
+        """
+        return {name: signature(f) for name, f in self.functions(relpath).items()}
+
+    def stats(self):
+        """
+        Counters for monitoring; never triggers a scan.
+        """
+        with self._lock:
+            return {
+                "files": len(self._files),
+                "folders": len(self._folders),
+                "version": self.version,
+                "last_scan_seconds": self.last_scan_seconds,
+            }
+
+    def _current_index(self):
+        self.refresh()
+        with self._lock:
+            if self._index is None or self._index_version != self.version:
+                self._index = _Index(self._files, self._folders)
+                self._index_version = self.version
+            return self._index
+
+    def etag(self):
+        """
+        Validator for listings and searches: changes whenever the catalog does.
+        """
+        self.refresh()
+        with self._lock:
+            return f"{self._token}.{self.version}"
+
+    def listing(self, folder="", offset=0, limit=LISTING_PAGE_SIZE):
+        """
+        One page of a folder's direct children, subfolders first:
+          { path, total, total_folders, total_scripts, offset, limit,
+            next_offset, entries: [ {type: "folder", name, path, folders,
+            scripts, functions} | {type: "script", name, path, functions} ] }
+        Folder counts are recursive. Returns None for an unknown folder.
+        """
+        return self._current_index().listing(folder.strip("/"), max(0, offset), max(0, limit))
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """
+        Scripts and functions whose name starts with `query`, followed by
+        substring and then fuzzy (in-order characters) matches. Queries with
+        a "/" match script paths instead.
+        """
+        return self._current_index().search(query, limit)
+
+    def summary(self):
+        """
+        Totals for the dashboard: scripts, functions and folders.
+        """
+        index = self._current_index()
+        scripts, functions = index.counts.get("", (0, 0))
+        return {"scripts": scripts, "functions": functions, "folders": len(index.children) - 1}
+
+    def tree(self):
+        """
+        Build the nested folder tree used by the dashboard:
+          { files: [ { name, functions: [...] } ], subdirs: {...} }
+        """
+        self.refresh()
+        root = {"files": [], "subdirs": {}}
+        with self._lock:
+            folders = list(self._folders)
+            items = sorted(self._files.items())
+        # Create folders first (in sorted order) so empty ones still show up.
+        for relpath in folders:
+            node = root
+            for folder in relpath.split("/"):
+                node = node["subdirs"].setdefault(folder, {"files": [], "subdirs": {}})
+        for relpath, entry in items:
+            *folders, filename = relpath.split("/")
+            node = root
+            for folder in folders:
+                node = node["subdirs"].setdefault(folder, {"files": [], "subdirs": {}})
+            node["files"].append({"name": filename, "functions": list(entry["functions"])})
+        return root
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(scripts_dir=SCRIPTS_DIR):
+    """
+    Return the process-wide catalog for `scripts_dir`.
+    """
+    scripts_dir = os.path.abspath(scripts_dir)
+    with _catalogs_lock:
+        if scripts_dir not in _catalogs:
+            if scripts_dir == os.path.abspath(SCRIPTS_DIR):
+                cache_path = CACHE_PATH
+            else:
+                key = _hash_bytes(scripts_dir.encode("utf-8"))[:12]
+                cache_path = os.path.join(STATE_DIR, f"catalog-{key}.json")
+            _catalogs[scripts_dir] = Catalog(scripts_dir, cache_path)
+        return _catalogs[scripts_dir]
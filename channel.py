@@ -0,0 +1,326 @@
+"""
+Structured result channel between the dispatcher and the app.
+
+A function's return value travels separately from its log output: the
+executor hands the dispatcher a pipe (its fd number in SCRIPTER_RESULT_FD)
+and the dispatcher writes length-prefixed frames to it: the result, a profile
+report for profiled runs, then its run metrics. Small results go inline; larger ones are written to a
+memory-mapped temp file under `<STATE_DIR>/tmp/` and only the file's path
+crosses the pipe. The receiver moves either into `<run_id>.result` next to
+the run log.
+
+A result is stored as JSON lines: a header line
+({"type": "list" | "value", "length": ..., "python_type": ...}) followed by
+one line per list item, or a single line with the value. Lists can then be
+paged without parsing the whole result.
+"""
+import base64
+import datetime
+import decimal
+import json
+import mmap
+import os
+import shutil
+import struct
+import uuid
+
+from runlog import STATE_DIR
+
+RESULT_FD_ENV = "SCRIPTER_RESULT_FD"
+TMP_DIR = os.path.join(STATE_DIR, "tmp")
+
+FRAME_VALUE = b"V"  # payload: the encoded result
+FRAME_FILE = b"F"  # payload: JSON {"path": ..., "size": ...} of a spilled result
+FRAME_METRICS = b"T"  # payload: JSON run metrics (see metrics.PhaseTimer)
+FRAME_PROFILE = b"P"  # payload: JSON profile report (see profiling.Profiler.save)
+_HEADER = struct.Struct("!cI")
+
+# Results up to this size go inline. Together with the small metrics and
+# profile frames this stays below the smallest pipe buffer, so writes never block even if
+# nobody reads the pipe until the process exits.
+INLINE_MAX = 32 * 1024
+
+# Items per page served by default for list results.
+PAGE_SIZE = 1000
+
+
+# -----------------------------------------------------------------------------
+# Encoding
+# -----------------------------------------------------------------------------
+def _default(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if callable(getattr(value, "to_dict", None)):
+        try:
+            return value.to_dict(orient="records")  # pandas DataFrame
+        except TypeError:
+            return value.to_dict()
+    if callable(getattr(value, "tolist", None)):
+        return value.tolist()  # numpy arrays and scalars
+    return repr(value)
+
+
+def _dumps(value):
+    return json.dumps(value, default=_default, ensure_ascii=False).encode("utf-8")
+
+
+def encode_result(value):
+    """
+    Encode a return value as result lines (see the module docstring).
+    """
+    python_type = type(value).__name__
+    items = value
+    if not isinstance(items, (list, tuple, dict, str, int, float, bool)) and value is not None:
+        items = json.loads(_dumps(value))
+    if isinstance(items, (list, tuple)):
+        header = {"type": "list", "length": len(items), "python_type": python_type}
+        lines = [_dumps(header)] + [_dumps(item) for item in items]
+    else:
+        header = {"type": "value", "length": None, "python_type": python_type}
+        lines = [_dumps(header), _dumps(items)]
+    return b"\n".join(lines) + b"\n"
+
+
+def summary(value):
+    """
+    Short description of a return value for the run log.
+    """
+    try:
+        size = f" of {len(value)} items"
+    except TypeError:
+        size = ""
+    text = repr(value)
+    if len(text) > 200:
+        text = text[:200] + " …"
+    return f"{type(value).__name__}{size}: {text}"
+
+
+# -----------------------------------------------------------------------------
+# Writer side (dispatcher)
+# -----------------------------------------------------------------------------
+def pack_frame(kind, payload):
+    return _HEADER.pack(kind, len(payload)) + payload
+
+
+def _spill(encoded):
+    os.makedirs(TMP_DIR, exist_ok=True)
+    path = os.path.join(TMP_DIR, f"{uuid.uuid4().hex}.result")
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        os.ftruncate(fd, len(encoded))
+        with mmap.mmap(fd, len(encoded)) as mm:
+            mm[:] = encoded
+    finally:
+        os.close(fd)
+    return path
+
+
+class ChannelWriter:
+    """
+    Dispatcher end of the channel.
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    @classmethod
+    def from_env(cls):
+        """
+        The channel handed to this process, if any. The variable is removed
+        so scripts that start another dispatcher don't write to our pipe.
+        """
+        fd = os.environ.pop(RESULT_FD_ENV, None)
+        return cls(int(fd)) if fd else None
+
+    def _write(self, kind, payload):
+        view = memoryview(pack_frame(kind, payload))
+        while view:
+            view = view[os.write(self.fd, view):]
+
+    def send_result(self, encoded):
+        """
+        Send an encoded result (see `encode_result`), inline or by reference.
+        """
+        if len(encoded) <= INLINE_MAX:
+            self._write(FRAME_VALUE, encoded)
+        else:
+            ref = {"path": _spill(encoded), "size": len(encoded)}
+            self._write(FRAME_FILE, json.dumps(ref).encode("utf-8"))
+
+    def send_profile(self, report):
+        """
+        Send a profile report; its files stay in TMP_DIR until received.
+        """
+        self._write(FRAME_PROFILE, json.dumps(report).encode("utf-8"))
+
+    def send_metrics(self, metrics):
+        self._write(FRAME_METRICS, json.dumps(metrics).encode("utf-8"))
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+# -----------------------------------------------------------------------------
+# Receiver side (executors)
+# -----------------------------------------------------------------------------
+def open_channel():
+    """
+    Create a result pipe: returns (read_fd, write_fd). The write end is
+    inheritable and meant for the child; close it in the parent after
+    starting the child.
+    """
+    read_fd, write_fd = os.pipe()
+    os.set_inheritable(write_fd, True)
+    return read_fd, write_fd
+
+
+def read_available(read_fd):
+    """
+    Read whatever is in the pipe without blocking and close it. Call once the
+    child has exited; a grandchild still holding the write end can't stall it.
+    """
+    os.set_blocking(read_fd, False)
+    chunks = []
+    try:
+        while True:
+            try:
+                data = os.read(read_fd, 65536)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            chunks.append(data)
+    finally:
+        os.close(read_fd)
+    return b"".join(chunks)
+
+
+def read_frames(data):
+    """
+    Split channel bytes into (kind, payload) frames; a truncated trailing
+    frame (the writer died mid-write) is dropped.
+    """
+    frames = []
+    pos = 0
+    while pos + _HEADER.size <= len(data):
+        kind, length = _HEADER.unpack_from(data, pos)
+        pos += _HEADER.size
+        if pos + length > len(data):
+            break
+        frames.append((kind, data[pos:pos + length]))
+        pos += length
+    return frames
+
+
+def _claim(src, dest_path):
+    """
+    Move a file the dispatcher left in TMP_DIR to `dest_path`.
+    """
+    if os.path.dirname(os.path.abspath(src)) != os.path.abspath(TMP_DIR):
+        raise ValueError(f"channel file outside {TMP_DIR}: {src}")
+    try:
+        os.replace(src, dest_path)
+    except OSError:
+        tmp_path = f"{dest_path}.tmp"
+        shutil.move(src, tmp_path)
+        os.replace(tmp_path, dest_path)
+
+
+def store_result(kind, payload, dest_path):
+    """
+    Move a result frame's value into `dest_path` and return its header.
+    """
+    if kind == FRAME_VALUE:
+        tmp_path = f"{dest_path}.tmp"
+        with open(tmp_path, "wb") as fh:
+            fh.write(payload)
+        os.replace(tmp_path, dest_path)
+    else:
+        _claim(json.loads(payload)["path"], dest_path)
+    return ResultFile(dest_path).header
+
+
+# Files a profile report may reference, by extension.
+PROFILE_FILE_TYPES = (".pstats", ".tracemalloc", ".collapsed")
+
+
+def store_profile(payload, dest_prefix):
+    """
+    Move a profile frame's files to `<dest_prefix><ext>`, write the report
+    to `<dest_prefix>.json` and return it. The report's "files" then hold
+    file names relative to the destination folder.
+    """
+    report = json.loads(payload)
+    files = {}
+    for name, src in report["files"].items():
+        ext = os.path.splitext(src)[1]
+        if ext not in PROFILE_FILE_TYPES:
+            raise ValueError(f"unexpected profile file type: {src}")
+        dest_path = dest_prefix + ext
+        if os.path.exists(src):  # the artifact may be the collapsed file itself
+            _claim(src, dest_path)
+        files[name] = os.path.basename(dest_path)
+    report["files"] = files
+    tmp_path = f"{dest_prefix}.json.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(report, fh)
+    os.replace(tmp_path, f"{dest_prefix}.json")
+    return report
+
+
+class ResultFile:
+    """
+    Read access to a stored result, memory-mapped so pages of a large list
+    are served without loading or parsing the rest of it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as fh:
+            self.header = json.loads(fh.readline())
+
+    def _lines(self, mm, start, count):
+        # Skip the header plus `start` items, then collect `count` raw lines.
+        pos = mm.find(b"\n") + 1
+        for _ in range(start):
+            pos = mm.find(b"\n", pos) + 1
+            if pos == 0:
+                return []
+        lines = []
+        while len(lines) < count and pos < len(mm):
+            end = mm.find(b"\n", pos)
+            end = len(mm) if end < 0 else end
+            lines.append(mm[pos:end])
+            pos = end + 1
+        return lines
+
+    def render(self, offset=0, limit=PAGE_SIZE):
+        """
+        JSON response body: the value, or one page of a list result.
+        """
+        header = self.header
+        with open(self.path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if header["type"] != "list":
+                value = self._lines(mm, 0, 1)
+                return b'{"type": "value", "python_type": %s, "value": %s}' % (
+                    _dumps(header["python_type"]), value[0] if value else b"null",
+                )
+            offset = max(0, min(offset, header["length"]))
+            items = self._lines(mm, offset, max(0, limit))
+        meta = _dumps({
+            "type": "list",
+            "python_type": header["python_type"],
+            "length": header["length"],
+            "offset": offset,
+            "limit": limit,
+            "next_offset": offset + len(items) if offset + len(items) < header["length"] else None,
+        })
+        return meta[:-1] + b', "items": [' + b", ".join(items) + b"]}"
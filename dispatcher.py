@@ -1,56 +1,214 @@
 #!/usr/bin/env python3
 import argparse
 import importlib
-import inspect
+import json
 import logging
 import os
+import pickle
+import signal
 import sys
+import time
+
+import batch
+import channel
+import handoff
+import paramtypes
+import profiling
+import resources
+import resultcache
+import scripter
+from catalog import SourceDefault, parse_file, signature
+from metrics import PhaseTimer
 
 # -----------------------------------------------------------------------------
 # 1) Configure logging so Flask can stream it
 # -----------------------------------------------------------------------------
-logging.basicConfig(
-    stream=sys.stdout,
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s: %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S"
-)
+def configure_logging(force=False):
+    """
+    Send log records to stdout; `force` replaces handlers a host process
+    (e.g. a pool worker) may already have installed.
+    """
+    logging.basicConfig(
+        stream=sys.stdout,
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        force=force,
+    )
+
+
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # -----------------------------------------------------------------------------
 # 2) Base scripts directory
 # -----------------------------------------------------------------------------
 BASE_DIR = os.path.dirname(__file__)
-SCRIPTS_DIR = os.path.join(BASE_DIR, "scripts")
+SCRIPTS_DIR = os.environ.get("SCRIPTER_SCRIPTS_DIR", os.path.join(BASE_DIR, "scripts"))
+
+
+def load_script_entry(module_name: str, module_folder: str):
+    """
+    Parse module_name in module_folder (no import) and return its catalog
+    entry (functions, content hash, ...). Only this one file is read.
+    """
+    script_path = os.path.join(module_folder, module_name + ".py")
+    entry = parse_file(script_path)
+    if entry is None:
+        logger.error("Script '%s' not found under '%s'", module_name + ".py", module_folder)
+        sys.exit(1)
+    if entry["error"]:
+        logger.error("Failed to parse '%s': %s", script_path, entry["error"])
+        sys.exit(1)
+    return entry
 
 
 def list_functions(module_name: str, module_folder: str):
     """
-    Import the module (module_name) from module_folder,
-    inspect top-level functions, and return a dict {func_name: signature}.
+    Return a dict {func_name: signature} for the top-level functions of
+    module_name in module_folder.
+    """
+    entry = load_script_entry(module_name, module_folder)
+    return {name: signature(f) for name, f in entry["functions"].items()}
+
+
+def encode_result(result):
+    """
+    Encode a return value for the result channel (None if it can't be).
     """
-    sys.path.insert(0, module_folder)
     try:
-        module = importlib.import_module(module_name)
-    except Exception as e:
-        logger.error("Failed to import module '%s' from '%s': %s", module_name, module_folder, e)
-        sys.exit(1)
-    finally:
-        sys.path.pop(0)
+        return channel.encode_result(result)
+    except (TypeError, ValueError, RecursionError) as e:
+        logger.warning("Return value could not be encoded as a structured result: %s", e)
+        return None
+
+
+def replay_cached(record, label, result_channel):
+    """
+    Print a cached run's output and return value instead of running it.
+    """
+    age = time.time() - record["created_at"]
+    logger.info("=== Cached: %s with args: %s (stored %.0fs ago, not re-run)", label, record["kwargs"], age)
+    sys.stdout.write(record["output"])
+    if record["result"] is not None:
+        logger.info("Return value: %s", record["result"] if result_channel is None else record["summary"])
+    if result_channel is not None and record.get("encoded_result") is not None:
+        result_channel.send_result(record["encoded_result"].encode("utf-8"))
+    logger.info("=== Completed: %s without errors (cached)", label)
+
+
+def report_profile(profiler, result_channel):
+    """
+    Save a finished profile: sent to the app over the result channel, or
+    kept under PROFILE_DIR with its hotspots printed for CLI runs.
+    """
+    try:
+        report = profiler.save(channel.TMP_DIR if result_channel is not None else profiling.PROFILE_DIR)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not save the %s profile: %s", profiler.mode, e)
+        return
+    if result_channel is not None:
+        result_channel.send_profile(report)
+        logger.info("Profile (%s) recorded", profiler.mode)
+    else:
+        logger.info(
+            "Profile (%s) saved to %s (collapsed stacks: %s); top hotspots:\n%s",
+            profiler.mode, report["files"]["artifact"], report["files"]["collapsed"],
+            profiling.format_hotspots(report),
+        )
+
+
+# Dispatcher-level flags that are never passed on to the function.
+DISPATCHER_FLAGS = (
+    "script", "function", "batch_file", "batch_grid", "batch_parallel", "profile", "inputs", "checkpoint",
+)
+
+
+def add_profile_argument(parser):
+    parser.add_argument(
+        "--profile",
+        choices=sorted(profiling.PROFILERS),
+        help="Run the function under a profiler and save the profile.",
+    )
 
-    funcs = {}
-    for attr_name, attr_val in vars(module).items():
-        if inspect.isfunction(attr_val) and attr_val.__module__ == module_name:
-            funcs[attr_name] = inspect.signature(attr_val)
-    return funcs
 
+def add_handoff_arguments(parser):
+    parser.add_argument(
+        "--inputs",
+        help="JSON file of kwargs, possibly referring to upstream pipeline results (see handoff.py).",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        help="Pickle the return value to this file for downstream pipeline steps.",
+    )
+
+
+def add_batch_arguments(parser):
+    parser.add_argument(
+        "--batch-file",
+        help="Run once per parameter set in a .csv / .jsonl / .json file.",
+    )
+    parser.add_argument(
+        "--batch-grid",
+        help='Run once per combination of a JSON grid, e.g. \'{"a": [1, 2], "b": [3, 4]}\'.',
+    )
+    parser.add_argument(
+        "--batch-parallel",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes for batch runs.",
+    )
+
+
+def shown_args(kwargs, inputs):
+    """
+    Kwargs for the "Starting" line; structured values from the inputs file
+    (uploads, upstream steps' results) are summarised, as they can be large.
+    """
+    return {
+        name: channel.summary(value) if name in inputs and not isinstance(value, paramtypes.SCALARS) else value
+        for name, value in kwargs.items()
+    }
+
+
+def _terminated(signum, frame):
+    # The run is being stopped (cancelled or out of time): unwind, so the
+    # script's `finally` blocks and context managers run before SIGKILL.
+    raise SystemExit(128 + signum)
+
+
+def main(argv=None):
+    """
+    Run one script function as described by the command line. When started
+    by an executor, the run's resource limits are applied first, and the
+    return value and the run's phase timings are sent over the result
+    channel. Progress the script reports (`scripter.progress`) goes to the
+    file the executor named, with its final state written on exit.
+    SIGTERM exits through SystemExit so the script can clean up.
+    """
+    resources.apply_from_env()
+    signal.signal(signal.SIGTERM, _terminated)
+    timer = PhaseTimer()
+    result_channel = channel.ChannelWriter.from_env()
+    run_progress = scripter.start_progress()
+    try:
+        run(argv, timer, result_channel)
+    finally:
+        if run_progress is not None:
+            run_progress.flush()
+        if result_channel is not None:
+            timer.mark("finish")
+            result_channel.send_metrics(timer.report())
+            result_channel.close()
 
-def main():
+
+def run(argv, timer, result_channel):
     # -----------------------------------------------------------------------------
     # 3) Parse --script and --function
     # -----------------------------------------------------------------------------
     parser = argparse.ArgumentParser(
-        description="Generic dispatcher: import a script from scripts/ and run one of its functions."
+        description="Generic dispatcher: import a script from scripts/ and run one of its functions.",
+        allow_abbrev=False,
     )
     parser.add_argument(
         "--script",
@@ -61,9 +219,14 @@ def main():
         )
     )
     parser.add_argument("--function", required=True, help="Function to call in that script.")
-    args, remaining = parser.parse_known_args()
+    add_batch_arguments(parser)
+    add_profile_argument(parser)
+    add_handoff_arguments(parser)
+    args, remaining = parser.parse_known_args(argv)
     script_arg = args.script  # e.g. "Other/sample_scr" or "sample_script"
     func_name = args.function
+    batch_mode = bool(args.batch_file or args.batch_grid)
+    timer.mark("argparse")
 
     # -----------------------------------------------------------------------------
     # 4) Split script_arg into folder (optional) and module_name
@@ -99,7 +262,15 @@ def main():
     # -----------------------------------------------------------------------------
     # 6) List functions in the module to verify func_name
     # -----------------------------------------------------------------------------
-    func_map = list_functions(module_name, module_folder)
+    script_entry = load_script_entry(module_name, module_folder)
+    func_map = {name: signature(f) for name, f in script_entry["functions"].items()}
+    timer.mark("lookup")
+    if func_name in script_entry["async_functions"]:
+        logger.error(
+            "Function '%s' in script '%s' is async; only plain functions can be run",
+            func_name, script_filename
+        )
+        sys.exit(1)
     if func_name not in func_map:
         logger.error(
             "Function '%s' not found in script '%s'. Available: %s",
@@ -112,16 +283,41 @@ def main():
     # -----------------------------------------------------------------------------
     sig = func_map[func_name]
     dispatcher_parser = argparse.ArgumentParser(
-        description=f"Run {script_arg}.{func_name}{sig}"
+        description=f"Run {script_arg}.{func_name}{sig}",
+        allow_abbrev=False,
     )
     # Re-add --script and --function (we ignore them when calling func)
     dispatcher_parser.add_argument("--script", help="(ignored)", required=True)
     dispatcher_parser.add_argument("--function", help="(ignored)", required=True)
+    add_batch_arguments(dispatcher_parser)
+    add_profile_argument(dispatcher_parser)
+    add_handoff_arguments(dispatcher_parser)
+
+    # Kwargs from an inputs file (typed values, uploads and pipeline steps'
+    # inputs) are passed as they are.
+    inputs = {}
+    if args.inputs:
+        try:
+            inputs = handoff.resolve_inputs(args.inputs)
+        except handoff.HandoffError as e:
+            logger.error("Could not resolve the run's inputs: %s", e)
+            sys.exit(1)
 
     for param_name, param in sig.parameters.items():
-        annotation = param.annotation if param.annotation in (int, float, str) else str
-        if param.default is param.empty:
+        annotation = paramtypes.parser(param.annotation)
+        if batch_mode or param_name in inputs:
+            # Per-item values come from the batch (or the value from the
+            # inputs file); flags only set shared values.
+            dispatcher_parser.add_argument(
+                f"--{param_name}", type=annotation, default=argparse.SUPPRESS
+            )
+        elif param.default is param.empty:
             dispatcher_parser.add_argument(f"--{param_name}", type=annotation, required=True)
+        elif isinstance(param.default, SourceDefault):
+            # Non-literal default: omit the kwarg so the function's own default applies.
+            dispatcher_parser.add_argument(
+                f"--{param_name}", type=annotation, default=argparse.SUPPRESS
+            )
         else:
             dispatcher_parser.add_argument(
                 f"--{param_name}", type=annotation, default=param.default
@@ -130,14 +326,37 @@ def main():
     # -----------------------------------------------------------------------------
     # 8) Parse only the flags relevant to this function; ignore unknowns
     # -----------------------------------------------------------------------------
-    parsed, extras = dispatcher_parser.parse_known_args()
-    kwargs = {k: v for k, v in vars(parsed).items() if k not in ("script", "function")}
+    parsed, extras = dispatcher_parser.parse_known_args(argv)
+    kwargs = {k: v for k, v in vars(parsed).items() if k not in DISPATCHER_FLAGS}
+    unknown_inputs = [name for name in inputs if name not in sig.parameters]
+    if unknown_inputs:
+        logger.warning("Ignoring inputs the function doesn't take: %s", unknown_inputs)
+    kwargs.update({name: value for name, value in inputs.items() if name in sig.parameters})
 
     # -----------------------------------------------------------------------------
     # 9) Warn about any extra flags
     # -----------------------------------------------------------------------------
     if extras:
         logger.warning("Ignoring unrecognized flags: %s", extras)
+    timer.mark("argparse")
+
+    # -----------------------------------------------------------------------------
+    # 9b) Replay a cached result for @cached functions (before any import)
+    # -----------------------------------------------------------------------------
+    label = f"{script_arg}.{func_name}"
+    # Profiled runs, pipeline steps (which need the value itself) and runs
+    # reading files always call the function.
+    cache_ttl = None
+    if not batch_mode and not args.profile and not args.checkpoint and not paramtypes.reads_files(kwargs):
+        cache_ttl = resultcache.cache_policy(script_entry["functions"][func_name])
+    if cache_ttl is not None:
+        cache_key = (script_arg, func_name, script_entry["sha1"], kwargs)
+        record = resultcache.get_cache().get(*cache_key)
+        timer.mark("cache")
+        if record is not None:
+            replay_cached(record, label, result_channel)
+            timer.mark("replay")
+            sys.exit(0)
 
     # -----------------------------------------------------------------------------
     # 10) Import the module and get the function object
@@ -152,21 +371,77 @@ def main():
         sys.path.pop(0)
 
     func = getattr(module, func_name)
+    timer.mark("import")
 
     # -----------------------------------------------------------------------------
     # 11) Invoke the function and stream logs
     # -----------------------------------------------------------------------------
+    if batch_mode:
+        if args.profile:
+            logger.warning("--profile is not supported for batch runs; running without it")
+        try:
+            items = batch.load_items(args.batch_file) if args.batch_file else []
+            if args.batch_grid:
+                items += batch.expand_grid(json.loads(args.batch_grid))
+        except (OSError, ValueError) as e:
+            logger.error("Could not read batch items: %s", e)
+            sys.exit(1)
+        exit_code = batch.run_batch(module, func_name, sig, kwargs, items, args.batch_parallel, label)
+        timer.mark("call")
+        sys.exit(exit_code)
+
+    profiler = profiling.PROFILERS[args.profile]() if args.profile else None
     try:
-        logger.info("=== Starting: %s.%s with args: %s", script_arg, func_name, kwargs)
-        result = func(**kwargs)
+        logger.info("=== Starting: %s.%s with args: %s", script_arg, func_name, shown_args(kwargs, inputs))
+        if profiler is not None:
+            result = profiler.call(func, kwargs)
+        elif cache_ttl is None:
+            result = func(**kwargs)
+        else:
+            with resultcache.capture_output(sys.stdout, sys.stderr) as captured:
+                result = func(**kwargs)
+        timer.mark("call")
         if result is not None:
-            logger.info("Return value: %s", result)
+            # With a result channel the log only gets a short summary.
+            logger.info("Return value: %s", result if result_channel is None else channel.summary(result))
     except Exception as e:
+        timer.mark("call")
         logger.exception("Unhandled exception in %s.%s: %s", script_arg, func_name, e)
+        if profiler is not None:
+            report_profile(profiler, result_channel)
+            timer.mark("profile")
         sys.exit(1)
     else:
         logger.info("=== Completed: %s.%s without errors", script_arg, func_name)
 
+    if profiler is not None:
+        report_profile(profiler, result_channel)
+        timer.mark("profile")
+
+    if args.checkpoint:
+        try:
+            handoff.save_checkpoint(result, args.checkpoint)
+        except (OSError, handoff.HandoffError, pickle.PickleError, TypeError, AttributeError, RecursionError) as e:
+            logger.error("Return value could not be checkpointed for the next steps: %s", e)
+            sys.exit(1)
+
+    encoded = None
+    if result is not None and (result_channel is not None or cache_ttl is not None):
+        encoded = encode_result(result)
+    if result_channel is not None and encoded is not None:
+        result_channel.send_result(encoded)
+
+    if cache_ttl is not None and not captured.truncated and len(encoded or b"") <= resultcache.MAX_ENTRY_BYTES:
+        resultcache.get_cache().put(*cache_key, {
+            "created_at": time.time(),
+            "ttl": cache_ttl,
+            "kwargs": kwargs,
+            "output": captured.getvalue(),
+            "result": None if result is None else str(result),
+            "summary": None if result is None else channel.summary(result),
+            "encoded_result": None if encoded is None else encoded.decode("utf-8"),
+        })
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
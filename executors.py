@@ -0,0 +1,337 @@
+"""
+Executors that actually run a (script, function, params) job.
+
+Every executor streams output into the job's run log (through `pump.py`,
+as raw coalesced chunks within the output cap), hands the job's resource
+limits to the dispatcher and enforces its wall-clock deadline (see
+`resources.py`), tells the dispatcher where to write the progress the
+script reports (`scripter.progress`), registers how to stop the run if
+the job is cancelled (`Job.stop_with`), and returns the process exit
+code. Runs lead their own process group, so stopping one also stops
+whatever it spawned.
+`execute()` picks an executor based on SCRIPTER_EXECUTOR; jobs marked to
+run in-process go to `inprocess.run` instead.
+"""
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+
+import channel
+import inprocess
+import pump
+import resources
+import scripter
+from catalog import get_catalog
+from workers import PoolUnavailable, get_pool
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.environ.get("SCRIPTER_SCRIPTS_DIR", os.path.join(BASE_DIR, "scripts"))
+DISPATCHER_PATH = os.path.join(BASE_DIR, "dispatcher.py")
+
+# "subprocess" starts a fresh interpreter per run; "pool" hands runs to the
+# pre-forked warm worker pool (falling back to a subprocess if it is down).
+EXECUTOR = os.environ.get("SCRIPTER_EXECUTOR", "subprocess")
+
+
+def split_script(full_script):
+    """
+    "Category/Sub/sample_script.py" -> ("Category/Sub/sample_script", workdir)
+    """
+    folder_part, script_filename = os.path.split(full_script)
+    module_name, _ = os.path.splitext(script_filename)
+    if folder_part == "":
+        return module_name, SCRIPTS_DIR
+    return f"{folder_part}/{module_name}", os.path.join(SCRIPTS_DIR, folder_part)
+
+
+# Dispatcher flags only the server sets; function parameters can't use
+# these names (a client could otherwise pass e.g. --checkpoint).
+DISPATCHER_OPTIONS = (
+    "script", "function", "batch-file", "batch-grid", "batch-parallel", "profile", "inputs", "checkpoint",
+)
+
+
+def function_args(params):
+    """
+    Turn {name: value} into dispatcher flags: ["--name", "value", ...].
+    """
+    args = []
+    for k, v in params.items():
+        args.extend([f"--{k}", str(v)])
+    return args
+
+
+def job_args(job):
+    """
+    Dispatcher flags for a job: its function parameters plus any dispatcher
+    options (e.g. --batch-file).
+    """
+    return function_args(job.params) + function_args(job.options)
+
+
+def build_command(script_module_arg, function, func_args):
+    return [
+        sys.executable,
+        DISPATCHER_PATH,
+        "--script",
+        script_module_arg,
+        "--function",
+        function,
+    ] + func_args
+
+
+def _child_env(result_fd, limits=None, progress_path=None):
+    if result_fd is None and not limits and progress_path is None:
+        return None
+    env = resources.child_env(limits)
+    if result_fd is not None:
+        env[channel.RESULT_FD_ENV] = str(result_fd)
+    if progress_path is not None:
+        env[scripter.PROGRESS_FILE_ENV] = progress_path
+    return env
+
+
+def stream_subprocess(cmd, workdir, result_fd=None, limits=None, usage=None, on_spawn=None, progress_path=None):
+    """
+    Yield the output of `cmd` as coalesced chunks of bytes (see
+    `pump.read_chunks`); the generator's return value is the exit code.
+    `result_fd` (the write end of a result channel) is handed to the child
+    and closed here. The child runs under `limits`; its CPU time and peak
+    RSS (from `wait4`) are stored in `usage`. `on_spawn` is called with a
+    function that stops the run. The child's progress is written to
+    `progress_path`.
+    """
+    try:
+        proc = subprocess.Popen(
+            cmd,
+            cwd=workdir,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=0,
+            pass_fds=() if result_fd is None else (result_fd,),
+            env=_child_env(result_fd, limits, progress_path),
+            start_new_session=True,
+        )
+    finally:
+        if result_fd is not None:
+            os.close(result_fd)
+    group = resources.ProcessGroup(proc.pid)
+    if on_spawn is not None:
+        on_spawn(group.terminate)
+    deadline = resources.Deadline(limits, group.terminate)
+    try:
+        yield from pump.read_chunks(proc.stdout.fileno())
+    except GeneratorExit:
+        # Nobody reads the output any more; don't leave the run going.
+        group.terminate()
+        raise
+    finally:
+        proc.stdout.close()
+        deadline.cancel()
+    run_usage = resources.reap(proc)
+    group.close()
+    if usage is not None:
+        usage.update(run_usage)
+    return_code = proc.returncode
+    note = resources.exit_note(limits, return_code, deadline)
+    if note:
+        yield note.encode("utf-8")
+    if return_code != 0:
+        yield f"\n[Process exited with code {return_code}]\n".encode("utf-8")
+    return return_code
+
+
+async def astream_subprocess(
+    cmd, workdir, status=None, result_fd=None, limits=None, on_spawn=None, progress_path=None
+):
+    """
+    Async counterpart of `stream_subprocess` built on asyncio subprocess
+    pipes. Reads are non-blocking, and since the pipe is only read as fast as
+    the consumer pulls, a slow consumer makes the child block on write
+    (backpressure) instead of buffering unbounded output here.
+    The exit code is stored in `status["returncode"]`. asyncio reaps the
+    child itself, so no `wait4` usage is recorded here (the dispatcher's own
+    report is used instead). `on_spawn` and `progress_path` are as for
+    `stream_subprocess`.
+    """
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            cwd=workdir,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            pass_fds=() if result_fd is None else (result_fd,),
+            env=_child_env(result_fd, limits, progress_path),
+            start_new_session=True,
+        )
+    finally:
+        if result_fd is not None:
+            os.close(result_fd)
+    group = resources.ProcessGroup(proc.pid)
+    if on_spawn is not None:
+        on_spawn(group.terminate)
+    deadline = resources.Deadline(limits, group.terminate)
+    try:
+        async for chunk in pump.aread_chunks(proc.stdout):
+            yield chunk
+        return_code = await proc.wait()
+    finally:
+        deadline.cancel()
+        if proc.returncode is None:
+            group.kill()
+            await proc.wait()
+        group.close()
+    if status is not None:
+        status["returncode"] = return_code
+    note = resources.exit_note(limits, return_code, deadline)
+    if note:
+        yield note.encode("utf-8")
+    if return_code != 0:
+        yield f"\n[Process exited with code {return_code}]\n".encode("utf-8")
+
+
+def _drain(stream, job):
+    """
+    Forward every chunk of `stream` to the job (within the output cap) and
+    return the stream's return value (the exit code).
+    """
+    cap = pump.OutputCap(job.emit)
+    try:
+        while True:
+            try:
+                cap.write(next(stream))
+            except StopIteration as stop:
+                return stop.value
+    finally:
+        cap.close()
+
+
+def receive_channel(job, data):
+    """
+    Keep what a run sent over its result channel: the structured result and
+    profile (stored next to the run log) and the dispatcher's run metrics.
+    """
+    for kind, payload in channel.read_frames(data):
+        try:
+            if kind == channel.FRAME_METRICS:
+                job.dispatcher_metrics = json.loads(payload)
+            elif kind in (channel.FRAME_VALUE, channel.FRAME_FILE):
+                job.result = channel.store_result(kind, payload, job.log.result_path)
+            elif kind == channel.FRAME_PROFILE:
+                report = channel.store_profile(payload, job.log.profile_prefix)
+                job.profile = {"mode": report["mode"], "unit": report["unit"], "totals": report["totals"]}
+        except (OSError, ValueError) as e:
+            logger.warning("Could not store channel data of job %s: %s", job.id, e)
+
+
+def run_subprocess(job):
+    script_module_arg, workdir = split_script(job.script)
+    cmd = build_command(script_module_arg, job.function, job_args(job))
+    job.emit(f"Running: {' '.join(cmd)}\n\n")
+    read_fd, write_fd = channel.open_channel()
+    usage = {}
+    try:
+        stream = stream_subprocess(cmd, workdir, write_fd, job.limits, usage, job.stop_with, job.log.progress_path)
+        return _drain(stream, job)
+    finally:
+        job.usage = usage or None
+        receive_channel(job, channel.read_available(read_fd))
+
+
+def run_pool(job):
+    script_module_arg, workdir = split_script(job.script)
+    func_args = job_args(job)
+    cmd = build_command(script_module_arg, job.function, func_args)
+    pool = get_pool()
+    try:
+        sock = pool.submit(script_module_arg, job.function, func_args, workdir, job.limits, job.log.progress_path)
+    except PoolUnavailable as e:
+        logger.warning("Worker pool unavailable, using a subprocess: %s", e)
+        return run_subprocess(job)
+    job.stop_with(lambda: pool.cancel(sock))
+    job.emit(f"Running (pool): {' '.join(cmd)}\n\n")
+    return _drain(pool.stream(sock, on_result=lambda data: receive_channel(job, data), on_usage=_set_usage(job)), job)
+
+
+def _set_usage(job):
+    def on_usage(payload):
+        job.usage = json.loads(payload)
+
+    return on_usage
+
+
+def run_agent(job, hub):
+    """
+    Run `job` on the worker agent `hub` reserved for it (see agents.py).
+    Raises agents.AgentLost if the agent goes away; the queue then requeues
+    the job.
+    """
+    script_module_arg, _ = split_script(job.script)
+    entry = get_catalog().file(job.script)
+    spec = {
+        "job_id": job.id,
+        "script": job.script,
+        "function": job.function,
+        "args": [str(a) for a in job_args(job)],
+        "sha1": entry["sha1"] if entry else None,
+        "limits": job.limits,
+    }
+    job.stop_with(lambda: hub.cancel(job.id))
+    job.emit(f"Running on agent {job.agent}: dispatcher.py --script {script_module_arg} --function {job.function}\n\n")
+    stream = hub.stream(job, spec, on_result=lambda data: receive_channel(job, data), on_usage=_set_usage(job))
+    return _drain(stream, job)
+
+
+EXECUTORS = {
+    "subprocess": run_subprocess,
+    "pool": run_pool,
+}
+
+
+def execute(job):
+    """
+    Run `job` with the configured executor and return its exit code.
+    """
+    if job.in_process:
+        return inprocess.run(job)
+    return EXECUTORS.get(EXECUTOR, run_subprocess)(job)
+
+
+async def arun_subprocess(job):
+    script_module_arg, workdir = split_script(job.script)
+    cmd = build_command(script_module_arg, job.function, job_args(job))
+    job.emit(f"Running: {' '.join(cmd)}\n\n")
+    status = {}
+    read_fd, write_fd = channel.open_channel()
+    cap = pump.OutputCap(job.emit)
+    try:
+        stream = astream_subprocess(
+            cmd, workdir, status, write_fd, job.limits, job.stop_with, job.log.progress_path
+        )
+        async for chunk in stream:
+            cap.write(chunk)
+    finally:
+        cap.close()
+        receive_channel(job, channel.read_available(read_fd))
+    return status.get("returncode", 1)
+
+
+ASYNC_EXECUTORS = {
+    "subprocess": arun_subprocess,
+}
+
+
+async def aexecute(job):
+    """
+    Event-loop version of `execute()`. Executors without an async variant
+    run in the loop's default thread pool.
+    """
+    runner = ASYNC_EXECUTORS.get(EXECUTOR)
+    if runner is not None and not job.in_process:
+        return await runner(job)
+    return await asyncio.get_running_loop().run_in_executor(None, execute, job)
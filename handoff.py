@@ -0,0 +1,197 @@
+"""
+Hand-off of return values between pipeline steps.
+
+A step's return value is pickled into a checkpoint file (written through a
+memory map, like a spilled result; see `channel.py`), and a downstream step
+receives its kwargs as an inputs file (`write_inputs()`) with three parts:
+  - "values": the kwargs as JSON, passed to the function as they are;
+  - "refs": references to upstream results the server placed in them,
+    each with where it goes ("at": [kwarg, key, ...]):
+        {"at": ["buckets"], "$ref": "list_buckets", "path": ["Buckets", 0],
+         "checkpoint": "<file>"}
+  - "files": uploaded files by kwarg, {"$file": path, "as": "path" | "buffer"}
+    (see `paramtypes.py`).
+`resolve_inputs()` puts the (part of the) upstream value each reference
+names at its place, unpickled straight from the memory-mapped checkpoint,
+and each uploaded file's path or a memory map of it. Values never travel
+through a run's output or the JSON result encoding, so their Python types
+survive. Steps running in-process (see `inprocess.py`) also keep their
+values in memory (`_live`), and in-process steps downstream get the very
+same objects without unpickling.
+
+Only the server writes references and file entries, never from a client's
+values, and it only reads inputs files, checkpoints and uploads under
+CHECKPOINT_DIR and `paramtypes.UPLOAD_DIR`: checkpoints are unpickled, so
+they are trusted input. References only follow keys and indices.
+"""
+import collections
+import json
+import mmap
+import os
+import pickle
+import threading
+
+import paramtypes
+from runlog import STATE_DIR
+
+# Pipelines' checkpoints and inputs files (see pipelines.py).
+CHECKPOINT_DIR = os.environ.get("SCRIPTER_PIPELINE_DIR", os.path.join(STATE_DIR, "pipelines"))
+# In-process values kept in memory, by checkpoint path.
+LIVE_VALUES = 64
+
+_live = collections.OrderedDict()
+_live_lock = threading.Lock()
+
+
+class HandoffError(ValueError):
+    """
+    An inputs file or checkpoint that can't be used.
+    """
+
+
+def save_checkpoint(value, path, keep_live=False):
+    """
+    Pickle `value` into `path` (atomically). With `keep_live`, later
+    `load_checkpoint(path)` calls in this process return `value` itself.
+    """
+    _trusted(path, CHECKPOINT_DIR)
+    data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path = f"{path}.tmp"
+    fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        os.ftruncate(fd, len(data))
+        if data:
+            with mmap.mmap(fd, len(data)) as mm:
+                mm[:] = data
+    finally:
+        os.close(fd)
+    os.replace(tmp_path, path)
+    if keep_live:
+        with _live_lock:
+            _live[path] = value
+            _live.move_to_end(path)
+            while len(_live) > LIVE_VALUES:
+                _live.popitem(last=False)
+    return len(data)
+
+
+def load_checkpoint(path):
+    """
+    The value saved in the checkpoint at `path` (under CHECKPOINT_DIR).
+    """
+    _trusted(path, CHECKPOINT_DIR)
+    with _live_lock:
+        if path in _live:
+            _live.move_to_end(path)
+            return _live[path]
+    try:
+        with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return pickle.loads(mm)
+    except (OSError, ValueError, pickle.UnpicklingError, EOFError) as e:
+        raise HandoffError(f"cannot read checkpoint {path}: {e}")
+
+
+def forget(paths):
+    """
+    Drop in-memory values of checkpoints that are about to be replaced.
+    """
+    with _live_lock:
+        for path in paths:
+            _live.pop(path, None)
+
+
+def is_ref(value):
+    return isinstance(value, dict) and "$ref" in value
+
+
+def _trusted(path, *directories):
+    if not isinstance(path, str) or not paramtypes.inside(path, *directories):
+        raise HandoffError(f"{path!r} is not a file the server handed over")
+    return path
+
+
+def walk(value, path):
+    """
+    Follow `path` (dict keys and list/tuple indices) into `value`. Paths
+    come from the client's pipeline spec, so attributes are never followed.
+    """
+    for key in path:
+        try:
+            if isinstance(value, (list, tuple)):
+                value = value[int(key)]
+            elif isinstance(value, dict) and key not in value and str(key).lstrip("-").isdigit():
+                value = value[int(key)]
+            elif isinstance(value, dict):
+                value = value[key]
+            else:
+                raise TypeError(key)
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise HandoffError(f"no {key!r} in {type(value).__name__} value")
+    return value
+
+
+def write_inputs(path, values, refs=(), files=None):
+    """
+    Write an inputs file (atomically): `values` are kwargs passed as they
+    are, `refs` references to place in them (each with its "at") and
+    `files` uploaded files by kwarg.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump({"values": values, "refs": list(refs), "files": files or {}}, fh, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _place(values, at, value):
+    # Put `value` at location `at` ([kwarg, key, ...]) within `values`.
+    if not isinstance(at, list) or not at:
+        raise HandoffError(f"invalid reference location: {at!r}")
+    container = values
+    for key in at[:-1]:
+        try:
+            container = container[key] if isinstance(container, dict) else container[int(key)]
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise HandoffError(f"invalid reference location: {at!r}")
+    try:
+        if isinstance(container, list):
+            container[int(at[-1])] = value
+        elif isinstance(container, dict):
+            container[at[-1]] = value
+        else:
+            raise TypeError(at[-1])
+    except (IndexError, ValueError, TypeError):
+        raise HandoffError(f"invalid reference location: {at!r}")
+
+
+def resolve_inputs(path):
+    """
+    Read an inputs file and return its kwargs with references and uploaded
+    files resolved.
+    """
+    try:
+        _trusted(path, paramtypes.UPLOAD_DIR, CHECKPOINT_DIR)
+        with open(path, "r", encoding="utf-8") as fh:
+            inputs = json.load(fh)
+    except (OSError, ValueError) as e:
+        raise HandoffError(f"cannot read inputs {path}: {e}")
+    if not isinstance(inputs, dict) or not isinstance(inputs.get("values"), dict):
+        raise HandoffError(f"inputs {path} must be a JSON object with 'values'")
+    values = inputs["values"]
+    checkpoints = {}
+    for ref in inputs.get("refs") or ():
+        checkpoint = ref.get("checkpoint")
+        if checkpoint not in checkpoints:
+            checkpoints[checkpoint] = load_checkpoint(checkpoint)
+        try:
+            value = walk(checkpoints[checkpoint], ref.get("path") or [])
+        except HandoffError as e:
+            raise HandoffError(f"{ref.get('$ref')}: {e}")
+        _place(values, ref.get("at"), value)
+    for name, upload in (inputs.get("files") or {}).items():
+        if not paramtypes.is_file(upload):
+            raise HandoffError(f"invalid file entry for {name!r}")
+        try:
+            values[name] = paramtypes.open_file(upload)
+        except ValueError as e:
+            raise HandoffError(str(e))
+    return values
@@ -0,0 +1,581 @@
+"""
+Run history: an embedded SQLite store of every finished run.
+
+Each run's script, function, parameters, status, timings, final progress
+and where its output lives go into `runs` (indexed by script/function/time, by time and by
+status); its output lines go into `log_lines`, with an FTS5 index over their
+text, so `search()` finds a phrase among millions of lines in milliseconds.
+The database runs in WAL mode: one writer thread (fed by `record()`) does
+all inserts and retention in batched transactions while any number of
+request threads read concurrently.
+
+Retention, applied every RETENTION_INTERVAL seconds:
+  - after COMPACT_AFTER_DAYS, logs bigger than twice COMPACT_KEEP_BYTES are
+    compacted to their first and last COMPACT_KEEP_BYTES (their lines stay
+    searchable);
+  - after OUTPUT_MAX_AGE_DAYS, or oldest first while all kept output is over
+    OUTPUT_MAX_BYTES, a run's output files and indexed lines are evicted;
+  - after MAX_AGE_DAYS the run is forgotten altogether.
+The run's row says which happened (`output_state`).
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from runlog import RUNS_DIR, STATE_DIR, RunLog
+
+logger = logging.getLogger(__name__)
+
+# "0" turns the history off.
+ENABLED = os.environ.get("SCRIPTER_HISTORY", "1") != "0"
+DB_PATH = os.environ.get("SCRIPTER_HISTORY_DB", os.path.join(STATE_DIR, "history.db"))
+# Output indexed per run; lines past this are stored but not searchable.
+INDEX_MAX_BYTES = int(os.environ.get("SCRIPTER_HISTORY_INDEX_BYTES", str(16 * 1024 * 1024)))
+# Longer lines are indexed up to this many characters.
+MAX_LINE_CHARS = 2000
+# Retention (0 = never).
+COMPACT_AFTER_DAYS = float(os.environ.get("SCRIPTER_HISTORY_COMPACT_DAYS", "7"))
+COMPACT_KEEP_BYTES = int(os.environ.get("SCRIPTER_HISTORY_COMPACT_KEEP_BYTES", str(256 * 1024)))
+OUTPUT_MAX_AGE_DAYS = float(os.environ.get("SCRIPTER_HISTORY_OUTPUT_DAYS", "30"))
+OUTPUT_MAX_BYTES = int(os.environ.get("SCRIPTER_HISTORY_OUTPUT_MAX_BYTES", str(10 * 1024 ** 3)))
+MAX_AGE_DAYS = float(os.environ.get("SCRIPTER_HISTORY_MAX_DAYS", "365"))
+RETENTION_INTERVAL = float(os.environ.get("SCRIPTER_HISTORY_RETENTION_INTERVAL", "3600"))
+# Rows per page of `runs()` / `search()`, and their maximum.
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+FULL, COMPACTED, EVICTED = "full", "compacted", "evicted"
+_DAY = 86400
+_BATCH_LINES = 5000
+
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    seq INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    script TEXT NOT NULL,
+    function TEXT NOT NULL,
+    params TEXT,
+    options TEXT,
+    status TEXT,
+    exit_code INTEGER,
+    error TEXT,
+    cancelled TEXT,
+    agent TEXT,
+    in_process INTEGER,
+    created_at REAL,
+    started_at REAL,
+    finished_at REAL,
+    duration REAL,
+    output_bytes INTEGER,
+    output_lines INTEGER,
+    indexed_lines INTEGER,
+    log_path TEXT,
+    output_state TEXT,
+    stored_bytes INTEGER,
+    result TEXT,
+    metrics TEXT,
+    usage TEXT,
+    progress TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_script_function_time ON runs (script, function, created_at);
+CREATE INDEX IF NOT EXISTS runs_function_time ON runs (function, created_at);
+CREATE INDEX IF NOT EXISTS runs_time ON runs (created_at);
+CREATE INDEX IF NOT EXISTS runs_status_time ON runs (status, created_at);
+CREATE TABLE IF NOT EXISTS log_lines (
+    id INTEGER PRIMARY KEY,
+    run_seq INTEGER NOT NULL,
+    line INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS log_lines_run ON log_lines (run_seq);
+CREATE VIRTUAL TABLE IF NOT EXISTS log_fts USING fts5 (
+    text, content='log_lines', content_rowid='id', tokenize='unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS log_lines_insert AFTER INSERT ON log_lines BEGIN
+    INSERT INTO log_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS log_lines_delete AFTER DELETE ON log_lines BEGIN
+    INSERT INTO log_fts (log_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+"""
+
+# Columns added after the first schema version: name -> type.
+ADDED_COLUMNS = {"progress": "TEXT"}
+
+_JSON_COLUMNS = ("params", "options", "result", "metrics", "usage", "progress")
+_COLUMNS = (
+    "id", "script", "function", "params", "options", "status", "exit_code", "error", "cancelled", "agent",
+    "in_process", "created_at", "started_at", "finished_at", "duration", "output_bytes", "output_lines",
+    "indexed_lines", "log_path", "output_state", "stored_bytes", "result", "metrics", "usage", "progress",
+)
+
+
+class BadQuery(ValueError):
+    """
+    A search query or filter SQLite can't use.
+    """
+
+
+def fts_query(text):
+    """
+    Turn free text into an FTS5 query: every word must appear (as a prefix
+    with a trailing `*`); "quoted phrases" must appear as written. Words
+    without letters or digits can't be matched and are left out.
+    """
+    terms = []
+    for idx, part in enumerate(text.split('"')):
+        if idx % 2:
+            if any(char.isalnum() for char in part):
+                terms.append('"' + part.strip() + '"')
+            continue
+        for word in part.split():
+            prefix = word.endswith("*")
+            word = word.rstrip("*").replace('"', "")
+            if any(char.isalnum() for char in word):
+                terms.append(f'"{word}"' + ("*" if prefix else ""))
+    return " AND ".join(terms)
+
+
+def _split_marks(marked):
+    """
+    Split the output of FTS5 `highlight()` (matches between \\x02 and \\x03)
+    into the plain line and the [start, end) ranges of its matches.
+    """
+    text, matches, start = [], [], None
+    length = 0
+    for char in marked:
+        if char == "\x02":
+            start = length
+        elif char == "\x03":
+            matches.append([start, length])
+        else:
+            text.append(char)
+            length += 1
+    return "".join(text), matches
+
+
+def _row(row):
+    """
+    A `runs` row as the dict the API returns.
+    """
+    out = dict(row)
+    for key in _JSON_COLUMNS:
+        if out.get(key) is not None:
+            out[key] = json.loads(out[key])
+    out["in_process"] = bool(out.get("in_process"))
+    out.pop("seq", None)
+    return out
+
+
+def _run_values(meta, log_path, stored_bytes):
+    duration = None
+    if meta.get("finished_at") and (meta.get("started_at") or meta.get("created_at")):
+        duration = meta["finished_at"] - (meta.get("started_at") or meta["created_at"])
+    values = {
+        "id": meta["id"],
+        "script": meta.get("script", ""),
+        "function": meta.get("function", ""),
+        "status": meta.get("status"),
+        "exit_code": meta.get("exit_code"),
+        "error": meta.get("error"),
+        "cancelled": meta.get("cancelled"),
+        "agent": meta.get("agent"),
+        "in_process": int(bool(meta.get("in_process"))),
+        "created_at": meta.get("created_at"),
+        "started_at": meta.get("started_at"),
+        "finished_at": meta.get("finished_at"),
+        "duration": duration,
+        "output_bytes": meta.get("size", meta.get("output_bytes")),
+        "output_lines": meta.get("lines", meta.get("output_lines")),
+        "indexed_lines": 0,
+        "log_path": log_path,
+        "output_state": FULL,
+        "stored_bytes": stored_bytes,
+    }
+    for key in _JSON_COLUMNS:
+        values[key] = json.dumps(meta.get(key), default=str) if meta.get(key) is not None else None
+    return values
+
+
+class History:
+    """
+    The history database. `record()` and `apply_retention()` are queued to
+    the writer thread; the query methods read on the calling thread.
+    """
+
+    def __init__(self, path=DB_PATH, runs_dir=RUNS_DIR):
+        self.path = path
+        self.runs_dir = runs_dir
+        self._local = threading.local()
+        self._pending = queue.Queue()
+        self._last_retention = 0.0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        created = not os.path.exists(path)
+        self._db = self._connect()
+        with self._db:
+            self._db.executescript(SCHEMA)
+            self._migrate()
+            self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+        if created:
+            self._pending.put(("backfill", None))
+
+    def _migrate(self):
+        """
+        Add the columns a database created by an earlier version lacks.
+        """
+        present = {row["name"] for row in self._db.execute("PRAGMA table_info(runs)")}
+        for name, kind in ADDED_COLUMNS.items():
+            if name not in present:
+                self._db.execute(f"ALTER TABLE runs ADD COLUMN {name} {kind}")
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode = WAL")
+        db.execute("PRAGMA synchronous = NORMAL")
+        return db
+
+    def _reader(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = self._connect()
+            db.execute("PRAGMA query_only = 1")
+        return db
+
+    # -------------------------------------------------------------------------
+    # Writer side
+    # -------------------------------------------------------------------------
+    def record(self, meta):
+        """
+        Queue a finished run for recording: its metadata as written by
+        `RunLog.close()` (the job's `to_dict()` plus size and lines).
+        """
+        self._pending.put(("record", meta))
+
+    def apply_retention(self):
+        self._pending.put(("retention", None))
+
+    def flush(self, timeout=None):
+        """
+        Wait until everything queued so far is written.
+        """
+        done = threading.Event()
+        self._pending.put(("flush", done))
+        return done.wait(timeout)
+
+    def _write_loop(self):
+        while True:
+            wait = max(0.0, self._last_retention + RETENTION_INTERVAL - time.time())
+            try:
+                kind, arg = self._pending.get(timeout=wait if RETENTION_INTERVAL else None)
+            except queue.Empty:
+                kind, arg = "retention", None
+            try:
+                if kind == "record":
+                    self._insert(arg)
+                elif kind == "backfill":
+                    self._backfill()
+                elif kind == "retention":
+                    self._retention()
+                elif kind == "flush":
+                    arg.set()
+            except (sqlite3.Error, OSError) as e:
+                logger.error("Run history %s failed: %s", kind, e)
+
+    def _insert(self, meta):
+        log = RunLog.open(meta["id"], self.runs_dir)
+        values = _run_values(meta, log.path if log else None, log.size if log else 0)
+        if log is None:
+            values["output_state"] = EVICTED
+        columns = ", ".join(_COLUMNS)
+        with self._db:
+            previous = self._db.execute("SELECT seq FROM runs WHERE id = ?", (values["id"],)).fetchone()
+            if previous is not None:
+                self._db.execute("DELETE FROM log_lines WHERE run_seq = ?", (previous["seq"],))
+                self._db.execute("DELETE FROM runs WHERE seq = ?", (previous["seq"],))
+            cur = self._db.execute(
+                f"INSERT INTO runs ({columns}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                [values[key] for key in _COLUMNS],
+            )
+            seq = cur.lastrowid
+            indexed = self._index_log(seq, log.path) if log else 0
+            self._db.execute("UPDATE runs SET indexed_lines = ? WHERE seq = ?", (indexed, seq))
+
+    def _index_log(self, seq, path):
+        # Called inside the insert's transaction.
+        indexed = 0
+        budget = INDEX_MAX_BYTES
+        batch = []
+        with open(path, "rb") as fh:
+            for number, raw in enumerate(fh, start=1):
+                budget -= len(raw)
+                if budget < 0:
+                    break
+                text = raw.decode("utf-8", errors="replace").rstrip("\r\n")
+                if not text.strip():
+                    continue
+                batch.append((seq, number, text[:MAX_LINE_CHARS]))
+                if len(batch) >= _BATCH_LINES:
+                    self._db.executemany("INSERT INTO log_lines (run_seq, line, text) VALUES (?, ?, ?)", batch)
+                    indexed += len(batch)
+                    batch = []
+        if batch:
+            self._db.executemany("INSERT INTO log_lines (run_seq, line, text) VALUES (?, ?, ?)", batch)
+            indexed += len(batch)
+        return indexed
+
+    def _backfill(self):
+        """
+        Record the runs already on disk when the database is first created.
+        """
+        try:
+            names = sorted(os.listdir(self.runs_dir))
+        except OSError:
+            return
+        count = 0
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.runs_dir, name), "r", encoding="utf-8") as fh:
+                    meta = json.load(fh)
+                if meta.get("id"):
+                    self._insert(meta)
+                    count += 1
+            except (OSError, ValueError) as e:
+                logger.warning("Skipping %s in run history backfill: %s", name, e)
+        if count:
+            logger.info("Run history: recorded %d earlier runs", count)
+
+    def _retention(self, now=None):
+        now = now or time.time()
+        self._last_retention = now
+        if COMPACT_AFTER_DAYS:
+            self._compact(now - COMPACT_AFTER_DAYS * _DAY)
+        if OUTPUT_MAX_AGE_DAYS:
+            old = self._db.execute(
+                "SELECT seq, id FROM runs WHERE created_at < ? AND output_state != ?",
+                (now - OUTPUT_MAX_AGE_DAYS * _DAY, EVICTED),
+            ).fetchall()
+            for row in old:
+                self._evict(row["seq"], row["id"])
+        if OUTPUT_MAX_BYTES:
+            (kept,) = self._db.execute(
+                "SELECT COALESCE(SUM(stored_bytes), 0) FROM runs WHERE output_state != ?", (EVICTED,)
+            ).fetchone()
+            oldest = self._db.execute(
+                "SELECT seq, id, stored_bytes FROM runs WHERE output_state != ? ORDER BY created_at", (EVICTED,)
+            )
+            for row in oldest.fetchall() if kept > OUTPUT_MAX_BYTES else ():
+                if kept <= OUTPUT_MAX_BYTES:
+                    break
+                self._evict(row["seq"], row["id"])
+                kept -= row["stored_bytes"] or 0
+        if MAX_AGE_DAYS:
+            gone = self._db.execute(
+                "SELECT seq, id, output_state FROM runs WHERE created_at < ?", (now - MAX_AGE_DAYS * _DAY,)
+            ).fetchall()
+            for row in gone:
+                if row["output_state"] != EVICTED:
+                    self._evict(row["seq"], row["id"])
+                with self._db:
+                    self._db.execute("DELETE FROM runs WHERE seq = ?", (row["seq"],))
+            if gone:
+                logger.info("Run history: forgot %d runs older than %g days", len(gone), MAX_AGE_DAYS)
+
+    def _compact(self, cutoff):
+        rows = self._db.execute(
+            "SELECT seq, id, stored_bytes FROM runs WHERE created_at < ? AND output_state = ? AND stored_bytes > ?",
+            (cutoff, FULL, 2 * COMPACT_KEEP_BYTES),
+        ).fetchall()
+        for row in rows:
+            log = RunLog(row["id"], self.runs_dir)
+            try:
+                size = compact_log(log.path, COMPACT_KEEP_BYTES)
+            except OSError as e:
+                logger.warning("Could not compact the log of run %s: %s", row["id"], e)
+                continue
+            try:
+                os.remove(log.index_path)  # offsets no longer match
+            except OSError:
+                pass
+            with self._db:
+                self._db.execute(
+                    "UPDATE runs SET output_state = ?, stored_bytes = ? WHERE seq = ?", (COMPACTED, size, row["seq"])
+                )
+
+    def _evict(self, seq, run_id):
+        """
+        Delete a run's output files and indexed lines, keeping its row.
+        """
+        prefix = f"{run_id}."
+        try:
+            names = [name for name in os.listdir(self.runs_dir) if name.startswith(prefix)]
+        except OSError:
+            names = []
+        for name in names:
+            try:
+                os.remove(os.path.join(self.runs_dir, name))
+            except OSError:
+                pass
+        with self._db:
+            self._db.execute("DELETE FROM log_lines WHERE run_seq = ?", (seq,))
+            self._db.execute(
+                "UPDATE runs SET output_state = ?, stored_bytes = 0, indexed_lines = 0 WHERE seq = ?", (EVICTED, seq)
+            )
+
+    # -------------------------------------------------------------------------
+    # Queries
+    # -------------------------------------------------------------------------
+    def get(self, run_id):
+        row = self._reader().execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+        return _row(row) if row is not None else None
+
+    def runs(self, script=None, function=None, status=None, since=None, until=None, before=None, limit=PAGE_SIZE):
+        """
+        One page of runs, newest first, with optional filters. `before` is
+        the `next` cursor of the previous page.
+        """
+        where, args = self._filters(script, function, status, since, until)
+        if before:
+            try:
+                created_at, seq = before.split(":")
+                args += [float(created_at), float(created_at), int(seq)]
+            except ValueError:
+                raise BadQuery(f"invalid cursor: {before!r}")
+            where.append("(created_at < ? OR (created_at = ? AND seq < ?))")
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        sql = "SELECT * FROM runs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC, seq DESC LIMIT ?"
+        rows = self._reader().execute(sql, args + [limit + 1]).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            "runs": [_row(row) for row in rows],
+            "next": f"{rows[-1]['created_at']!r}:{rows[-1]['seq']}" if more else None,
+        }
+
+    def search(self, text, script=None, function=None, status=None, since=None, until=None, before=None,
+               limit=PAGE_SIZE, raw=False):
+        """
+        Log lines matching `text` (see `fts_query`; `raw` passes FTS5 syntax
+        through), newest first, each with its run. `before` is the `next`
+        cursor of the previous page.
+        """
+        query = text if raw else fts_query(text)
+        if not query.strip():
+            return {"query": text, "hits": [], "next": None}
+        where, args = self._filters(script, function, status, since, until, table="r")
+        where.insert(0, "log_fts MATCH ?")
+        args.insert(0, query)
+        if before:
+            try:
+                args.append(int(before))
+            except ValueError:
+                raise BadQuery(f"invalid cursor: {before!r}")
+            where.append("log_fts.rowid < ?")
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        sql = (
+            "SELECT log_fts.rowid AS hit, l.line, highlight(log_fts, 0, char(2), char(3)) AS marked, r.* "
+            "FROM log_fts JOIN log_lines l ON l.id = log_fts.rowid JOIN runs r ON r.seq = l.run_seq "
+            f"WHERE {' AND '.join(where)} ORDER BY log_fts.rowid DESC LIMIT ?"
+        )
+        started = time.perf_counter()
+        try:
+            rows = self._reader().execute(sql, args + [limit + 1]).fetchall()
+        except sqlite3.OperationalError as e:
+            raise BadQuery(str(e))
+        more = len(rows) > limit
+        rows = rows[:limit]
+        hits = []
+        for row in rows:
+            line, matches = _split_marks(row["marked"])
+            hit = {"line": row["line"], "text": line, "matches": matches}
+            hit["run"] = _row({k: row[k] for k in row.keys() if k not in ("hit", "line", "marked")})
+            hits.append(hit)
+        return {
+            "query": text,
+            "hits": hits,
+            "next": str(rows[-1]["hit"]) if more else None,
+            "took_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+
+    def stats(self):
+        db = self._reader()
+        row = db.execute(
+            "SELECT COUNT(*) AS runs, COALESCE(SUM(stored_bytes), 0) AS stored_bytes, "
+            "COALESCE(SUM(indexed_lines), 0) AS indexed_lines FROM runs"
+        ).fetchone()
+        return dict(row)
+
+    @staticmethod
+    def _filters(script, function, status, since, until, table=None):
+        col = f"{table}." if table else ""
+        where, args = [], []
+        for name, value in (("script", script), ("function", function), ("status", status)):
+            if value:
+                where.append(f"{col}{name} = ?")
+                args.append(value)
+        if since is not None:
+            where.append(f"{col}created_at >= ?")
+            args.append(since)
+        if until is not None:
+            where.append(f"{col}created_at < ?")
+            args.append(until)
+        return where, args
+
+
+def compact_log(path, keep):
+    """
+    Rewrite the log at `path` as its first and last `keep` bytes with a note
+    in between (cut at line boundaries where possible). Returns the new size.
+    """
+    size = os.path.getsize(path)
+    if size <= 2 * keep:
+        return size
+    with open(path, "rb") as fh:
+        head = fh.read(keep)
+        fh.seek(size - keep)
+        tail = fh.read(keep)
+    cut = head.rfind(b"\n")
+    head = head[:cut + 1] if cut >= 0 else head
+    cut = tail.find(b"\n")
+    tail = tail[cut + 1:] if 0 <= cut < len(tail) - 1 else tail
+    note = f"\n[… {size - len(head) - len(tail)} bytes of output removed by history compaction …]\n".encode("utf-8")
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as fh:
+        fh.write(head + note + tail)
+    os.replace(tmp, path)
+    return os.path.getsize(path)
+
+
+_history = None
+_history_failed = False
+_history_lock = threading.Lock()
+
+
+def get_history():
+    """
+    Return the process-wide run history, or None if it is turned off or
+    can't be opened.
+    """
+    global _history, _history_failed
+    if not ENABLED:
+        return None
+    with _history_lock:
+        if _history is None and not _history_failed:
+            try:
+                _history = History()
+            except (sqlite3.Error, OSError) as e:
+                logger.error("Run history unavailable: %s", e)
+                _history_failed = True
+        return _history
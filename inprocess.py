@@ -0,0 +1,492 @@
+"""
+In-process execution for trusted, lightweight functions.
+
+Starting an interpreter costs far more than calling a function like
+`add(a, b)`. Functions marked `@in_process` (from `scripter`), or scripts,
+folders and functions listed in SCRIPTER_IN_PROCESS, run on a bounded pool
+of threads inside the server instead:
+  - The script module is imported once and cached; it is imported again
+    when the file changes (the catalog's content hash).
+  - `sys.stdout`, `sys.stderr` and logging are redirected per run through a
+    context variable, so concurrent runs never mix their output, and so is
+    `scripter.progress`. Output and progress of threads the function starts
+    itself are not captured.
+  - The working directory is the server's, not the script's folder (it is
+    shared by all threads); the script's folder is on `sys.path` while the
+    module is imported.
+  - A run is stopped (deadline, cancellation) by raising `RunInterrupted`
+    in its thread. A thread blocked in a C call (sleep, socket read) only
+    sees it once the call returns; a run that hasn't stopped after the
+    grace period is reported as stopped and its thread is left to finish.
+
+There is no isolation: the function shares the server's memory, so only
+use this for code you trust. Runs that need a process of their own fall
+back to the regular executors: resource limits other than a deadline,
+`@cached` and `@requires` functions, batches and profiled runs. Pipeline
+steps run in-process too; their inputs and results are handed over in
+memory (see `handoff.py`).
+"""
+import contextvars
+import ctypes
+import importlib.util
+import io
+import logging
+import os
+import pickle
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import channel
+import handoff
+import paramtypes
+import pump
+import resources
+import scripter
+from catalog import SourceDefault, find_decorator, get_catalog, signature
+from metrics import PhaseTimer
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.environ.get("SCRIPTER_SCRIPTS_DIR", os.path.join(BASE_DIR, "scripts"))
+
+# Threads running in-process calls (0 disables in-process execution).
+THREADS = int(os.environ.get("SCRIPTER_IN_PROCESS_THREADS", "4"))
+# Scripts ("AWS/test.py"), folders ("tools/") and functions
+# ("AWS/test.py:add") that run in-process without the decorator.
+LISTED = [item.strip() for item in os.environ.get("SCRIPTER_IN_PROCESS", "").split(",") if item.strip()]
+# Deadline of an in-process run without a wall_seconds limit (0 = none).
+DEFAULT_TIMEOUT = float(os.environ.get("SCRIPTER_IN_PROCESS_TIMEOUT", "30"))
+# Limits an in-process run can honour; any other limit needs a process.
+SUPPORTED_LIMITS = ("wall_seconds",)
+# Exit code of a stopped run, as for a dispatcher stopped with SIGTERM.
+INTERRUPTED_CODE = 128 + 15
+# Dispatcher options an in-process run can honour (pipeline steps).
+HANDOFF_OPTIONS = ("inputs", "checkpoint")
+# Same log format as the dispatcher's.
+LOG_FORMAT = "%(asctime)s %(levelname)s: %(message)s"
+LOG_DATEFMT = "%Y-%m-%d %H:%M:%S"
+
+
+class RunInterrupted(BaseException):
+    """
+    Raised inside an in-process run to stop it. A BaseException, so that
+    `except Exception` in the script doesn't swallow it.
+    """
+
+
+def listed(script, function):
+    """
+    Whether SCRIPTER_IN_PROCESS covers `function` in `script`.
+    """
+    for item in LISTED:
+        if item in (script, f"{script}:{function}") or (item.endswith("/") and script.startswith(item)):
+            return True
+    return False
+
+
+def eligible(script, function, func_entry, options=None, limits=None):
+    """
+    Whether a run should execute in-process: opted in (decorator or
+    SCRIPTER_IN_PROCESS) and not needing anything only a process gives.
+    """
+    if not THREADS or func_entry is None or any(key not in HANDOFF_OPTIONS for key in options or {}):
+        return False
+    if find_decorator(func_entry, "in_process") is None and not listed(script, function):
+        return False
+    if any(key not in SUPPORTED_LIMITS for key in limits or {}):
+        return False
+    return find_decorator(func_entry, "cached") is None and find_decorator(func_entry, "requires") is None
+
+
+# -----------------------------------------------------------------------------
+# Output capture
+# -----------------------------------------------------------------------------
+_current = contextvars.ContextVar("scripter_run_output", default=None)
+_install_lock = threading.Lock()
+_installed = False
+
+
+class RunOutput(io.TextIOBase):
+    """
+    A run's stdout/stderr: text is coalesced like pump.read_chunks does for
+    a pipe and handed to `write` (bytes). Once detached (the run was given
+    up on), further output is dropped.
+    """
+
+    def __init__(self, write, chunk_bytes=pump.COALESCE_BYTES, interval=pump.FLUSH_INTERVAL):
+        self._write = write
+        self._chunk_bytes = chunk_bytes
+        self._interval = interval
+        self._pending = []
+        self._size = 0
+        self._since = None
+        self._detached = False
+        self._lock = threading.Lock()
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        with self._lock:
+            if self._detached:
+                return len(text)
+            self._pending.append(text)
+            self._size += len(text)
+            if self._since is None:
+                self._since = time.monotonic()
+            due = self._size >= self._chunk_bytes or time.monotonic() - self._since >= self._interval
+        if due:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        with self._lock:
+            if not self._pending or self._detached:
+                return
+            data = "".join(self._pending).encode("utf-8", errors="replace")
+            self._pending, self._size, self._since = [], 0, None
+            self._write(data)
+
+    def detach_run(self):
+        self.flush()
+        with self._lock:
+            self._detached = True
+
+
+class _Redirect:
+    """
+    Installed as sys.stdout / sys.stderr: writes go to the current run's
+    output, or to the original stream outside runs.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, text):
+        out = _current.get()
+        return (self._stream if out is None else out).write(text)
+
+    def flush(self):
+        out = _current.get()
+        (self._stream if out is None else out).flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class _RunLogHandler(logging.Handler):
+    """
+    Sends log records emitted during a run to that run's output. Records
+    from outside runs go where they would have gone without this handler.
+    """
+
+    def __init__(self, fallback):
+        super().__init__()
+        self.fallback = fallback
+        self.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATEFMT))
+
+    def emit(self, record):
+        out = _current.get()
+        if out is not None:
+            out.write(self.format(record) + "\n")
+        elif self.fallback and record.levelno >= logging.lastResort.level:
+            logging.lastResort.handle(record)
+
+
+# Writes the run's own "=== Starting" / "Return value" lines.
+_run_logger = logging.getLogger("scripter.inprocess.run")
+_run_logger.propagate = False
+_run_logger.setLevel(logging.INFO)
+
+
+def _install():
+    """
+    Put the redirections in place (once). Script loggers log at INFO as
+    under the dispatcher, unless the server configured logging itself.
+    """
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        root = logging.getLogger()
+        unconfigured = not root.handlers
+        handler = _RunLogHandler(fallback=unconfigured)
+        root.addHandler(handler)
+        if unconfigured:
+            root.setLevel(logging.INFO)
+        _run_logger.addHandler(handler)
+        sys.stdout = _Redirect(sys.stdout)
+        sys.stderr = _Redirect(sys.stderr)
+        _installed = True
+
+
+# -----------------------------------------------------------------------------
+# Module cache
+# -----------------------------------------------------------------------------
+_modules = {}  # script -> (sha1, module)
+_import_lock = threading.Lock()
+
+
+def load_module(script, sha1):
+    """
+    The imported module of `script` (relative path), imported again if its
+    content hash changed since the last import.
+    """
+    with _import_lock:
+        cached = _modules.get(script)
+        if cached is not None and cached[0] == sha1:
+            return cached[1]
+        path = os.path.join(SCRIPTS_DIR, script)
+        name = "_scripter_inprocess." + os.path.splitext(script)[0].replace("/", ".")
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        folder = os.path.dirname(path)
+        # Sibling modules import like they do under the dispatcher.
+        sys.path.insert(0, folder)
+        sys.modules[name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            sys.modules.pop(name, None)
+            raise
+        finally:
+            sys.path.remove(folder)
+        _modules[script] = (sha1, module)
+        return module
+
+
+# -----------------------------------------------------------------------------
+# Runs
+# -----------------------------------------------------------------------------
+def _raise_in_thread(thread_id, exc_type):
+    """
+    Make `exc_type` pending in thread `thread_id` (None clears it).
+    """
+    exc = ctypes.py_object(exc_type) if exc_type is not None else ctypes.c_void_p(None)
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread_id), exc)
+
+
+class _Run:
+    """
+    One in-process call: the thread running it (while it runs) and whether
+    it was asked to stop. At most one RunInterrupted is ever raised.
+    """
+
+    def __init__(self, output, progress):
+        self.output = output
+        self.progress = progress
+        self.stop_requested = False
+        self.usage = None  # CPU time of the call, once it returned
+        self._thread_id = None
+        self._interrupted = False
+        self._lock = threading.Lock()
+
+    def interrupt(self):
+        with self._lock:
+            self.stop_requested = True
+            if self._thread_id is not None and not self._interrupted:
+                self._interrupted = True
+                _raise_in_thread(self._thread_id, RunInterrupted)
+
+    def enter(self):
+        with self._lock:
+            if self.stop_requested:
+                raise RunInterrupted()
+            self._thread_id = threading.get_ident()
+
+    def leave(self):
+        with self._lock:
+            if self._thread_id is not None:
+                _raise_in_thread(self._thread_id, None)
+            self._thread_id = None
+
+
+def _thread_cpu():
+    who = getattr(resource, "RUSAGE_THREAD", None)
+    if who is None:
+        return time.thread_time(), 0.0
+    ru = resource.getrusage(who)
+    return ru.ru_utime, ru.ru_stime
+
+
+def _kwargs(params, sig, inputs=None):
+    """
+    Convert request parameters like the dispatcher's argparse does: values
+    are parsed from their string form by annotation (see paramtypes.py),
+    literal defaults are filled in, and `inputs` (typed values, uploads and
+    pipeline steps' inputs, resolved) are passed as they are. Returns (kwargs, unknown names, error).
+    """
+    inputs = inputs or {}
+    kwargs = {}
+    for name, param in sig.parameters.items():
+        if name in inputs:
+            kwargs[name] = inputs[name]
+            continue
+        if name not in params:
+            if param.default is param.empty:
+                return None, None, f"the following arguments are required: --{name}"
+            if not isinstance(param.default, SourceDefault):
+                kwargs[name] = param.default
+            continue
+        kind = paramtypes.parser(param.annotation)
+        try:
+            kwargs[name] = kind(str(params[name]))
+        except (TypeError, ValueError):
+            return None, None, f"argument --{name}: invalid {kind.__name__} value: '{params[name]}'"
+    return kwargs, [name for name in list(params) + list(inputs) if name not in sig.parameters], None
+
+
+def _call(run, job, entry, kwargs, inputs, unknown, timer):
+    """
+    Body of a pool thread: import (or reuse) the module, call the function
+    and report like the dispatcher. Returns the exit code.
+    """
+    _current.set(run.output)
+    scripter.set_run_progress(run.progress)
+    script_arg = os.path.splitext(job.script)[0]
+    cpu_before = _thread_cpu()
+    try:
+        run.enter()
+        timer.mark("pool_wait")
+        try:
+            module = load_module(job.script, entry["sha1"])
+            func = getattr(module, job.function)
+        except Exception as e:
+            _run_logger.exception("Failed to import module '%s': %s", script_arg, e)
+            return 1
+        timer.mark("import")
+        if unknown:
+            _run_logger.warning("Ignoring unrecognized flags: %s", [f"--{name}" for name in unknown])
+        shown = {
+            name: channel.summary(value) if name in inputs and not isinstance(value, paramtypes.SCALARS) else value
+            for name, value in kwargs.items()
+        }
+        _run_logger.info("=== Starting: %s.%s with args: %s", script_arg, job.function, shown)
+        try:
+            result = func(**kwargs)
+        except Exception as e:
+            timer.mark("call")
+            _run_logger.exception("Unhandled exception in %s.%s: %s", script_arg, job.function, e)
+            return 1
+        timer.mark("call")
+        if result is not None:
+            _run_logger.info("Return value: %s", channel.summary(result))
+            _store_result(job, result)
+        if job.options.get("checkpoint"):
+            try:
+                handoff.save_checkpoint(result, job.options["checkpoint"], keep_live=True)
+            except (OSError, handoff.HandoffError, pickle.PickleError, TypeError, AttributeError, RecursionError) as e:
+                _run_logger.error("Return value could not be checkpointed for the next steps: %s", e)
+                return 1
+        _run_logger.info("=== Completed: %s.%s without errors", script_arg, job.function)
+        timer.mark("finish")
+        return 0
+    except RunInterrupted:
+        return INTERRUPTED_CODE
+    finally:
+        run.leave()
+        cpu_after = _thread_cpu()
+        run.usage = {
+            "cpu_user": round(cpu_after[0] - cpu_before[0], 6),
+            "cpu_system": round(cpu_after[1] - cpu_before[1], 6),
+            "max_rss_bytes": None,  # shared with the server
+        }
+
+
+def _store_result(job, result):
+    try:
+        payload = channel.encode_result(result)
+        job.result = channel.store_result(channel.FRAME_VALUE, payload, job.log.result_path)
+    except (TypeError, ValueError, RecursionError, OSError) as e:
+        _run_logger.warning("Return value could not be stored as a structured result: %s", e)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, THREADS), thread_name_prefix="inprocess")
+        return _pool
+
+
+def run(job):
+    """
+    Executor for in-process jobs (see executors.py): run the call on the
+    thread pool, relay its output and return its exit code.
+    """
+    _install()
+    cap = pump.OutputCap(job.emit)
+    out = RunOutput(cap.write)
+    job.emit(f"Running (in-process): {job.script} {job.function}\n\n")
+    entry = get_catalog().file(job.script)
+    func_entry = entry["functions"].get(job.function) if entry and not entry["error"] else None
+    if func_entry is None:
+        job.emit(f"[Function '{job.function}' not found in {job.script}]\n")
+        return 1
+    inputs = {}
+    if job.options.get("inputs"):
+        try:
+            inputs = handoff.resolve_inputs(job.options["inputs"])
+        except handoff.HandoffError as e:
+            job.emit(f"[Could not resolve the run's inputs: {e}]\n")
+            return 1
+    kwargs, unknown, error = _kwargs(job.params, signature(func_entry), inputs)
+    if error:
+        job.emit(f"dispatcher.py: error: {error}\n")
+        return 2
+
+    timer = PhaseTimer()
+    call = _Run(out, scripter.Progress(job.log.progress_path))
+    future = get_pool().submit(contextvars.Context().run, _call, call, job, entry, kwargs, inputs, unknown, timer)
+    job.stop_with(call.interrupt)
+    limits = dict(job.limits)
+    if DEFAULT_TIMEOUT and "wall_seconds" not in limits:
+        limits["wall_seconds"] = DEFAULT_TIMEOUT
+    deadline = resources.Deadline(limits, call.interrupt)
+    stop_seen = None
+    try:
+        while True:
+            try:
+                code = future.result(timeout=pump.FLUSH_INTERVAL)
+                break
+            except FutureTimeout:
+                out.flush()
+            except RunInterrupted:
+                # Raised just as the call was returning.
+                code = INTERRUPTED_CODE
+                break
+            if call.stop_requested:
+                stop_seen = stop_seen or time.monotonic()
+                if time.monotonic() - stop_seen > resources.TERM_GRACE_SECONDS:
+                    logger.warning("In-process run %s did not stop; leaving its thread to finish", job.id)
+                    out.detach_run()
+                    job.emit(
+                        f"\n[The call did not stop within {resources.TERM_GRACE_SECONDS:g}s; "
+                        "its thread keeps running in the background]\n"
+                    )
+                    code = INTERRUPTED_CODE
+                    break
+    finally:
+        deadline.cancel()
+        out.flush()
+        call.progress.flush()
+        cap.close()
+    job.usage = call.usage
+    job.dispatcher_metrics = dict(
+        {"started_at": timer.started_at, "finished_at": time.time(), "phases": dict(timer.phases)},
+        **(call.usage or {"cpu_user": None, "cpu_system": None, "max_rss_bytes": None}),
+    )
+    note = resources.exit_note(limits, code, deadline)
+    if note:
+        job.emit(note)
+    if code != 0:
+        job.emit(f"\n[Process exited with code {code}]\n")
+    return code
@@ -0,0 +1,652 @@
+"""
+Asynchronous job queue with admission control.
+
+Runs are submitted as jobs and return immediately with an ID. A scheduler
+thread drains the queue in priority order onto executors, honouring a global
+concurrency limit and per-script limits; submissions beyond the queue
+capacity are rejected instead of piling up. A submission identical to a job
+that is still queued or running attaches to that job (single flight), and
+every viewer follows the same run log. With worker agents connected (see
+`agents.py`), a job runs on whichever host with the tags it requires has the
+most free slots, and jobs of an agent that dies are requeued. New local runs
+wait while the host is overloaded (see `resources.HostLoad`).
+
+Jobs can be cancelled: a queued job is dropped, a running one is stopped
+through the hook its executor registered (`Job.stop_with`). A job submitted
+with `cancel_on_disconnect` is cancelled once nobody has followed its
+output for DISCONNECT_GRACE seconds, so a run whose client went away does
+not keep holding a slot.
+
+Every finished run is recorded in the run history (see `history.py`).
+"""
+import asyncio
+import bisect
+import contextlib
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import agents
+import executors
+import history
+import inprocess
+import metrics
+import resources
+from agents import AgentLost
+from catalog import find_decorator, get_catalog
+from runlog import RunLog
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of runs executing at the same time.
+MAX_CONCURRENT = int(os.environ.get("SCRIPTER_MAX_CONCURRENT", str(os.cpu_count() or 4)))
+# Maximum number of concurrent runs of the same script (0 = no per-script limit).
+PER_SCRIPT_LIMIT = int(os.environ.get("SCRIPTER_PER_SCRIPT_LIMIT", "2"))
+# Per-script overrides, e.g. "AWS/test.py=1,test/test.py=4".
+SCRIPT_LIMITS = {
+    name.strip(): int(limit)
+    for name, _, limit in (
+        item.partition("=") for item in os.environ.get("SCRIPTER_SCRIPT_LIMITS", "").split(",") if item
+    )
+}
+# Maximum number of queued (not yet running) jobs before submissions are refused.
+MAX_QUEUED = int(os.environ.get("SCRIPTER_MAX_QUEUED", "100"))
+# Number of finished jobs kept in memory for status lookups and late viewers.
+KEEP_FINISHED = int(os.environ.get("SCRIPTER_KEEP_FINISHED", "200"))
+# Attach identical submissions to an unfinished job instead of running them
+# again ("0" disables; functions opt out with `@side_effects`).
+COALESCE = os.environ.get("SCRIPTER_COALESCE", "1") != "0"
+# Seconds a `cancel_on_disconnect` job may go without viewers before it is
+# cancelled (long enough for a reloading page to re-attach).
+DISCONNECT_GRACE = float(os.environ.get("SCRIPTER_DISCONNECT_GRACE", "10"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class QueueFull(Exception):
+    """
+    Raised when a submission would exceed the queue capacity.
+    """
+
+
+class Job:
+    """
+    One requested run of `function` in `script` (path relative to scripts/,
+    including ".py") and the output it produced so far. `options` are extra
+    dispatcher flags such as {"batch-file": path, "batch-parallel": 4}.
+    """
+
+    def __init__(self, script, function, params, priority=0, options=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.script = script
+        self.function = function
+        self.params = dict(params)
+        self.priority = priority
+        self.options = dict(options or {})
+        self.status = QUEUED
+        self.exit_code = None
+        self.error = None
+        self.result = None  # header of the structured result, if one was sent
+        self.profile = None  # mode and totals of the profile, for profiled runs
+        self.dispatcher_metrics = None  # phase timings etc. reported by the dispatcher
+        self.limits = {}  # resource limits (see resources.py)
+        self.usage = None  # CPU time and peak RSS from wait4, where available
+        self.metrics = {}
+        self.key = None  # coalescing key, if identical submissions may attach
+        self.attached = 0  # identical submissions that attached to this job
+        self.requires = frozenset()  # agent tags the function requires
+        self.side_effects = False
+        self.in_process = False  # runs on the server's in-process thread pool
+        self.agent = None  # name of the agent running the job, if remote
+        self.requeues = 0
+        self.unconfirmed_losses = 0  # dropped data connections of live agents
+        self.seq = None
+        self.cancelled = None  # why the job was cancelled, if it was
+        self.cancel_on_disconnect = False
+        self.followers = 0  # viewers currently following the output
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.log = RunLog.create(self.id)
+        self._stop = None
+        self._stop_lock = threading.Lock()
+        self._done = threading.Event()
+        self._callbacks = []
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def emit(self, text):
+        """
+        Append output to the run log and wake up every viewer.
+        """
+        self.log.append(text)
+
+    def wait(self, timeout=None):
+        """
+        Block until the job finished (and its log is closed); returns
+        whether it did within `timeout` seconds.
+        """
+        return self._done.wait(timeout)
+
+    def add_done_callback(self, callback):
+        """
+        Call `callback(job)` once the job finished (right away if it has).
+        """
+        with self._stop_lock:
+            done = self._done.is_set()
+            if not done:
+                self._callbacks.append(callback)
+        if done:
+            callback(self)
+
+    def stop_with(self, stop):
+        """
+        Register how to stop the job's run (called by the executor once the
+        run started). Calls `stop` right away if the job is already
+        cancelled.
+        """
+        with self._stop_lock:
+            self._stop = stop
+            cancelled = self.cancelled is not None
+        if cancelled:
+            stop()
+
+    def stop(self, reason):
+        """
+        Mark the job cancelled and stop its run, if one started.
+        """
+        with self._stop_lock:
+            self.cancelled = reason
+            stop = self._stop
+        if stop is not None:
+            stop()
+
+    def follow(self, offset=0):
+        """
+        Yield decoded output from byte `offset`, blocking for new output until
+        the job finishes. Any number of viewers can follow the same job.
+        """
+        for _, data in self.log.follow(offset):
+            if data:
+                yield data.decode("utf-8", errors="replace")
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "script": self.script,
+            "function": self.function,
+            "params": self.params,
+            "priority": self.priority,
+            "attached": self.attached,
+            "agent": self.agent,
+            "in_process": self.in_process,
+            "requires": sorted(self.requires),
+            "requeues": self.requeues,
+            "options": self.options,
+            "status": self.status,
+            "exit_code": self.exit_code,
+            "error": self.error,
+            "cancelled": self.cancelled,
+            "cancel_on_disconnect": self.cancel_on_disconnect,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "output_bytes": self.log.size,
+            "output_lines": self.log.lines,
+            "result": self.result,
+            "profile": self.profile,
+            "limits": self.limits,
+            "usage": self.usage,
+            "metrics": self.metrics,
+            "progress": self.log.read_progress(),
+        }
+
+
+class JobQueue:
+    """
+    Priority queue of jobs plus the scheduler that drains it.
+    """
+
+    def __init__(
+        self,
+        max_concurrent=MAX_CONCURRENT,
+        per_script_limit=PER_SCRIPT_LIMIT,
+        script_limits=None,
+        max_queued=MAX_QUEUED,
+        execute=executors.execute,
+        coalesce=COALESCE,
+        hub=None,
+        execute_remote=executors.run_agent,
+        host_load=None,
+    ):
+        self.max_concurrent = max_concurrent
+        self.per_script_limit = per_script_limit
+        self.script_limits = dict(SCRIPT_LIMITS if script_limits is None else script_limits)
+        self.max_queued = max_queued
+        self.execute = execute
+        self.coalesce = coalesce
+        self.hub = hub
+        self.execute_remote = execute_remote
+        self.host_load = resources.HostLoad() if host_load is None else host_load
+        self._held_back = None  # why new local runs are waiting, if they are
+        self._loop = None
+        self._aexecute = None
+        self._jobs = {}
+        self._inflight = {}  # coalescing key -> unfinished job
+        self._finished_ids = []
+        self._queue = []  # sorted list of (-priority, seq, job)
+        self._running = {}  # script -> number of running jobs
+        self._running_total = 0
+        self._running_local = 0
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._scheduler = threading.Thread(target=self._schedule_loop, name="job-scheduler", daemon=True)
+        self._scheduler.start()
+        if hub is not None:
+            hub.on_change = self._kick
+
+    # -------------------------------------------------------------------------
+    # Public API
+    # -------------------------------------------------------------------------
+    def submit(self, script, function, params, priority=0, options=None, timeout=None, cancel_on_disconnect=False):
+        """
+        Queue a run and return its Job right away. `timeout` (seconds)
+        tightens the run's wall-clock limit; with `cancel_on_disconnect` the
+        run is cancelled once nobody follows it any more (see `following`).
+        Raises QueueFull when the queue is at capacity.
+        """
+        settings = _job_settings(get_catalog().file(script), script, function, options, timeout)
+        with self._lock:
+            job = self._enqueue(script, function, params, priority, options, settings)
+            job.cancel_on_disconnect = cancel_on_disconnect
+        self._watch_orphan(job)
+        return job
+
+    def submit_or_attach(
+        self, script, function, params, priority=0, options=None, timeout=None, cancel_on_disconnect=False
+    ):
+        """
+        Like `submit()`, but if an identical run (see `coalesce_key`) is
+        already queued or running, attach to it instead of queueing another.
+        Attaching without `cancel_on_disconnect` keeps the run going even
+        after its other viewers leave. Returns (job, attached).
+        """
+        entry = get_catalog().file(script)
+        key = self.coalesce_key(script, function, params, options, timeout, entry=entry)
+        settings = _job_settings(entry, script, function, options, timeout)
+        with self._lock:
+            job = self._inflight.get(key) if key else None
+            if job is not None and not job.finished:
+                job.attached += 1
+                job.cancel_on_disconnect = job.cancel_on_disconnect and cancel_on_disconnect
+                return job, True
+            job = self._enqueue(script, function, params, priority, options, settings)
+            job.cancel_on_disconnect = cancel_on_disconnect
+            if key:
+                job.key = key
+                self._inflight[key] = job
+        self._watch_orphan(job)
+        return job, False
+
+    def coalesce_key(self, script, function, params, options=None, timeout=None, entry=None):
+        """
+        Identity of a run for single flight: the script's content hash, the
+        function, its arguments and deadline. None if the run must not be
+        shared (coalescing off, unknown function, or marked `@side_effects`).
+        `entry` is the script's catalog entry, if already looked up.
+        """
+        if not self.coalesce:
+            return None
+        if entry is None:
+            entry = get_catalog().file(script)
+        func = _function_entry(entry, function)
+        if func is None or find_decorator(func, "side_effects") is not None:
+            return None
+        return json.dumps(
+            [script, entry["sha1"], function, params, options or {}, timeout], sort_keys=True, default=str
+        )
+
+    def _enqueue(self, script, function, params, priority, options, settings):
+        # Called with the lock held; `settings` come from _job_settings().
+        if len(self._queue) >= self.max_queued:
+            raise QueueFull(f"queue is full ({self.max_queued} jobs waiting)")
+        job = Job(script, function, params, priority, options)
+        for name, value in settings.items():
+            setattr(job, name, value)
+        job.seq = next(self._seq)
+        self._jobs[job.id] = job
+        bisect.insort(self._queue, (-priority, job.seq, job), key=lambda e: e[:2])
+        self._wakeup.notify()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def position(self, job):
+        """
+        0-based position of a queued job, or None if it is not waiting.
+        """
+        with self._lock:
+            for idx, (_, _, queued) in enumerate(self._queue):
+                if queued is job:
+                    return idx
+        return None
+
+    def cancel(self, job, reason="cancelled by request"):
+        """
+        Cancel `job`. A queued job finishes right away; a running one is
+        stopped (its process group gets SIGTERM, then SIGKILL) and finishes
+        as cancelled once its executor returns. Returns False if the job had
+        already finished.
+        """
+        with self._lock:
+            if job.finished:
+                return False
+            queued = self._dequeue(job)
+        if queued:
+            job.cancelled = reason
+            job.emit(f"[Cancelled before it started: {reason}]\n")
+            self._finished(job, release=False)
+        else:
+            job.stop(reason)
+        logger.info("Job %s cancelled: %s", job.id, reason)
+        return True
+
+    @contextlib.contextmanager
+    def following(self, job):
+        """
+        Count a viewer of `job` (None for runs no longer in memory) while
+        the block runs. A `cancel_on_disconnect` job is cancelled once it has
+        gone DISCONNECT_GRACE seconds without viewers.
+        """
+        if job is None:
+            yield
+            return
+        with self._lock:
+            job.followers += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                job.followers -= 1
+            self._watch_orphan(job)
+
+    def _watch_orphan(self, job):
+        if job.cancel_on_disconnect and not job.followers and not job.finished:
+            timer = threading.Timer(DISCONNECT_GRACE, self._reclaim, (job,))
+            timer.daemon = True
+            timer.start()
+
+    def _reclaim(self, job):
+        with self._lock:
+            orphaned = job.cancel_on_disconnect and not job.followers and not job.finished
+        if orphaned:
+            self.cancel(job, f"nobody followed the run for {DISCONNECT_GRACE:g}s (client disconnected)")
+
+    def attach_loop(self, loop, aexecute=executors.aexecute):
+        """
+        Run jobs as coroutines on `loop` (async serving mode) instead of one
+        thread per running job.
+        """
+        with self._lock:
+            self._loop = loop
+            self._aexecute = aexecute
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "queued": len(self._queue),
+                "running": self._running_total,
+                "running_local": self._running_local,
+                "max_concurrent": self.max_concurrent,
+                "held_back": self._held_back,
+            }
+        if self.host_load.enabled:
+            stats["host"] = self.host_load.sample()
+        if self.hub is not None:
+            stats["agents"] = self.hub.stats()
+        return stats
+
+    # -------------------------------------------------------------------------
+    # Scheduling
+    # -------------------------------------------------------------------------
+    def limit_for(self, script):
+        return self.script_limits.get(script, self.per_script_limit)
+
+    def _place(self, job):
+        # Where `job` can start now: (True, None) for this host, (True, agent)
+        # for an agent, (False, None) if nowhere. The host or agent with the
+        # most free slots wins, this host on a tie.
+        local_free = self.max_concurrent - self._running_local
+        if self._held_back or (self.hub is not None and not job.requires <= agents.LOCAL_TAGS):
+            local_free = 0
+        if self.hub is not None and not job.in_process and not agents.local_only(job.options):
+            agent = self.hub.reserve(job, better_than=max(0, local_free))
+            if agent is not None:
+                return True, agent
+        return local_free > 0, None
+
+    def _next_runnable(self):
+        # Highest priority first; skip jobs whose script is at its limit or
+        # that no host can take right now.
+        for idx, (_, _, job) in enumerate(self._queue):
+            limit = self.limit_for(job.script)
+            if limit and self._running.get(job.script, 0) >= limit:
+                continue
+            placed, agent = self._place(job)
+            if placed:
+                del self._queue[idx]
+                return job, agent
+        return None, None
+
+    def _schedule_loop(self):
+        while True:
+            with self._wakeup:
+                job = None
+                while job is None:
+                    self._check_host_load()
+                    job, agent = self._next_runnable()
+                    if job is None:
+                        # While held back, look at the host load again soon.
+                        self._wakeup.wait(resources.LOAD_SAMPLE_INTERVAL if self._held_back else None)
+                self._running[job.script] = self._running.get(job.script, 0) + 1
+                self._running_total += 1
+                if agent is None:
+                    self._running_local += 1
+                job.agent = agent.name if agent is not None else None
+                loop = self._loop
+            if agent is not None:
+                threading.Thread(target=self._run, args=(job, True), name=f"job-{job.id}", daemon=True).start()
+            elif loop is not None and not loop.is_closed():
+                asyncio.run_coroutine_threadsafe(self._arun(job), loop)
+            else:
+                threading.Thread(target=self._run, args=(job,), name=f"job-{job.id}", daemon=True).start()
+
+    def _check_host_load(self):
+        # Called with the lock held.
+        held_back = self.host_load.overloaded() if self._queue else None
+        if held_back and not self._held_back:
+            logger.warning("Holding back new runs: %s", held_back)
+        elif self._held_back and not held_back:
+            logger.info("Host load is back below the thresholds; starting runs again")
+        self._held_back = held_back
+
+    def _kick(self):
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def _started(self, job):
+        job.started_at = time.time()
+        job.status = RUNNING
+
+    def _failed_to_execute(self, job, error):
+        logger.error("Job %s failed to execute: %s", job.id, error, exc_info=error)
+        job.error = str(error)
+        job.emit(f"\n[Executor error: {error}]\n")
+
+    def _dequeue(self, job):
+        # Called with the lock held.
+        for idx, (_, _, queued) in enumerate(self._queue):
+            if queued is job:
+                del self._queue[idx]
+                return True
+        return False
+
+    def _finished(self, job, release=True):
+        job.finished_at = time.time()
+        if job.exit_code == 0:
+            job.status = SUCCEEDED
+        elif job.cancelled is not None:
+            job.status = CANCELLED
+            if release:
+                job.emit(f"\n[Run cancelled: {job.cancelled}]\n")
+        else:
+            job.status = FAILED
+        job.metrics = metrics.run_breakdown(job)
+        metrics.run_metrics.observe(job)
+        job.emit(metrics.footer(job))
+        job.log.close(job.to_dict())
+        store = history.get_history()
+        if store is not None:
+            store.record(job.log.meta)
+        with job._stop_lock:
+            job._done.set()
+            callbacks, job._callbacks = job._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(job)
+            except Exception:
+                logger.exception("Done callback of job %s failed", job.id)
+        with self._wakeup:
+            if job.key and self._inflight.get(job.key) is job:
+                del self._inflight[job.key]
+            if release:
+                self._release(job)
+            self._remember_finished(job)
+            self._wakeup.notify()
+
+    def _release(self, job):
+        # Called with the lock held.
+        self._running[job.script] -= 1
+        self._running_total -= 1
+        if job.agent is None:
+            self._running_local -= 1
+        elif self.hub is not None:
+            self.hub.release(job.id)
+
+    def _requeue(self, job, error):
+        """
+        Put a job whose agent was lost back at its place in the queue.
+        Returns False if it must fail instead: requeued too often already, a
+        `@side_effects` function that may have partly run, or cancelled.
+        The first loss whose agent is still registered is not counted: it
+        may be the same crash the agent is about to be dropped for.
+        """
+        if job.cancelled is not None:
+            return False
+        if error.started and job.side_effects:
+            job.emit(f"\n[{error}; not requeued: {job.function} is marked @side_effects and may have partly run]\n")
+            return False
+        if job.requeues >= agents.MAX_REQUEUES:
+            job.emit(f"\n[{error}; not requeued again after {job.requeues} attempts]\n")
+            return False
+        job.emit(f"\n[{error}; requeueing the run]\n")
+        with self._wakeup:
+            self._release(job)
+            job.agent = None
+            if error.confirmed or job.unconfirmed_losses:
+                job.requeues += 1
+            if not error.confirmed:
+                job.unconfirmed_losses += 1
+            job.status = QUEUED
+            bisect.insort(self._queue, (-job.priority, job.seq, job), key=lambda e: e[:2])
+            self._wakeup.notify()
+        logger.warning("Job %s requeued: %s", job.id, error)
+        return True
+
+    def _run(self, job, remote=False):
+        self._started(job)
+        requeued = False
+        try:
+            if remote:
+                job.exit_code = self.execute_remote(job, self.hub)
+            else:
+                job.exit_code = self.execute(job)
+        except AgentLost as e:
+            requeued = self._requeue(job, e)
+            if not requeued:
+                self._failed_to_execute(job, e)
+        except Exception as e:
+            self._failed_to_execute(job, e)
+        finally:
+            if not requeued:
+                self._finished(job)
+
+    async def _arun(self, job):
+        self._started(job)
+        try:
+            job.exit_code = await self._aexecute(job)
+        except Exception as e:
+            self._failed_to_execute(job, e)
+        finally:
+            self._finished(job)
+
+    def _remember_finished(self, job):
+        self._finished_ids.append(job.id)
+        while len(self._finished_ids) > KEEP_FINISHED:
+            self._jobs.pop(self._finished_ids.pop(0), None)
+
+
+def _function_entry(entry, function):
+    """
+    A function's catalog entry, or None for an unknown script or function.
+    """
+    if not entry or entry["error"]:
+        return None
+    return entry["functions"].get(function)
+
+
+def _job_settings(entry, script, function, options, timeout=None):
+    """
+    Job attributes that depend on the function's catalog entry (agent tags,
+    resource limits, in-process eligibility), worked out before a job is
+    queued so the catalog is never read under the queue lock.
+    """
+    func = _function_entry(entry, function)
+    limits = resources.policy_for(script, func)
+    if timeout:
+        limits["wall_seconds"] = min(timeout, limits.get("wall_seconds", timeout))
+    return {
+        "requires": agents.required_tags(func),
+        "side_effects": func is not None and find_decorator(func, "side_effects") is not None,
+        "limits": limits,
+        "in_process": inprocess.eligible(script, function, func, options, limits),
+    }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """
+    Return the process-wide job queue (its scheduler starts on first use).
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(hub=agents.get_hub())
+        return _queue
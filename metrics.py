@@ -0,0 +1,233 @@
+"""
+Per-run timing breakdown and Prometheus-style aggregate metrics.
+
+`PhaseTimer` runs inside the dispatcher and reports how long each phase took
+(argparse, catalog lookup, import, the call itself, ...) plus CPU time and
+peak RSS over the result channel. The app adds the phases it sees from the
+outside (queue wait, process spawn, teardown), prints a one-line footer under
+the run's output and feeds `RunMetrics`, which `/metrics` renders in the
+Prometheus text format.
+"""
+import bisect
+import collections
+import resource
+import sys
+import threading
+import time
+
+# Histogram buckets (upper bounds) for durations in seconds.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Histogram buckets for peak RSS in bytes (16 MiB .. 4 GiB).
+RSS_BUCKETS = tuple(2 ** n * 1024 * 1024 for n in range(4, 13))
+# Recent runs per script kept for the p50/p95/p99 summaries.
+SUMMARY_WINDOW = 1000
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+# -----------------------------------------------------------------------------
+# Dispatcher side
+# -----------------------------------------------------------------------------
+def max_rss_bytes(usage):
+    # ru_maxrss is in KiB on Linux and in bytes on macOS.
+    return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+
+class PhaseTimer:
+    """
+    Accumulates wall time per phase: `mark(name)` charges the time since the
+    previous mark to `name`.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.phases = {}
+        self._last = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def report(self):
+        """
+        Phases plus this process's (and its children's) CPU time and peak RSS.
+        """
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return {
+            "started_at": self.started_at,
+            "finished_at": time.time(),
+            "phases": {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            "cpu_user": round(own.ru_utime + children.ru_utime, 6),
+            "cpu_system": round(own.ru_stime + children.ru_stime, 6),
+            "max_rss_bytes": max(max_rss_bytes(own), max_rss_bytes(children)),
+        }
+
+
+# -----------------------------------------------------------------------------
+# App side
+# -----------------------------------------------------------------------------
+def run_breakdown(job):
+    """
+    Combine the dispatcher's report (`job.dispatcher_metrics`, None if the
+    process died before sending one) with the phases seen from the outside:
+    queue wait, spawn (executor start until the dispatcher's main) and
+    teardown (dispatcher done until the run was reaped). CPU time and peak
+    RSS come from `wait4` (`job.usage`) where the executor reaped the run
+    itself.
+    """
+    child = job.dispatcher_metrics
+    started_at = job.started_at or job.created_at
+    finished_at = job.finished_at or time.time()
+    phases = {"queue": max(0.0, started_at - job.created_at)}
+    if child:
+        phases["spawn"] = max(0.0, child["started_at"] - started_at)
+        phases.update(child["phases"])
+        phases["teardown"] = max(0.0, finished_at - child["finished_at"])
+    else:
+        phases["run"] = finished_at - started_at
+    usage = job.usage or child
+    return {
+        "phases": {name: round(seconds, 6) for name, seconds in phases.items()},
+        "cpu_user": usage["cpu_user"] if usage else None,
+        "cpu_system": usage["cpu_system"] if usage else None,
+        "max_rss_bytes": usage["max_rss_bytes"] if usage else None,
+    }
+
+
+def _human_bytes(size):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def footer(job):
+    """
+    One-line summary printed under a finished run's output.
+    """
+    m = job.metrics
+    total = (job.finished_at or time.time()) - job.created_at
+    parts = [f"exit {job.exit_code} in {total:.3f}s"]
+    if m.get("phases"):
+        parts.append(", ".join(f"{name} {sec:.3f}s" for name, sec in m["phases"].items()))
+    if m.get("cpu_user") is not None:
+        parts.append(f"CPU {m['cpu_user']:.3f}s user / {m['cpu_system']:.3f}s sys")
+        if m.get("max_rss_bytes") is not None:
+            parts.append(f"peak RSS {_human_bytes(m['max_rss_bytes'])}")
+    parts.append(f"output {_human_bytes(job.log.size)}")
+    return f"\n[Run {job.id}: " + " | ".join(parts) + "]\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def lines(self, name, **labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            yield f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}"
+        yield f"{name}_sum{_labels(**labels)} {self.sum}"
+        yield f"{name}_count{_labels(**labels)} {cumulative}"
+
+
+class RunMetrics:
+    """
+    Process-wide aggregates over finished runs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = collections.Counter()  # (script, status) -> count
+        self.cpu_seconds = collections.Counter()  # script -> seconds
+        self.output_bytes = collections.Counter()  # script -> bytes
+        self.durations = collections.defaultdict(lambda: collections.deque(maxlen=SUMMARY_WINDOW))
+        self.duration_sums = collections.Counter()
+        self.duration_counts = collections.Counter()
+        self.phases = collections.defaultdict(lambda: _Histogram(DURATION_BUCKETS))
+        self.rss = _Histogram(RSS_BUCKETS)
+
+    def observe(self, job):
+        duration = (job.finished_at or time.time()) - (job.started_at or job.created_at)
+        m = job.metrics
+        with self._lock:
+            self.runs[(job.script, job.status)] += 1
+            self.output_bytes[job.script] += job.log.size
+            self.durations[job.script].append(duration)
+            self.duration_sums[job.script] += duration
+            self.duration_counts[job.script] += 1
+            for phase, seconds in m.get("phases", {}).items():
+                self.phases[phase].observe(seconds)
+            if m.get("cpu_user") is not None:
+                self.cpu_seconds[job.script] += m["cpu_user"] + m["cpu_system"]
+                if m.get("max_rss_bytes") is not None:
+                    self.rss.observe(m["max_rss_bytes"])
+
+    def render(self, gauges=(), counters=()):
+        """
+        Prometheus text exposition. `gauges` and `counters` are extra (name,
+        help, value) samples taken at scrape time (queue depth, catalog
+        stats, page cache hits, ...).
+        """
+        out = []
+
+        def header(name, kind, text):
+            out.append(f"# HELP {name} {text}")
+            out.append(f"# TYPE {name} {kind}")
+
+        for name, text, value in gauges:
+            header(name, "gauge", text)
+            out.append(f"{name} {value}")
+        for name, text, value in counters:
+            header(name, "counter", text)
+            out.append(f"{name} {value}")
+
+        with self._lock:
+            header("scripter_runs_total", "counter", "Finished runs by script and status.")
+            for (script, status), count in sorted(self.runs.items()):
+                out.append(f"scripter_runs_total{_labels(script=script, status=status)} {count}")
+
+            header("scripter_run_duration_seconds", "summary", "Run duration (start to finish) per script.")
+            for script, window in sorted(self.durations.items()):
+                ordered = sorted(window)
+                for q in QUANTILES:
+                    value = ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+                    out.append(f"scripter_run_duration_seconds{_labels(script=script, quantile=q)} {value}")
+                out.append(f"scripter_run_duration_seconds_sum{_labels(script=script)} {self.duration_sums[script]}")
+                out.append(f"scripter_run_duration_seconds_count{_labels(script=script)} {self.duration_counts[script]}")
+
+            header("scripter_run_phase_seconds", "histogram", "Time spent in each phase of a run.")
+            for phase, hist in sorted(self.phases.items()):
+                out.extend(hist.lines("scripter_run_phase_seconds", phase=phase))
+
+            header("scripter_run_cpu_seconds_total", "counter", "CPU time (user + system) used by runs.")
+            for script, seconds in sorted(self.cpu_seconds.items()):
+                out.append(f"scripter_run_cpu_seconds_total{_labels(script=script)} {seconds}")
+
+            header("scripter_run_output_bytes_total", "counter", "Log output produced by runs.")
+            for script, size in sorted(self.output_bytes.items()):
+                out.append(f"scripter_run_output_bytes_total{_labels(script=script)} {size}")
+
+            header("scripter_run_peak_rss_bytes", "histogram", "Peak resident memory of run processes.")
+            out.extend(self.rss.lines("scripter_run_peak_rss_bytes"))
+        return "\n".join(out) + "\n"
+
+
+run_metrics = RunMetrics()
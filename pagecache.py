@@ -0,0 +1,249 @@
+"""
+Response cache for rendered pages and small files.
+
+Pages whose content only depends on the catalog and the templates (the
+dashboard, a script's run page, docs, about) are rendered once per key: the
+caller's key (e.g. the catalog version) plus the templates' mtimes. Files
+served from `static/` and `scripts/` (folder icons, ...) are read once per
+mtime and size. Each entry keeps its body, compressed once (gzip, and brotli
+if the `brotli` package is installed), in an LRU bounded by MAX_BYTES.
+
+Responses carry a strong ETag suffixed per content encoding: a hash of the
+body for files, a hash of the cache key for pages. A page whose key matches
+the client's If-None-Match gets 304 before it is looked up or rendered.
+Pages and script files must be revalidated (`no-cache`); static URLs built
+with `url_for("static", ...)` get a `?v=<content hash>` fingerprint and are
+cached by browsers for a year.
+"""
+import collections
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+from flask import Response, abort, request, send_from_directory
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # optional: pip install brotli
+    brotli = None
+
+# Total size of cached bodies (including their compressed copies).
+MAX_BYTES = int(os.environ.get("SCRIPTER_PAGE_CACHE_BYTES", str(32 * 1024 * 1024)))
+# Larger files are streamed from disk (with werkzeug's own validators).
+MAX_FILE_BYTES = 2 * 1024 * 1024
+# Smaller bodies aren't worth compressing.
+MIN_COMPRESS_BYTES = 512
+COMPRESSIBLE = ("text/", "application/json", "application/javascript", "application/xml", "image/svg+xml")
+REVALIDATE = "no-cache"
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def compress(body):
+    """
+    Yield (content coding, compressed body), best compression, once.
+    """
+    if brotli is not None:
+        yield "br", brotli.compress(body, quality=11)
+    yield "gzip", gzip.compress(body, compresslevel=9, mtime=0)
+
+
+class Entry:
+    """
+    A cached body, its ETag and its compressed variants.
+    """
+
+    __slots__ = ("body", "etag", "mimetype", "encoded", "size")
+
+    def __init__(self, body, mimetype, etag=None):
+        self.body = body
+        self.etag = etag or hashlib.sha1(body).hexdigest()
+        self.mimetype = mimetype
+        self.encoded = {}
+        if len(body) >= MIN_COMPRESS_BYTES and mimetype.startswith(COMPRESSIBLE):
+            for coding, compressed in compress(body):
+                if len(compressed) < len(body):
+                    self.encoded[coding] = compressed
+        self.size = len(body) + sum(len(data) for data in self.encoded.values())
+
+
+class ResponseCache:
+    """
+    LRU of Entry objects, bounded by the total size of their bodies.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        """
+        The entry for `key`, or a new one from `build()` -> (body, mimetype)
+        or (body, mimetype, etag).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        # Built outside the lock; two threads may build the same entry.
+        entry = Entry(*build())
+        if entry.size <= self.max_bytes:
+            with self._lock:
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    self.bytes -= old.size
+                self._entries[key] = entry
+                self.bytes += entry.size
+                while self.bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.bytes -= evicted.size
+        return entry
+
+    def hit(self):
+        # A request answered from the client's copy, without a lookup.
+        with self._lock:
+            self.hits += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.bytes, "hits": self.hits, "misses": self.misses}
+
+
+_cache = ResponseCache()
+
+
+def get_cache():
+    return _cache
+
+
+# -----------------------------------------------------------------------------
+# Responses
+# -----------------------------------------------------------------------------
+def _coding(entry):
+    # The best encoding the client accepts, or None for the identity.
+    for coding in entry.encoded:
+        if request.accept_encodings[coding]:
+            return coding
+    return None
+
+
+def _not_modified(etag, cache_control, vary):
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    if vary:
+        response.vary.add("Accept-Encoding")
+    return response
+
+
+def respond(entry, cache_control=REVALIDATE):
+    """
+    The response for `entry`: compressed if the client accepts it, or 304
+    if the client's copy of that representation is current.
+    """
+    coding = _coding(entry)
+    etag = f"{entry.etag}-{coding}" if coding else entry.etag
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag, cache_control, bool(entry.encoded))
+    response = Response(entry.encoded[coding] if coding else entry.body, mimetype=entry.mimetype)
+    if coding:
+        response.headers["Content-Encoding"] = coding
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    if entry.encoded:
+        response.vary.add("Accept-Encoding")
+    return response
+
+
+def templates_version(folder):
+    """
+    Changes whenever a template is edited, added or removed.
+    """
+    stamps = []
+    for root, _, files in os.walk(folder):
+        for name in files:
+            try:
+                stamps.append((name, os.stat(os.path.join(root, name)).st_mtime_ns))
+            except OSError:
+                continue
+    return hashlib.sha1(repr(sorted(stamps)).encode("utf-8")).hexdigest()[:16]
+
+
+def cached_page(key, render, template_folder):
+    """
+    A page rendered by `render()` (HTML text), cached under `key` plus the
+    templates' version and the URL prefix the app is served under.
+    The ETag is derived from that key, so a client holding the current
+    version gets its 304 without the page being rendered (or even cached).
+    """
+    full_key = ("page", request.endpoint, key, templates_version(template_folder), request.script_root)
+    etag = hashlib.sha1(repr(full_key).encode("utf-8")).hexdigest()
+    for tag in (etag, *(f"{etag}-{coding}" for coding in ("br", "gzip"))):
+        if request.if_none_match.contains(tag):
+            _cache.hit()
+            return _not_modified(tag, REVALIDATE, True)
+    entry = _cache.get(full_key, lambda: (render().encode("utf-8"), "text/html", etag))
+    return respond(entry)
+
+
+def _file_entry(directory, filename):
+    # (entry, None) for a small file, (None, path) for a large one, or
+    # (None, None) if there's no such file.
+    path = safe_join(directory, filename)
+    if path is None:
+        return None, None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None, None
+    if not os.path.isfile(path):
+        return None, None
+    if st.st_size > MAX_FILE_BYTES:
+        return None, path
+
+    def read():
+        with open(path, "rb") as fh:
+            body = fh.read()
+        return body, mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    try:
+        return _cache.get(("file", path, st.st_mtime_ns, st.st_size), read), path
+    except OSError:
+        return None, None
+
+
+def fingerprint(directory, filename):
+    """
+    Short content hash of a small file, for cache-busting URLs; None if it
+    is missing or too large to cache.
+    """
+    entry, _ = _file_entry(directory, filename)
+    return entry.etag[:12] if entry is not None else None
+
+
+def send_cached_file(directory, filename, cache_control=REVALIDATE):
+    """
+    Serve a file under `directory` from the cache (404 if missing).
+    """
+    entry, path = _file_entry(directory, filename)
+    if entry is not None:
+        return respond(entry, cache_control)
+    if path is None:
+        abort(404)
+    response = send_from_directory(directory, filename)
+    response.headers["Cache-Control"] = cache_control
+    return response
@@ -0,0 +1,173 @@
+"""
+Parameter types beyond int/float/str.
+
+`kind()` classifies a parameter's annotation (a type, or the source text the
+catalog keeps):
+  - "int", "float", "str": parsed from their string form, as always;
+  - "bool": true/false, yes/no, on/off, 1/0;
+  - "json": `list` / `dict` (also `list[str]`, `typing.Dict[str, int]`, ...),
+    given as JSON;
+  - "path": `pathlib.Path` / `os.PathLike`; an uploaded file is passed as
+    its path;
+  - "buffer": `BinaryIO` / `IO[bytes]` / `mmap` / `memoryview`; an uploaded
+    file is passed as a read-only memory map of it.
+The app sends values of the STRUCTURED kinds to the dispatcher in an inputs
+file (see `handoff.py`) instead of on the command line, so they keep their
+type and their size doesn't matter. Uploads stay where they were streamed
+to on disk (under UPLOAD_DIR), listed in the inputs file's "files" as
+{"$file": path, "as": "path" | "buffer"}.
+"""
+import inspect
+import io
+import json
+import mmap
+import os
+import pathlib
+
+from runlog import STATE_DIR
+
+# Uploaded files and the inputs files of typed runs.
+UPLOAD_DIR = os.path.join(STATE_DIR, "uploads")
+
+STRUCTURED = ("bool", "json", "path", "buffer")
+FILE_KINDS = ("path", "buffer")
+# Values shown as they are in a run's "Starting" line.
+SCALARS = (bool, int, float, str, type(None))
+
+TRUE_WORDS = ("1", "true", "yes", "on", "y", "t")
+FALSE_WORDS = ("0", "false", "no", "off", "n", "f", "")
+
+_SIMPLE = {"int": "int", "float": "float", "str": "str", "bool": "bool"}
+_JSON = ("list", "dict", "List", "Dict", "Sequence", "Mapping", "MutableMapping", "MutableSequence")
+_PATHS = ("Path", "PurePath", "PosixPath", "PathLike")
+_BUFFERS = ("BinaryIO", "mmap", "memoryview", "Buffer")
+
+
+def _base_name(annotation):
+    # "typing.Dict[str, int]" -> "Dict", "pathlib.Path" -> "Path",
+    # "Optional[Path]" -> "Path", "IO[bytes]" -> "IO[bytes]".
+    text = annotation if isinstance(annotation, str) else getattr(annotation, "__name__", str(annotation))
+    text = text.replace("typing.", "").replace(" ", "").strip("'\"")
+    if text.startswith("Optional[") and text.endswith("]"):
+        text = text[len("Optional["):-1]
+    elif text.endswith("|None"):
+        text = text[:-len("|None")]
+    if text in ("IO[bytes]", "io.BufferedReader", "BufferedReader"):
+        return "BinaryIO"
+    return text.partition("[")[0].rpartition(".")[2]
+
+
+def kind(annotation):
+    """
+    The kind of a parameter with this annotation ("str" when unknown).
+    """
+    if annotation is None or annotation is inspect.Parameter.empty:
+        return "str"
+    name = _base_name(annotation)
+    if name in _SIMPLE:
+        return _SIMPLE[name]
+    if name in _JSON:
+        return "json"
+    if name in _PATHS:
+        return "path"
+    if name in _BUFFERS:
+        return "buffer"
+    return "str"
+
+
+def boolean(text):
+    """
+    Parse a bool from form / command-line text.
+    """
+    if isinstance(text, bool):
+        return text
+    word = str(text).strip().lower()
+    if word in TRUE_WORDS:
+        return True
+    if word in FALSE_WORDS:
+        return False
+    raise ValueError(f"not a boolean: {text!r}")
+
+
+def json_value(text):
+    """
+    Parse a list or object from JSON text (values already parsed pass).
+    """
+    value = json.loads(text) if isinstance(text, (str, bytes)) else text
+    if not isinstance(value, (list, dict)):
+        raise ValueError(f"expected a JSON list or object, not {type(value).__name__}")
+    return value
+
+
+def open_buffer(path):
+    """
+    A read-only memory map of the file at `path` (an empty BytesIO for an
+    empty file, which can't be mapped). It reads like a binary file and
+    slices like bytes, without reading the file into memory.
+    """
+    try:
+        with open(path, "rb") as fh:
+            if os.fstat(fh.fileno()).st_size == 0:
+                return io.BytesIO()
+            return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    except OSError as e:
+        raise ValueError(f"cannot open {path}: {e}")
+
+
+def buffer(text):
+    return open_buffer(str(text))
+
+
+PARSERS = {
+    "int": int,
+    "float": float,
+    "str": str,
+    "bool": boolean,
+    "json": json_value,
+    "path": pathlib.Path,
+    "buffer": buffer,
+}
+
+
+def parser(annotation):
+    """
+    The callable turning a command-line string into a value for a parameter
+    with this annotation (argparse's `type=`).
+    """
+    return PARSERS[kind(annotation)]
+
+
+def is_file(value):
+    return isinstance(value, dict) and "$file" in value
+
+
+def inside(path, *directories):
+    """
+    Whether `path` (symlinks resolved) is a file under one of `directories`.
+    """
+    real = os.path.realpath(path)
+    for directory in directories:
+        root = os.path.realpath(directory)
+        if os.path.commonpath([real, root]) == root and real != root:
+            return True
+    return False
+
+
+def open_file(value):
+    """
+    The value handed to the function for an uploaded file reference; only
+    files under UPLOAD_DIR are handed over.
+    """
+    if not isinstance(value.get("$file"), str) or not inside(value["$file"], UPLOAD_DIR):
+        raise ValueError(f"not an uploaded file: {value.get('$file')!r}")
+    if value.get("as") == "buffer":
+        return open_buffer(value["$file"])
+    return pathlib.Path(value["$file"])
+
+
+def reads_files(kwargs):
+    """
+    Whether any argument is a file (its content may change under the same
+    path, so such runs are never served from the result cache).
+    """
+    return any(isinstance(value, (pathlib.PurePath, mmap.mmap, io.IOBase)) for value in kwargs.values())
@@ -0,0 +1,581 @@
+"""
+Pipelines: a DAG of script functions, each step fed by the results of others.
+
+A pipeline spec names its steps; each step is a run of `function` in
+`script` whose kwargs may refer to other steps' return values:
+
+    {"name": "bucket-report", "steps": {
+        "buckets": {"script": "AWS/s3.py", "function": "list_buckets",
+                    "kwargs": {"region": "eu-west-1"}},
+        "sizes":   {"script": "AWS/s3.py", "function": "sizes",
+                    "kwargs": {"names": {"$ref": "buckets.names"}}},
+        "report":  {"script": "AWS/report.py", "function": "render",
+                    "kwargs": {"sizes": {"$ref": "sizes"}, "title": "S3"},
+                    "after": ["audit"], "timeout": 60},
+        ...}}
+
+`{"$ref": "step"}` is that step's return value, `{"$ref": "step.key.0"}` a
+part of it; `after` adds ordering without passing a value. A step runs once
+everything it depends on succeeded, as an ordinary job on the job queue (so
+concurrency limits, cancellation and the run history apply), and independent
+branches run in parallel. Values are handed over through checkpoints (see
+`handoff.py`), never through a run's output.
+
+When a step fails, the steps depending on it are skipped while independent
+branches still finish, and the pipeline fails. `resume()` runs it again from
+there: steps that succeeded keep their checkpoints and don't run again. A
+pipeline's state (`pipeline.json`) and checkpoints live in
+PIPELINE_DIR/<id>/, so pipelines interrupted by a restart can be resumed too.
+"""
+import contextlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+import executors
+import handoff
+import jobs
+from catalog import get_catalog
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_DIR = handoff.CHECKPOINT_DIR
+# Finished pipelines (and their checkpoints) are deleted after this many days (0 = never).
+KEEP_DAYS = float(os.environ.get("SCRIPTER_PIPELINE_KEEP_DAYS", "7"))
+MAX_STEPS = 100
+# Seconds between attempts to submit a step while the job queue is full.
+QUEUE_FULL_RETRY = 1.0
+
+PENDING = "pending"
+SKIPPED = "skipped"
+RUNNING = jobs.RUNNING
+SUCCEEDED = jobs.SUCCEEDED
+FAILED = jobs.FAILED
+CANCELLED = jobs.CANCELLED
+
+STEP_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_-]{0,63}$")
+PIPELINE_ID = re.compile(r"^[0-9a-f]{12}$")
+
+
+class PipelineError(ValueError):
+    """
+    An invalid pipeline spec, or an operation the pipeline's state forbids.
+    """
+
+
+# -----------------------------------------------------------------------------
+# Spec
+# -----------------------------------------------------------------------------
+def _parse_ref(value, steps, where):
+    target, _, path = str(value["$ref"]).partition(".")
+    if target not in steps:
+        raise PipelineError(f"{where}: reference to unknown step {target!r}")
+    ref = {"$ref": target}
+    if path:
+        ref["path"] = path.split(".")
+    if isinstance(value.get("path"), list):
+        ref["path"] = ref.get("path", []) + value["path"]
+    return ref
+
+
+def _parse_value(value, steps, where, refs):
+    if handoff.is_ref(value):
+        ref = _parse_ref(value, steps, where)
+        refs.add(ref["$ref"])
+        return ref
+    if isinstance(value, dict):
+        return {key: _parse_value(item, steps, where, refs) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_parse_value(item, steps, where, refs) for item in value]
+    return value
+
+
+def parse_spec(spec):
+    """
+    Validate a pipeline spec (see the module docstring) against the catalog.
+    Returns the normalised spec: every step with "kwargs" (references as
+    {"$ref": step, "path": [...]}), "deps" and "timeout", plus "order", the
+    steps in a dependency-respecting order. Raises PipelineError.
+    """
+    if not isinstance(spec, dict) or not isinstance(spec.get("steps"), dict) or not spec["steps"]:
+        raise PipelineError("a pipeline needs a non-empty 'steps' object")
+    if len(spec["steps"]) > MAX_STEPS:
+        raise PipelineError(f"a pipeline can have at most {MAX_STEPS} steps")
+    names = spec["steps"].keys()
+    catalog = get_catalog()
+    steps = {}
+    for name, step in spec["steps"].items():
+        if not STEP_NAME.match(name):
+            raise PipelineError(f"invalid step name {name!r} (letters, digits, '_' and '-')")
+        if not isinstance(step, dict):
+            raise PipelineError(f"{name}: a step must be an object")
+        script, function = step.get("script"), step.get("function")
+        if not isinstance(script, str) or not isinstance(function, str):
+            raise PipelineError(f"{name}: 'script' and 'function' are required")
+        entry = catalog.file(script)
+        if entry is None:
+            raise PipelineError(f"{name}: unknown script {script!r}")
+        if entry["error"]:
+            raise PipelineError(f"{name}: {script} does not load: {entry['error']}")
+        if function not in entry["functions"]:
+            raise PipelineError(f"{name}: {script} has no function {function!r}")
+        kwargs = step.get("kwargs") or {}
+        if not isinstance(kwargs, dict):
+            raise PipelineError(f"{name}: 'kwargs' must be an object")
+        reserved = [key for key in kwargs if key in executors.DISPATCHER_OPTIONS]
+        if reserved:
+            raise PipelineError(f"{name}: reserved parameter names: {', '.join(reserved)}")
+        after = step.get("after") or []
+        if not isinstance(after, list) or not all(isinstance(dep, str) for dep in after):
+            raise PipelineError(f"{name}: 'after' must be a list of step names")
+        timeout = step.get("timeout")
+        if timeout is not None and (not isinstance(timeout, (int, float)) or timeout <= 0):
+            raise PipelineError(f"{name}: 'timeout' must be a positive number of seconds")
+        refs = set()
+        kwargs = {key: _parse_value(value, names, f"{name}.{key}", refs) for key, value in kwargs.items()}
+        for dep in after:
+            if dep not in names:
+                raise PipelineError(f"{name}: 'after' names unknown step {dep!r}")
+        deps = sorted(refs | set(after))
+        if name in deps:
+            raise PipelineError(f"{name}: a step can't depend on itself")
+        steps[name] = {"script": script, "function": function, "kwargs": kwargs, "deps": deps, "timeout": timeout}
+    return {"name": str(spec.get("name") or ""), "steps": steps, "order": _order(steps)}
+
+
+def _order(steps):
+    # Kahn's algorithm, keeping the spec's order among ready steps.
+    remaining = {name: set(step["deps"]) for name, step in steps.items()}
+    order = []
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise PipelineError(f"dependency cycle between steps {', '.join(sorted(remaining))}")
+        for name in ready:
+            del remaining[name]
+            order.append(name)
+        for deps in remaining.values():
+            deps.difference_update(ready)
+    return order
+
+
+# -----------------------------------------------------------------------------
+# Pipeline state
+# -----------------------------------------------------------------------------
+def _new_step():
+    return {
+        "status": PENDING,
+        "job_id": None,
+        "attempts": 0,
+        "in_process": None,
+        "queued_at": None,
+        "started_at": None,
+        "finished_at": None,
+        "queue_seconds": None,
+        "run_seconds": None,
+        "phases": None,
+        "exit_code": None,
+        "error": None,
+    }
+
+
+class Pipeline:
+    """
+    One submitted pipeline and the state of each of its steps.
+    """
+
+    def __init__(self, spec, priority=0, directory=PIPELINE_DIR, pipeline_id=None):
+        self.id = pipeline_id or uuid.uuid4().hex[:12]
+        self.spec = spec
+        self.name = spec["name"] or self.id
+        self.priority = priority
+        self.status = RUNNING
+        self.error = None
+        self.resumes = 0
+        self.created_at = time.time()
+        self.started_at = self.created_at
+        self.finished_at = None
+        self.steps = {name: _new_step() for name in spec["order"]}
+        self.directory = os.path.join(directory, self.id)
+        self.cancelled = False
+        self.jobs = {}  # step -> Job, while it runs
+        self.lock = threading.Lock()
+        self.wake = threading.Event()  # set when a step's job finished
+
+    @property
+    def finished(self):
+        return self.status != RUNNING
+
+    def checkpoint_path(self, step):
+        return os.path.join(self.directory, f"{step}.pkl")
+
+    def inputs_path(self, step):
+        return os.path.join(self.directory, f"{step}.inputs.json")
+
+    def to_dict(self):
+        with self.lock:
+            steps = {}
+            for name in self.spec["order"]:
+                spec = self.spec["steps"][name]
+                steps[name] = {
+                    "script": spec["script"],
+                    "function": spec["function"],
+                    "deps": spec["deps"],
+                    **self.steps[name],
+                }
+            run_seconds = sum(step["run_seconds"] or 0 for step in self.steps.values())
+            return {
+                "id": self.id,
+                "name": self.name,
+                "status": self.status,
+                "error": self.error,
+                "priority": self.priority,
+                "resumes": self.resumes,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "wall_seconds": ((self.finished_at or time.time()) - self.started_at),
+                "step_seconds": run_seconds,
+                "order": self.spec["order"],
+                "steps": steps,
+            }
+
+    def save(self):
+        state = self.to_dict()
+        state["spec"] = self.spec
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, "pipeline.json")
+        with open(f"{path}.tmp", "w", encoding="utf-8") as fh:
+            json.dump(state, fh, indent=1, default=str)
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, pipeline_id, directory=PIPELINE_DIR):
+        """
+        A pipeline saved in `directory`, or None. One saved while it was
+        still running was interrupted by a restart: it is marked failed.
+        """
+        if not PIPELINE_ID.match(pipeline_id):
+            return None
+        try:
+            with open(os.path.join(directory, pipeline_id, "pipeline.json"), "r", encoding="utf-8") as fh:
+                state = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        pipeline = cls(state["spec"], state["priority"], directory, pipeline_id)
+        for key in ("status", "error", "resumes", "created_at", "started_at", "finished_at"):
+            setattr(pipeline, key, state[key])
+        for name in pipeline.steps:
+            saved = state["steps"].get(name, {})
+            pipeline.steps[name].update((key, saved[key]) for key in pipeline.steps[name] if key in saved)
+        if pipeline.status == RUNNING:
+            for step in pipeline.steps.values():
+                if step["status"] in (jobs.QUEUED, RUNNING):
+                    step["status"] = FAILED
+                    step["error"] = "interrupted by a server restart"
+            pipeline.status = FAILED
+            pipeline.error = "interrupted by a server restart"
+            pipeline.finished_at = time.time()
+        return pipeline
+
+
+# -----------------------------------------------------------------------------
+# Running pipelines
+# -----------------------------------------------------------------------------
+class PipelineRunner:
+    """
+    Drives pipelines: one thread per running pipeline submits each step to
+    the job queue once its dependencies succeeded.
+    """
+
+    def __init__(self, queue=None, directory=PIPELINE_DIR):
+        self._queue = queue
+        self.directory = directory
+        self._pipelines = {}
+        self._lock = threading.Lock()
+        self._cleanup()
+
+    @property
+    def queue(self):
+        if self._queue is None:
+            self._queue = jobs.get_queue()
+        return self._queue
+
+    # -------------------------------------------------------------------------
+    # Public API
+    # -------------------------------------------------------------------------
+    def submit(self, spec, priority=0):
+        """
+        Validate and start a pipeline; returns it. Raises PipelineError.
+        """
+        pipeline = Pipeline(parse_spec(spec), priority, self.directory)
+        pipeline.save()
+        with self._lock:
+            self._pipelines[pipeline.id] = pipeline
+        self._start(pipeline)
+        logger.info("Pipeline %s (%s) started with %d steps", pipeline.id, pipeline.name, len(pipeline.steps))
+        return pipeline
+
+    def get(self, pipeline_id):
+        with self._lock:
+            pipeline = self._pipelines.get(pipeline_id)
+            if pipeline is None:
+                pipeline = Pipeline.load(pipeline_id, self.directory)
+                if pipeline is not None:
+                    self._pipelines[pipeline_id] = pipeline
+            return pipeline
+
+    def list(self, limit=50):
+        """
+        The most recent pipelines (running or saved), newest first.
+        """
+        try:
+            ids = os.listdir(self.directory)
+        except OSError:
+            ids = []
+        with self._lock:
+            ids = set(ids) | set(self._pipelines)
+        pipelines = [pipeline for pipeline in map(self.get, ids) if pipeline is not None]
+        pipelines.sort(key=lambda pipeline: pipeline.created_at, reverse=True)
+        return pipelines[:limit]
+
+    def resume(self, pipeline_id):
+        """
+        Run a failed or cancelled pipeline again from where it stopped.
+        Steps that succeeded (and still have their checkpoint) are kept.
+        """
+        pipeline = self.get(pipeline_id)
+        if pipeline is None:
+            raise KeyError(pipeline_id)
+        with pipeline.lock:
+            if pipeline.status == RUNNING:
+                raise PipelineError("pipeline is still running")
+            if pipeline.status == SUCCEEDED:
+                raise PipelineError("pipeline already succeeded")
+            rerun = [
+                name
+                for name, step in pipeline.steps.items()
+                if step["status"] != SUCCEEDED or not os.path.exists(pipeline.checkpoint_path(name))
+            ]
+            for name in rerun:
+                pipeline.steps[name].update(_new_step(), attempts=pipeline.steps[name]["attempts"])
+            handoff.forget(pipeline.checkpoint_path(name) for name in rerun)
+            pipeline.status = RUNNING
+            pipeline.error = None
+            pipeline.cancelled = False
+            pipeline.resumes += 1
+            pipeline.started_at = time.time()
+            pipeline.finished_at = None
+        pipeline.save()
+        self._start(pipeline)
+        logger.info("Pipeline %s resumed; %d of %d steps to run", pipeline.id, len(rerun), len(pipeline.steps))
+        return pipeline
+
+    def cancel(self, pipeline_id, reason="pipeline cancelled"):
+        """
+        Stop a running pipeline: no more steps start and running ones are
+        cancelled. Returns False if it was not running.
+        """
+        pipeline = self.get(pipeline_id)
+        if pipeline is None:
+            raise KeyError(pipeline_id)
+        with pipeline.lock:
+            if pipeline.finished:
+                return False
+            pipeline.cancelled = reason
+            running = list(pipeline.jobs.values())
+            pipeline.wake.set()
+        for job in running:
+            self.queue.cancel(job, reason)
+        return True
+
+    def delete(self, pipeline_id):
+        """
+        Forget a finished pipeline and delete its checkpoints.
+        """
+        pipeline = self.get(pipeline_id)
+        if pipeline is None:
+            raise KeyError(pipeline_id)
+        if not pipeline.finished:
+            raise PipelineError("pipeline is still running")
+        with self._lock:
+            self._pipelines.pop(pipeline_id, None)
+        handoff.forget(pipeline.checkpoint_path(name) for name in pipeline.steps)
+        shutil.rmtree(pipeline.directory, ignore_errors=True)
+
+    # -------------------------------------------------------------------------
+    # Internals
+    # -------------------------------------------------------------------------
+    def _start(self, pipeline):
+        threading.Thread(target=self._drive, args=(pipeline,), name=f"pipeline-{pipeline.id}", daemon=True).start()
+
+    def _drive(self, pipeline):
+        try:
+            self._steps(pipeline)
+        except Exception as e:
+            logger.exception("Pipeline %s failed", pipeline.id)
+            with pipeline.lock:
+                pipeline.error = f"internal error: {e}"
+        self._conclude(pipeline)
+
+    def _steps(self, pipeline):
+        while True:
+            pipeline.wake.clear()
+            with pipeline.lock:
+                self._collect(pipeline)
+                ready = [] if pipeline.cancelled else self._ready(pipeline)
+            blocked = False
+            for name in ready:
+                try:
+                    job = self._submit_step(pipeline, name)
+                except jobs.QueueFull:
+                    blocked = True
+                    break
+                except (OSError, handoff.HandoffError) as e:
+                    with pipeline.lock:
+                        pipeline.steps[name].update(status=FAILED, error=str(e), finished_at=time.time())
+                    continue
+                with pipeline.lock:
+                    pipeline.jobs[name] = job
+                    pipeline.steps[name].update(
+                        status=job.status,
+                        job_id=job.id,
+                        attempts=pipeline.steps[name]["attempts"] + 1,
+                        in_process=job.in_process,
+                        queued_at=job.created_at,
+                    )
+                job.add_done_callback(lambda _job: pipeline.wake.set())
+                logger.info("Pipeline %s: step %s is job %s", pipeline.id, name, job.id)
+            pipeline.save()
+            with pipeline.lock:
+                if not pipeline.jobs and not blocked and (pipeline.cancelled or not self._ready(pipeline)):
+                    return
+            pipeline.wake.wait(QUEUE_FULL_RETRY if blocked else None)
+
+    def _ready(self, pipeline):
+        # Called with the pipeline's lock held. Pending steps whose
+        # dependencies all succeeded; those that can never run are skipped.
+        ready = []
+        for name in pipeline.spec["order"]:
+            step = pipeline.steps[name]
+            if step["status"] != PENDING:
+                continue
+            deps = [pipeline.steps[dep]["status"] for dep in pipeline.spec["steps"][name]["deps"]]
+            if any(status in (FAILED, SKIPPED, CANCELLED) for status in deps):
+                step.update(status=SKIPPED, error="a step it depends on did not succeed")
+            elif all(status == SUCCEEDED for status in deps):
+                ready.append(name)
+        return ready
+
+    def _collect(self, pipeline):
+        # Called with the pipeline's lock held: record steps whose job ended.
+        for name, job in list(pipeline.jobs.items()):
+            step = pipeline.steps[name]
+            if not job.finished:
+                step["status"] = job.status
+                step["started_at"] = job.started_at
+                continue
+            del pipeline.jobs[name]
+            phases = (job.metrics or {}).get("phases") or {}
+            step.update(
+                status=job.status,
+                started_at=job.started_at,
+                finished_at=job.finished_at,
+                queue_seconds=phases.get("queue"),
+                run_seconds=job.finished_at - job.started_at if job.started_at else None,
+                phases=phases,
+                exit_code=job.exit_code,
+                error=job.cancelled or job.error,
+            )
+            if job.status == SUCCEEDED and not os.path.exists(pipeline.checkpoint_path(name)):
+                step.update(status=FAILED, error="the run returned no checkpoint")
+            logger.info("Pipeline %s: step %s %s", pipeline.id, name, step["status"])
+
+    def _submit_step(self, pipeline, name):
+        spec = pipeline.spec["steps"][name]
+        params, inputs, refs = {}, {}, []
+        for key, value in spec["kwargs"].items():
+            # Plain strings and numbers go through the dispatcher's argument
+            # parsing like any form value; everything else as an input.
+            if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+                params[key] = value
+            else:
+                inputs[key] = self._bind(pipeline, value, [key], refs)
+        options = {"checkpoint": pipeline.checkpoint_path(name)}
+        if inputs:
+            handoff.write_inputs(pipeline.inputs_path(name), inputs, refs)
+            options["inputs"] = pipeline.inputs_path(name)
+        handoff.forget([options["checkpoint"]])
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(options["checkpoint"])
+        return self.queue.submit(
+            spec["script"], spec["function"], params, pipeline.priority, options, spec["timeout"]
+        )
+
+    def _bind(self, pipeline, value, at, refs):
+        # Move the (parsed) spec's references out of `value` into `refs`,
+        # with where they go and their checkpoint; None holds their place.
+        if handoff.is_ref(value):
+            refs.append({**value, "at": at, "checkpoint": pipeline.checkpoint_path(value["$ref"])})
+            return None
+        if isinstance(value, dict):
+            return {key: self._bind(pipeline, item, at + [key], refs) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._bind(pipeline, item, at + [idx], refs) for idx, item in enumerate(value)]
+        return value
+
+    def _conclude(self, pipeline):
+        with pipeline.lock:
+            for step in pipeline.steps.values():
+                if step["status"] == PENDING:
+                    step["status"] = CANCELLED if pipeline.cancelled else SKIPPED
+            statuses = [step["status"] for step in pipeline.steps.values()]
+            if pipeline.cancelled:
+                pipeline.status = CANCELLED
+                pipeline.error = pipeline.cancelled
+            elif all(status == SUCCEEDED for status in statuses) and not pipeline.error:
+                pipeline.status = SUCCEEDED
+            else:
+                pipeline.status = FAILED
+                failed = [name for name, step in pipeline.steps.items() if step["status"] == FAILED]
+                pipeline.error = pipeline.error or f"failed steps: {', '.join(failed)}"
+            pipeline.finished_at = time.time()
+        pipeline.save()
+        logger.info(
+            "Pipeline %s %s in %.2fs", pipeline.id, pipeline.status, pipeline.finished_at - pipeline.started_at
+        )
+
+    def _cleanup(self):
+        if not KEEP_DAYS:
+            return
+        cutoff = time.time() - KEEP_DAYS * 86400
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except OSError:
+                continue
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    """
+    Return the process-wide pipeline runner.
+    """
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = PipelineRunner()
+        return _runner
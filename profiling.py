@@ -0,0 +1,379 @@
+"""
+On-demand profiling of a single function call.
+
+The dispatcher wraps `func(**kwargs)` in the profiler chosen with `--profile`:
+
+- "cprofile": deterministic cProfile. The artifact is a pstats file
+  (`python -m pstats`, snakeviz, ...).
+- "tracemalloc": allocation tracking. The artifact is a tracemalloc snapshot
+  (`tracemalloc.Snapshot.load(path)`) taken near the call's memory peak, so
+  it shows what was allocated when memory use was highest.
+- "sample": a sampling profiler that records the calling thread's stack every
+  SAMPLE_INTERVAL seconds. Much lower overhead than cProfile; the artifact is
+  the collapsed stacks themselves.
+
+Every profile also yields collapsed stacks ("frame;frame;frame value" per
+line, the input format of flamegraph.pl, speedscope, ...) and a table of the
+top hotspots.
+"""
+import cProfile
+import collections
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+from catalog import SCRIPTS_DIR, STATE_DIR
+
+# Where profiles of runs without a result channel (plain CLI runs) are saved.
+PROFILE_DIR = os.path.join(STATE_DIR, "profiles")
+# Seconds between two stack samples of the "sample" profiler.
+SAMPLE_INTERVAL = float(os.environ.get("SCRIPTER_PROFILE_INTERVAL", "0.005"))
+# Stack depth recorded per allocation by the "tracemalloc" profiler.
+TRACEMALLOC_FRAMES = int(os.environ.get("SCRIPTER_PROFILE_FRAMES", "25"))
+# The "tracemalloc" profiler checks traced memory this often and snapshots it
+# again when it grew by PEAK_GROWTH since the last snapshot.
+PEAK_CHECK_INTERVAL = 0.01
+PEAK_GROWTH = 1.1
+# Rows in the hotspots table.
+TOP_N = 25
+# Caps for turning a cProfile call graph into stacks.
+MAX_DEPTH = 64
+MAX_STACKS = 20000
+
+
+def _short_path(filename):
+    if filename.startswith(SCRIPTS_DIR + os.sep):
+        return os.path.relpath(filename, SCRIPTS_DIR)
+    return os.path.basename(filename)
+
+
+def _frame_label(filename, lineno, name):
+    # ";" separates frames in the collapsed format.
+    if filename == "~":  # cProfile's marker for built-ins
+        return name.replace(";", ",")
+    return f"{name} ({_short_path(filename)}:{lineno})".replace(";", ",")
+
+
+def write_collapsed(stacks, path):
+    """
+    Write {(frame, ...): value} as collapsed stacks, heaviest first.
+    """
+    with open(path, "w", encoding="utf-8") as fh:
+        for stack, value in sorted(stacks.items(), key=lambda kv: kv[1], reverse=True):
+            if value > 0:
+                fh.write(f"{';'.join(stack)} {value}\n")
+
+
+class Profiler:
+    """
+    Base class: `call()` runs the function under the profiler, `save()`
+    writes the artifact and collapsed stacks and returns the report.
+    """
+
+    mode = None
+    unit = None
+    artifact_ext = None
+    columns = ()
+
+    def start(self):
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+    def call(self, func, kwargs):
+        self.start()
+        try:
+            return func(**kwargs)
+        finally:
+            self.stop()
+
+    def stacks(self):
+        """
+        {(outermost frame, ..., innermost frame): value in `unit`}
+        """
+        raise NotImplementedError
+
+    def hotspots(self):
+        raise NotImplementedError
+
+    def dump(self, path):
+        raise NotImplementedError
+
+    def totals(self):
+        return {}
+
+    def save(self, directory):
+        """
+        Write the profile under `directory` and return its report:
+        {"mode", "unit", "columns", "hotspots", "totals", "files"}.
+        """
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, uuid.uuid4().hex)
+        collapsed = base + ".collapsed"
+        write_collapsed(self.stacks(), collapsed)
+        artifact = collapsed
+        if self.artifact_ext != ".collapsed":
+            artifact = base + self.artifact_ext
+            self.dump(artifact)
+        return {
+            "mode": self.mode,
+            "unit": self.unit,
+            "columns": list(self.columns),
+            "hotspots": self.hotspots(),
+            "totals": self.totals(),
+            "files": {"artifact": artifact, "collapsed": collapsed},
+        }
+
+
+# -----------------------------------------------------------------------------
+# cProfile
+# -----------------------------------------------------------------------------
+class CProfiler(Profiler):
+    mode = "cprofile"
+    unit = "us"
+    artifact_ext = ".pstats"
+    columns = ("location", "calls", "self_s", "total_s")
+
+    def start(self):
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        # Leave out the profiler's own bookkeeping.
+        self.stats = {
+            func: stat for func, stat in pstats.Stats(self.profile).stats.items()
+            if func[0] != __file__ and func[2] != "<method 'disable' of '_lsprof.Profiler' objects>"
+        }
+
+    def dump(self, path):
+        self.profile.dump_stats(path)
+
+    def totals(self):
+        return {"seconds": round(sum(tt for _, _, tt, _, _ in self.stats.values()), 6)}
+
+    def hotspots(self):
+        ranked = sorted(self.stats.items(), key=lambda kv: kv[1][2], reverse=True)[:TOP_N]
+        return [
+            {
+                "location": _frame_label(*func),
+                "calls": nc,
+                "self_s": round(tt, 6),
+                "total_s": round(ct, 6),
+            }
+            for func, (_, nc, tt, ct, _) in ranked
+        ]
+
+    def stacks(self):
+        # cProfile only records caller -> callee edges, so each function's
+        # time is split over its call paths in proportion to the time each
+        # caller spent in it.
+        callees = collections.defaultdict(dict)
+        for func, (_, _, _, _, callers) in self.stats.items():
+            for caller, edge in callers.items():
+                callees[caller][func] = edge[3]
+        stacks = collections.Counter()
+
+        def walk(func, path, on_path, budget):
+            _, _, tt, ct, _ = self.stats[func]
+            ratio = min(1.0, budget / ct) if ct else 0.0
+            path = path + (_frame_label(*func),)
+            stacks[path] += round(tt * ratio * 1e6)
+            if len(path) >= MAX_DEPTH or len(stacks) >= MAX_STACKS:
+                return
+            for callee, edge_ct in callees[func].items():
+                if callee not in on_path and edge_ct * ratio >= 1e-6:
+                    walk(callee, path, on_path | {callee}, edge_ct * ratio)
+
+        for func, (_, _, _, ct, callers) in self.stats.items():
+            if not callers:
+                walk(func, (), {func}, ct)
+        return stacks
+
+
+# -----------------------------------------------------------------------------
+# tracemalloc
+# -----------------------------------------------------------------------------
+class TracemallocProfiler(Profiler):
+    mode = "tracemalloc"
+    unit = "bytes"
+    artifact_ext = ".tracemalloc"
+    columns = ("location", "size_bytes", "count")
+
+    def start(self):
+        self._stopped = threading.Event()
+        self._peak_snapshot = None
+        self._peak_size = 0
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        self._watcher = threading.Thread(target=self._watch, name="scripter-tracemalloc", daemon=True)
+        self._watcher.start()
+
+    def _watch(self):
+        # Memory freed before the call returns is gone from a final snapshot,
+        # so keep the one taken at the highest traced size seen.
+        while not self._stopped.wait(PEAK_CHECK_INTERVAL):
+            current, _ = tracemalloc.get_traced_memory()
+            if current > self._peak_size * PEAK_GROWTH:
+                self._peak_snapshot = tracemalloc.take_snapshot()
+                self._peak_size = current
+
+    def stop(self):
+        self._stopped.set()
+        self._watcher.join()
+        final = tracemalloc.take_snapshot()
+        current, self.peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.retained = current
+        snapshot = final if current >= self._peak_size else self._peak_snapshot
+        self.snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, threading.__file__),
+            tracemalloc.Filter(False, __file__),
+        ])
+
+    def dump(self, path):
+        self.snapshot.dump(path)
+
+    def totals(self):
+        stats = self.snapshot.statistics("filename")
+        return {
+            "size_bytes": sum(s.size for s in stats),
+            "count": sum(s.count for s in stats),
+            "peak_bytes": self.peak,
+            "retained_bytes": self.retained,
+        }
+
+    def hotspots(self):
+        return [
+            {
+                "location": f"{_short_path(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+                "size_bytes": stat.size,
+                "count": stat.count,
+            }
+            for stat in self.snapshot.statistics("lineno")[:TOP_N]
+        ]
+
+    def stacks(self):
+        stacks = collections.Counter()
+        for stat in self.snapshot.statistics("traceback"):
+            # Frames are ordered oldest call first; drop the dispatcher's.
+            frames = list(stat.traceback)
+            for idx in range(len(frames) - 1, -1, -1):
+                if frames[idx].filename == __file__:
+                    frames = frames[idx + 1:]
+                    break
+            path = tuple(f"{_short_path(f.filename)}:{f.lineno}".replace(";", ",") for f in frames)
+            stacks[path] += stat.size
+        return stacks
+
+
+# -----------------------------------------------------------------------------
+# Sampling
+# -----------------------------------------------------------------------------
+class SamplingProfiler(Profiler):
+    mode = "sample"
+    unit = "samples"
+    artifact_ext = ".collapsed"
+    columns = ("location", "self_samples", "total_samples", "self_pct")
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = collections.Counter()  # stack of (file, line, name) -> count
+
+    def call(self, func, kwargs):
+        # Samples are cut at this frame so they start at the profiled function.
+        self._root = sys._getframe()
+        self.start()
+        try:
+            return func(**kwargs)
+        finally:
+            self.stop()
+
+    def start(self):
+        # The sampler needs the GIL to take a sample; a shorter switch
+        # interval keeps a busy main thread from delaying it.
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._switch_interval, self.interval / 5))
+        self._thread_id = threading.get_ident()
+        self._stopped = threading.Event()
+        self._started_at = time.perf_counter()
+        self._sampler = threading.Thread(target=self._run, name="scripter-sampler", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._sampler.join()
+        sys.setswitchinterval(self._switch_interval)
+        self.duration = time.perf_counter() - self._started_at
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None and frame is not self._root:
+                code = frame.f_code
+                if code is SamplingProfiler.stop.__code__:
+                    stack = None  # the call is over, we're waiting for stop()
+                    break
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.samples[tuple(reversed(stack))] += 1
+
+    def dump(self, path):
+        write_collapsed(self.stacks(), path)
+
+    def totals(self):
+        return {
+            "samples": sum(self.samples.values()),
+            "interval_s": self.interval,
+            "duration_s": round(self.duration, 6),
+        }
+
+    def hotspots(self):
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, count in self.samples.items():
+            own[stack[-1]] += count
+            for frame in set(stack):
+                total[frame] += count
+        samples = sum(self.samples.values()) or 1
+        return [
+            {
+                "location": _frame_label(*frame),
+                "self_samples": own[frame],
+                "total_samples": total[frame],
+                "self_pct": round(100.0 * own[frame] / samples, 1),
+            }
+            for frame, _ in sorted(total.items(), key=lambda kv: (own[kv[0]], kv[1]), reverse=True)[:TOP_N]
+        ]
+
+    def stacks(self):
+        stacks = collections.Counter()
+        for stack, count in self.samples.items():
+            stacks[tuple(_frame_label(*frame) for frame in stack)] += count
+        return stacks
+
+
+PROFILERS = {
+    CProfiler.mode: CProfiler,
+    TracemallocProfiler.mode: TracemallocProfiler,
+    SamplingProfiler.mode: SamplingProfiler,
+}
+
+
+def format_hotspots(report, limit=10):
+    """
+    Plain-text hotspots table for the run log.
+    """
+    columns = report["columns"]
+    rows = [[str(row[c]) for c in columns] for row in report["hotspots"][:limit]]
+    widths = [max(len(c), *(len(r[i]) for r in rows)) if rows else len(c) for i, c in enumerate(columns)]
+    lines = ["  ".join(c.ljust(w) for c, w in zip(columns, widths))]
+    lines += ["  ".join(v.ljust(w) for v, w in zip(r, widths)) for r in rows]
+    return "\n".join(lines)
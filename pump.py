@@ -0,0 +1,152 @@
+"""
+Output pump: moves a run's output from its pipe into the run log.
+
+Output is read as raw bytes (no decoding, no splitting into lines) and
+coalesced: a chunk is handed on once COALESCE_BYTES are pending or
+FLUSH_INTERVAL has passed since its first byte arrived. A script printing
+millions of short lines then costs a handful of log writes per second, and
+one enormous line streams through in pieces instead of waiting for its
+newline. The pump only reads when its consumer asks for the next chunk, so
+if the log can't keep up the pipe fills and the script blocks on write
+(backpressure) instead of output piling up in memory; viewers read the log
+from disk at their own pace.
+
+`OutputCap` bounds what is kept of a runaway run: the first
+MAX_OUTPUT_BYTES - TAIL_BYTES bytes go to the log as they come, after that
+only the last TAIL_BYTES are kept and written when the run ends.
+"""
+import asyncio
+import os
+import selectors
+import time
+
+from runlog import utf8_safe_end
+
+# Bytes read from a pipe at a time.
+READ_SIZE = 64 * 1024
+# Pending output is handed on at this size ...
+COALESCE_BYTES = int(os.environ.get("SCRIPTER_OUTPUT_CHUNK_BYTES", str(256 * 1024)))
+# ... or this many seconds after its first byte arrived.
+FLUSH_INTERVAL = float(os.environ.get("SCRIPTER_OUTPUT_FLUSH_INTERVAL", "0.05"))
+# Output kept per run (0 = unlimited), of which the last TAIL_BYTES are
+# always kept once the limit is exceeded.
+MAX_OUTPUT_BYTES = int(os.environ.get("SCRIPTER_MAX_OUTPUT_BYTES", str(256 * 1024 * 1024)))
+TAIL_BYTES = int(os.environ.get("SCRIPTER_OUTPUT_TAIL_BYTES", str(1024 * 1024)))
+
+
+def read_chunks(fd, chunk_bytes=COALESCE_BYTES, interval=FLUSH_INTERVAL):
+    """
+    Yield coalesced chunks of bytes read from `fd` until EOF.
+    """
+    pending = []
+    pending_size = 0
+    deadline = None
+    with selectors.DefaultSelector() as selector:
+        selector.register(fd, selectors.EVENT_READ)
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if selector.select(timeout):
+                data = os.read(fd, READ_SIZE)
+                if not data:
+                    break
+                pending.append(data)
+                pending_size += len(data)
+                if deadline is None:
+                    deadline = time.monotonic() + interval
+                if pending_size < chunk_bytes and time.monotonic() < deadline:
+                    continue
+            if pending:
+                yield b"".join(pending)
+                pending, pending_size, deadline = [], 0, None
+    if pending:
+        yield b"".join(pending)
+
+
+async def aread_chunks(reader, chunk_bytes=COALESCE_BYTES, interval=FLUSH_INTERVAL):
+    """
+    Async version of `read_chunks()` for an asyncio StreamReader.
+    """
+    loop = asyncio.get_running_loop()
+    pending = []
+    pending_size = 0
+    deadline = None
+    while True:
+        if deadline is None:
+            data = await reader.read(READ_SIZE)
+        else:
+            try:
+                data = await asyncio.wait_for(reader.read(READ_SIZE), max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                data = None
+        if data == b"":
+            break
+        if data:
+            pending.append(data)
+            pending_size += len(data)
+            if deadline is None:
+                deadline = loop.time() + interval
+            if pending_size < chunk_bytes and loop.time() < deadline:
+                continue
+        if pending:
+            yield b"".join(pending)
+            pending, pending_size, deadline = [], 0, None
+    if pending:
+        yield b"".join(pending)
+
+
+class OutputCap:
+    """
+    Passes output on to `write` until `limit` bytes minus the tail (0 = no
+    limit), then only keeps the last `tail` bytes; `close()` writes those
+    with a note of how much was left out.
+    """
+
+    def __init__(self, write, limit=MAX_OUTPUT_BYTES, tail=TAIL_BYTES):
+        self.write_through = write
+        self.limit = limit
+        self.tail = min(tail, limit // 2) if limit else 0
+        self.head = limit - self.tail if limit else None
+        self.written = 0
+        self.capped = False
+        self.overflow = 0  # bytes received after the head was full
+        self._tail = bytearray()
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8", errors="replace")
+        if not self.capped:
+            if self.head is None or self.written + len(data) <= self.head:
+                self.write_through(data)
+                self.written += len(data)
+                return
+            cut = utf8_safe_end(data[:self.head - self.written])
+            self.write_through(data[:cut])
+            self.written += cut
+            data = data[cut:]
+            self.capped = True
+            self.write_through(
+                f"\n[Output limit of {self.limit} bytes reached: further output is discarded "
+                f"except the last {self.tail} bytes, shown when the run ends]\n".encode("utf-8")
+            )
+        self.overflow += len(data)
+        self._tail += data
+        if len(self._tail) > 2 * self.tail:
+            del self._tail[:len(self._tail) - self.tail]
+
+    def close(self):
+        if not self.capped:
+            return
+        kept = bytes(self._tail[-self.tail:]) if self.tail else b""
+        # Start the tail at a line (or at least a character) boundary.
+        newline = kept.find(b"\n")
+        if 0 <= newline < len(kept) - 1:
+            kept = kept[newline + 1:]
+        else:
+            while kept and kept[0] & 0xC0 == 0x80:
+                kept = kept[1:]
+        self.write_through(
+            f"\n[… {self.overflow - len(kept)} bytes of output omitted; last {len(kept)} bytes:]\n".encode("utf-8")
+            + kept
+        )
+        self.capped = False
+        self._tail = bytearray()
@@ -0,0 +1,429 @@
+"""
+Per-run resource limits, usage accounting and load-aware admission.
+
+A run's limits come from three layers:
+  - global defaults (SCRIPTER_LIMIT_* variables);
+  - the admin's policy file (SCRIPTER_RESOURCE_POLICY), a JSON object of
+    {"AWS/": {...}, "AWS/test.py": {...}} whose folder and script entries
+    override the defaults, more specific entries last;
+  - the function's own `@resource_limits(...)` decorator, which can only
+    tighten them (lower limits, higher niceness).
+
+Limits travel to the dispatcher in SCRIPTER_LIMITS and are applied there
+before the script is imported: rlimits for CPU seconds, address space and
+open files, `nice`, and on cgroup v2 hosts (SCRIPTER_CGROUP names a
+delegated cgroup) a per-run cgroup whose memory.max caps real memory. The
+wall-clock deadline is enforced by whoever started the process, which stops
+it when the time is up. Each run leads its own process group, and stopping
+a run (deadline or cancellation) tears down the whole group: SIGTERM, then
+SIGKILL after a grace period (see `ProcessGroup`). Executors reap runs with
+`wait4` and record the run's own CPU time and peak RSS.
+
+`HostLoad` lets the scheduler hold back new local runs while the host's
+load average, available memory or memory pressure (PSI) is past its
+thresholds.
+"""
+import json
+import logging
+import os
+import resource
+import signal
+import threading
+import time
+
+from metrics import max_rss_bytes
+
+logger = logging.getLogger(__name__)
+
+LIMITS_ENV = "SCRIPTER_LIMITS"
+LIMIT_KEYS = ("cpu_seconds", "memory_mb", "address_space_mb", "open_files", "wall_seconds", "nice")
+# Global defaults; unset means unlimited.
+DEFAULT_LIMITS = {
+    key: float(os.environ[f"SCRIPTER_LIMIT_{key.upper()}"])
+    for key in LIMIT_KEYS
+    if os.environ.get(f"SCRIPTER_LIMIT_{key.upper()}")
+}
+POLICY_PATH = os.environ.get("SCRIPTER_RESOURCE_POLICY", "")
+# A cgroup v2 directory the server may create child cgroups in.
+CGROUP_ROOT = os.environ.get("SCRIPTER_CGROUP", "")
+# Seconds between SIGXCPU at the CPU limit and the kernel's SIGKILL.
+CPU_GRACE_SECONDS = 5
+# Seconds a stopped run gets between SIGTERM and SIGKILL.
+TERM_GRACE_SECONDS = float(os.environ.get("SCRIPTER_TERM_GRACE", "5"))
+
+# Admission thresholds (0 = not checked): 1-minute load average per CPU,
+# fraction of memory available, and memory pressure (PSI "some" avg10, %).
+MAX_LOAD_PER_CPU = float(os.environ.get("SCRIPTER_MAX_LOAD_PER_CPU", "0"))
+MIN_MEMORY_AVAILABLE = float(os.environ.get("SCRIPTER_MIN_MEMORY_AVAILABLE", "0"))
+MAX_MEMORY_PRESSURE = float(os.environ.get("SCRIPTER_MAX_MEMORY_PRESSURE", "0"))
+# Seconds a host load sample is reused, and between re-checks while held back.
+LOAD_SAMPLE_INTERVAL = 1.0
+
+
+# -----------------------------------------------------------------------------
+# Policy
+# -----------------------------------------------------------------------------
+_policy_cache = {"mtime": None, "policy": {}}
+
+
+def _policy_file():
+    if not POLICY_PATH:
+        return {}
+    try:
+        mtime = os.stat(POLICY_PATH).st_mtime
+        if mtime != _policy_cache["mtime"]:
+            with open(POLICY_PATH, "r", encoding="utf-8") as fh:
+                _policy_cache["policy"] = json.load(fh)
+            _policy_cache["mtime"] = mtime
+    except (OSError, ValueError) as e:
+        logger.warning("Could not read resource policy %s: %s", POLICY_PATH, e)
+    return _policy_cache["policy"]
+
+
+def _clean(limits):
+    out = {}
+    for key, value in limits.items():
+        if key in LIMIT_KEYS and isinstance(value, (int, float)) and not isinstance(value, bool):
+            out[key] = value
+    return out
+
+
+def decorator_limits(func_entry):
+    """
+    Keyword arguments of a function's `@resource_limits(...)` (catalog entry).
+    """
+    from catalog import find_decorator
+
+    node = find_decorator(func_entry, "resource_limits") if func_entry else None
+    limits = {}
+    for kw in getattr(node, "keywords", []):
+        value = getattr(kw.value, "value", None)
+        if kw.arg in LIMIT_KEYS and isinstance(value, (int, float)):
+            limits[kw.arg] = value
+    return limits
+
+
+def policy_for(script, func_entry=None):
+    """
+    Effective limits of a run of `script` (relative path): defaults, then
+    matching policy file entries, then the function's decorator, which may
+    only tighten what the admin allows.
+    """
+    limits = dict(DEFAULT_LIMITS)
+    policy = _policy_file()
+    matches = [key for key in policy if script == key or (key.endswith("/") and script.startswith(key))]
+    for key in sorted(matches, key=len):
+        limits.update(_clean(policy[key]))
+    for key, value in decorator_limits(func_entry).items():
+        if key == "nice":
+            limits[key] = max(value, limits.get(key, value))
+        else:
+            limits[key] = min(value, limits.get(key, value))
+    return limits
+
+
+def child_env(limits, env=None):
+    """
+    `env` (default: os.environ) plus the limits for the dispatcher.
+    """
+    env = dict(os.environ if env is None else env)
+    if limits:
+        env[LIMITS_ENV] = json.dumps(limits)
+    return env
+
+
+# -----------------------------------------------------------------------------
+# Child side (dispatcher)
+# -----------------------------------------------------------------------------
+def _set_limit(kind, soft, hard=None):
+    hard = soft if hard is None else hard
+    _, current_hard = resource.getrlimit(kind)
+    if current_hard != resource.RLIM_INFINITY:
+        soft, hard = min(soft, current_hard), min(hard, current_hard)
+    resource.setrlimit(kind, (soft, hard))
+
+
+def _join_cgroup(memory_bytes):
+    """
+    Move this process into a new child cgroup of CGROUP_ROOT capped at
+    `memory_bytes`. Returns False if cgroups can't be used here.
+    """
+    if not CGROUP_ROOT or not os.path.isfile(os.path.join(CGROUP_ROOT, "cgroup.procs")):
+        return False
+    # Cgroups of earlier runs are empty by now; busy ones refuse removal.
+    for name in os.listdir(CGROUP_ROOT):
+        if name.startswith("run-"):
+            try:
+                os.rmdir(os.path.join(CGROUP_ROOT, name))
+            except OSError:
+                pass
+    path = os.path.join(CGROUP_ROOT, f"run-{os.getpid()}")
+    try:
+        os.mkdir(path)
+        with open(os.path.join(path, "memory.max"), "w") as fh:
+            fh.write(str(memory_bytes))
+        with open(os.path.join(path, "cgroup.procs"), "w") as fh:
+            fh.write(str(os.getpid()))
+    except OSError as e:
+        logger.warning("Could not set up cgroup %s: %s", path, e)
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+def apply(limits):
+    """
+    Apply `limits` to the current process (and so to anything it starts).
+    """
+    mib = 1024 * 1024
+    if "cpu_seconds" in limits:
+        cpu = max(1, int(limits["cpu_seconds"]))
+        _set_limit(resource.RLIMIT_CPU, cpu, cpu + CPU_GRACE_SECONDS)
+    address_space = limits.get("address_space_mb")
+    if "memory_mb" in limits and not _join_cgroup(int(limits["memory_mb"] * mib)):
+        # No cgroup: the address space limit is the closest we have.
+        address_space = min(address_space or limits["memory_mb"], limits["memory_mb"])
+    if address_space:
+        _set_limit(resource.RLIMIT_AS, int(address_space * mib))
+    if "open_files" in limits:
+        _set_limit(resource.RLIMIT_NOFILE, int(limits["open_files"]))
+    if limits.get("nice"):
+        os.nice(int(limits["nice"]))
+
+
+def apply_from_env():
+    """
+    Apply the limits handed over in SCRIPTER_LIMITS, if any. The variable is
+    removed so runs started by the script don't apply them again.
+    """
+    text = os.environ.pop(LIMITS_ENV, None)
+    if not text:
+        return {}
+    limits = json.loads(text)
+    try:
+        apply(limits)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not apply resource limits %s: %s", limits, e)
+    return limits
+
+
+# -----------------------------------------------------------------------------
+# Parent side (executors, pool workers, agents)
+# -----------------------------------------------------------------------------
+class ProcessGroup:
+    """
+    The process group led by a run's process `pid` (started in a new
+    session), so that stopping the run also stops whatever it spawned.
+    `terminate()` sends SIGTERM to the group and SIGKILL `grace` seconds
+    later; once the run has been reaped (`close()`) it does nothing.
+    """
+
+    def __init__(self, pid, grace=TERM_GRACE_SECONDS):
+        self.pid = pid
+        self.grace = grace
+        self.terminated = False
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def terminate(self):
+        with self._lock:
+            if self._closed or self.terminated:
+                return
+            self.terminated = True
+        self._signal(signal.SIGTERM)
+        # Also catches stragglers that ignore SIGTERM after the leader exited.
+        timer = threading.Timer(self.grace, self._signal, (signal.SIGKILL,))
+        timer.daemon = True
+        timer.start()
+
+    def kill(self):
+        """
+        SIGKILL the group right away.
+        """
+        with self._lock:
+            if self._closed:
+                return
+        self._signal(signal.SIGKILL)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+
+    def _signal(self, signum):
+        try:
+            os.killpg(self.pid, signum)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+class Deadline:
+    """
+    Calls `kill` once `limits["wall_seconds"]` have passed, unless cancelled
+    first. `fired` tells whether it did.
+    """
+
+    def __init__(self, limits, kill):
+        self.fired = False
+        self._kill = kill
+        self._timer = None
+        seconds = (limits or {}).get("wall_seconds")
+        if seconds:
+            self._timer = threading.Timer(seconds, self._expire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _expire(self):
+        self.fired = True
+        try:
+            self._kill()
+        except (OSError, ProcessLookupError):
+            pass
+
+    def cancel(self):
+        if self._timer is not None:
+            self._timer.cancel()
+
+
+def usage_from_rusage(ru):
+    """
+    The accounting kept for a reaped run (see `wait4`).
+    """
+    return {
+        "cpu_user": round(ru.ru_utime, 6),
+        "cpu_system": round(ru.ru_stime, 6),
+        "max_rss_bytes": max_rss_bytes(ru),
+        "major_faults": ru.ru_majflt,
+        "involuntary_switches": ru.ru_nivcsw,
+    }
+
+
+def wait4(pid):
+    """
+    Reap `pid` and return (exit code, usage), like Popen.returncode plus the
+    child's own resource usage.
+    """
+    while True:
+        try:
+            _, status, ru = os.wait4(pid, 0)
+            break
+        except InterruptedError:
+            continue
+    return os.waitstatus_to_exitcode(status), usage_from_rusage(ru)
+
+
+def reap(proc):
+    """
+    `wait4` for a subprocess.Popen: sets its returncode and returns usage.
+    """
+    proc.returncode, usage = wait4(proc.pid)
+    return usage
+
+
+def exit_note(limits, return_code, deadline=None):
+    """
+    A line explaining that a run was stopped by one of its limits, or None.
+    """
+    limits = limits or {}
+    if deadline is not None and deadline.fired:
+        return f"\n[Wall-clock limit of {limits['wall_seconds']:g}s exceeded: run stopped]\n"
+    if return_code == -signal.SIGXCPU:
+        return f"\n[CPU time limit of {limits.get('cpu_seconds', 0):g}s exceeded: run killed]\n"
+    if return_code == -signal.SIGKILL and "memory_mb" in limits:
+        return f"\n[Run killed, probably for exceeding its memory limit of {limits['memory_mb']:g} MiB]\n"
+    return None
+
+
+# -----------------------------------------------------------------------------
+# Admission
+# -----------------------------------------------------------------------------
+def _cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _memory_available_ratio():
+    try:
+        with open("/proc/meminfo", "r") as fh:
+            info = {line.split(":")[0]: int(line.split()[1]) for line in fh if line.split()[1:]}
+        return info["MemAvailable"] / info["MemTotal"]
+    except (OSError, KeyError, ValueError, ZeroDivisionError):
+        return None
+
+
+def _memory_pressure():
+    try:
+        with open("/proc/pressure/memory", "r") as fh:
+            for line in fh:
+                if line.startswith("some"):
+                    return float(line.split()[1].partition("=")[2])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class HostLoad:
+    """
+    Samples host load (at most every LOAD_SAMPLE_INTERVAL seconds) and tells
+    whether new runs should wait.
+    """
+
+    def __init__(
+        self,
+        max_load_per_cpu=MAX_LOAD_PER_CPU,
+        min_memory_available=MIN_MEMORY_AVAILABLE,
+        max_memory_pressure=MAX_MEMORY_PRESSURE,
+    ):
+        self.max_load_per_cpu = max_load_per_cpu
+        self.min_memory_available = min_memory_available
+        self.max_memory_pressure = max_memory_pressure
+        self._sample = None
+        self._sampled_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.max_load_per_cpu or self.min_memory_available or self.max_memory_pressure)
+
+    def sample(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._sample is None or now - self._sampled_at >= LOAD_SAMPLE_INTERVAL:
+                try:
+                    load = os.getloadavg()[0] / _cpu_count()
+                except OSError:
+                    load = None
+                self._sample = {
+                    "load_per_cpu": load,
+                    "memory_available": _memory_available_ratio(),
+                    "memory_pressure": _memory_pressure(),
+                }
+                self._sampled_at = now
+            return self._sample
+
+    def overloaded(self):
+        """
+        Why new runs should wait right now, or None.
+        """
+        if not self.enabled:
+            return None
+        s = self.sample()
+        if self.max_load_per_cpu and s["load_per_cpu"] is not None and s["load_per_cpu"] > self.max_load_per_cpu:
+            return f"load {s['load_per_cpu']:.2f} per CPU is above {self.max_load_per_cpu:g}"
+        if (
+            self.min_memory_available
+            and s["memory_available"] is not None
+            and s["memory_available"] < self.min_memory_available
+        ):
+            return f"only {s['memory_available']:.0%} of memory available (minimum {self.min_memory_available:.0%})"
+        if (
+            self.max_memory_pressure
+            and s["memory_pressure"] is not None
+            and s["memory_pressure"] > self.max_memory_pressure
+        ):
+            return f"memory pressure {s['memory_pressure']:.1f}% is above {self.max_memory_pressure:g}%"
+        return None
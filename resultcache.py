@@ -0,0 +1,243 @@
+"""
+Opt-in cache of function results.
+
+A function decorated with `@cached` (see `scripter.py`) has its return value
+and captured output stored under `<STATE_DIR>/cache/`. The key combines the
+script's content hash, the function name and the kwargs the dispatcher
+built, so editing the script invalidates its entries automatically. Entries
+expire after their TTL and the whole cache is kept under a byte budget by
+evicting the least recently used entries.
+"""
+import ast
+import contextlib
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+
+from catalog import STATE_DIR, find_decorator
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.join(STATE_DIR, "cache")
+# TTL in seconds for `@cached` without an explicit ttl (0 = never expires).
+DEFAULT_TTL = float(os.environ.get("SCRIPTER_CACHE_TTL", "3600"))
+# Total size of the cache on disk before the least recently used entries go.
+MAX_BYTES = int(os.environ.get("SCRIPTER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Runs that print more than this are not cached.
+MAX_ENTRY_BYTES = int(os.environ.get("SCRIPTER_CACHE_MAX_ENTRY_BYTES", str(4 * 1024 * 1024)))
+
+
+def cache_policy(func_entry):
+    """
+    TTL for a catalog function entry decorated with `@cached` /
+    `@cached(ttl=...)` / `@scripter.cached(...)`, or None if not cached.
+    Read from the recorded decorator source, so no import is needed.
+    """
+    node = find_decorator(func_entry, "cached")
+    if node is None:
+        return None
+    ttl_node = None
+    if isinstance(node, ast.Call):
+        ttl_node = node.args[0] if node.args else None
+        for kw in node.keywords:
+            if kw.arg == "ttl":
+                ttl_node = kw.value
+    if ttl_node is None:
+        return DEFAULT_TTL
+    try:
+        return float(ast.literal_eval(ttl_node) or 0)
+    except (ValueError, TypeError):
+        logger.warning("Ignoring cache ttl %s, not a number of seconds", ast.unparse(ttl_node))
+        return DEFAULT_TTL
+
+
+def _hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Cache entries are JSON files at `<dir>/<script+function>/<sha>-<args>.json`;
+    a file's mtime is its last use, which drives LRU eviction.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def path(self, script, function, script_sha1, kwargs):
+        args = json.dumps(kwargs, sort_keys=True, default=repr)
+        folder = _hash(f"{script}:{function}")[:16]
+        return os.path.join(self.directory, folder, f"{script_sha1[:12]}-{_hash(args)}.json")
+
+    def get(self, script, function, script_sha1, kwargs):
+        """
+        Return the stored record, or None if missing or expired.
+        """
+        path = self.path(script, function, script_sha1, kwargs)
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                record = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        if record.get("ttl") and time.time() - record["created_at"] > record["ttl"]:
+            with contextlib.suppress(OSError):
+                os.remove(path)
+            return None
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        return record
+
+    def put(self, script, function, script_sha1, kwargs, record):
+        path = self.path(script, function, script_sha1, kwargs)
+        folder = os.path.dirname(path)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(folder, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as fh:
+                json.dump(record, fh)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Could not write cache entry '%s': %s", path, e)
+            return
+        # Entries of earlier versions of the script can never hit again.
+        prefix = script_sha1[:12] + "-"
+        for entry in os.scandir(folder):
+            if entry.name.endswith(".json") and not entry.name.startswith(prefix):
+                with contextlib.suppress(OSError):
+                    os.remove(entry.path)
+        self.evict()
+
+    def evict(self):
+        """
+        Drop least recently used entries until the cache fits in max_bytes.
+        """
+        with self._lock:
+            entries = []
+            try:
+                folders = list(os.scandir(self.directory))
+            except OSError:
+                return
+            for folder in folders:
+                if not folder.is_dir():
+                    continue
+                for entry in os.scandir(folder.path):
+                    with contextlib.suppress(OSError):
+                        st = entry.stat()
+                        entries.append((st.st_mtime, st.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+                    total -= size
+
+
+class Captured:
+    """
+    Output captured during a run, up to `limit` characters.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.parts = []
+        self.size = 0
+
+    def add(self, text):
+        if self.size <= self.limit:
+            self.parts.append(text)
+        self.size += len(text)
+
+    @property
+    def truncated(self):
+        return self.size > self.limit
+
+    def getvalue(self):
+        return "".join(self.parts)
+
+
+class _Tee(io.TextIOBase):
+    """
+    Writes through to `stream` and keeps a copy in `captured`.
+    """
+
+    def __init__(self, stream, captured):
+        self.stream = stream
+        self.captured = captured
+
+    def write(self, text):
+        self.stream.write(text)
+        self.captured.add(text)
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class _CaptureHandler(logging.Handler):
+    """
+    Passes log records, formatted like the root logger's own output, to
+    `write`: the root's handlers hold the original streams, which the
+    redirection of sys.stdout / sys.stderr doesn't reach.
+    """
+
+    def __init__(self, write, formatter=None):
+        super().__init__()
+        self.write = write
+        self.setFormatter(formatter)
+
+    def emit(self, record):
+        try:
+            self.write(self.format(record) + "\n")
+        except Exception:
+            self.handleError(record)
+
+
+@contextlib.contextmanager
+def capture_logging(write, exclusive=False):
+    """
+    Send log records to `write` as well as the root logger's handlers, or
+    instead of them with `exclusive`, until the block ends.
+    """
+    root = logging.getLogger()
+    formatter = next((handler.formatter for handler in root.handlers if handler.formatter), None)
+    handlers = list(root.handlers) if exclusive else []
+    for handler in handlers:
+        root.removeHandler(handler)
+    capture = _CaptureHandler(write, formatter)
+    root.addHandler(capture)
+    try:
+        yield
+    finally:
+        root.removeHandler(capture)
+        for handler in handlers:
+            root.addHandler(handler)
+
+
+@contextlib.contextmanager
+def capture_output(stdout, stderr, limit=MAX_ENTRY_BYTES):
+    """
+    Tee stdout, stderr and logging into one buffer (keeping their
+    interleaving) while still printing them.
+    """
+    captured = Captured(limit)
+    with capture_logging(captured.add), \
+            contextlib.redirect_stdout(_Tee(stdout, captured)), \
+            contextlib.redirect_stderr(_Tee(stderr, captured)):
+        yield captured
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = ResultCache()
+    return _cache
@@ -0,0 +1,295 @@
+"""
+Durable, append-only output store for runs.
+
+Each run writes its output to `<STATE_DIR>/runs/<run_id>.log` and keeps a
+small sparse index in `<run_id>.idx` (one entry every INDEX_EVERY bytes,
+mapping byte offset -> line number and time) so viewers can resume from any
+byte offset and the UI can jump to a line without scanning the whole file.
+The most recent output of a live run is also kept in memory, so any number
+of viewers following it share one buffer instead of each reading the file.
+When the run finishes its metadata is written to `<run_id>.json`; a return
+value sent over the result channel is stored in `<run_id>.result`, a
+profile in `<run_id>.profile.*` and the progress the run reports (see
+`scripter.progress`) in `<run_id>.progress`.
+"""
+import asyncio
+import json
+import os
+import re
+import struct
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_DIR = os.environ.get("SCRIPTER_STATE_DIR", os.path.join(BASE_DIR, ".scripter"))
+RUNS_DIR = os.path.join(STATE_DIR, "runs")
+
+# Write one index entry per this many bytes of output.
+INDEX_EVERY = 64 * 1024
+# Maximum bytes handed to a viewer in one read.
+READ_SIZE = 64 * 1024
+# Output of a live run kept in memory for its followers (between this and
+# twice this much).
+RECENT_BYTES = 1024 * 1024
+
+_INDEX_ENTRY = struct.Struct("!QQd")  # byte offset, lines before offset, timestamp
+_RUN_ID = re.compile(r"^[0-9a-zA-Z_-]+$")
+
+
+def valid_run_id(run_id):
+    return bool(_RUN_ID.match(run_id or ""))
+
+
+def log_path(run_id, directory=RUNS_DIR):
+    return os.path.join(directory, f"{run_id}.log")
+
+
+def utf8_safe_end(data):
+    """
+    Length of the longest prefix of `data` that doesn't end inside a
+    multi-byte UTF-8 sequence.
+    """
+    end = len(data)
+    for back in range(1, min(4, end) + 1):
+        byte = data[end - back]
+        if byte & 0xC0 == 0x80:
+            continue  # continuation byte, keep looking for the lead byte
+        if byte & 0x80 == 0:
+            return end  # ASCII: nothing pending
+        needed = 2 if byte & 0xE0 == 0xC0 else 3 if byte & 0xF0 == 0xE0 else 4
+        return end if back >= needed else end - back
+    return end
+
+
+class RunLog:
+    """
+    Append-only log for one run. A single writer appends; any number of
+    readers can read ranges or follow the log until it is closed.
+    """
+
+    def __init__(self, run_id, directory=RUNS_DIR):
+        if not valid_run_id(run_id):
+            raise ValueError(f"invalid run id: {run_id!r}")
+        self.run_id = run_id
+        self.directory = directory
+        self.path = log_path(run_id, directory)
+        self.index_path = os.path.join(directory, f"{run_id}.idx")
+        self.meta_path = os.path.join(directory, f"{run_id}.json")
+        self.result_path = os.path.join(directory, f"{run_id}.result")
+        self.profile_prefix = os.path.join(directory, f"{run_id}.profile")
+        self.progress_path = os.path.join(directory, f"{run_id}.progress")
+        self.size = 0
+        self.lines = 0
+        self.complete = False
+        self.meta = None
+        self._next_index = 0
+        self._fd = None
+        self._index = None
+        self._cond = threading.Condition()
+        self._watchers = set()  # (event loop, asyncio.Event) of async followers
+        self._recent = bytearray()  # output from byte _recent_start onwards
+        self._recent_start = 0
+        self._progress = (None, None)  # (stat key, parsed state) last read
+
+    # -------------------------------------------------------------------------
+    # Writer side
+    # -------------------------------------------------------------------------
+    @classmethod
+    def create(cls, run_id, directory=RUNS_DIR):
+        log = cls(run_id, directory)
+        os.makedirs(directory, exist_ok=True)
+        log._fd = os.open(log.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        log._index = open(log.index_path, "ab", buffering=0)
+        return log
+
+    def append(self, data):
+        """
+        Append text or bytes and wake up followers.
+        """
+        if isinstance(data, str):
+            data = data.encode("utf-8", errors="replace")
+        if not data:
+            return
+        with self._cond:
+            if self._fd is None:
+                raise ValueError(f"run log {self.run_id} is closed")
+            if self.size >= self._next_index:
+                self._index.write(_INDEX_ENTRY.pack(self.size, self.lines, time.time()))
+                self._next_index = self.size + INDEX_EVERY
+            os.write(self._fd, data)
+            self.size += len(data)
+            self.lines += data.count(b"\n")
+            self._recent += data
+            if len(self._recent) > 2 * RECENT_BYTES:
+                drop = len(self._recent) - RECENT_BYTES
+                del self._recent[:drop]
+                self._recent_start += drop
+            self._cond.notify_all()
+            self._wake_watchers()
+
+    def close(self, meta=None):
+        """
+        Mark the log complete and persist the run's metadata next to it.
+        """
+        with self._cond:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._index.close()
+                self._fd = None
+            self._recent = bytearray()
+            self._recent_start = self.size
+            self.meta = dict(meta or {}, size=self.size, lines=self.lines)
+            tmp = self.meta_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump(self.meta, fh)
+            os.replace(tmp, self.meta_path)
+            self.complete = True
+            self._cond.notify_all()
+            self._wake_watchers()
+
+    def _wake_watchers(self):
+        for loop, event in self._watchers:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # loop already closed
+
+    # -------------------------------------------------------------------------
+    # Reader side
+    # -------------------------------------------------------------------------
+    @classmethod
+    def open(cls, run_id, directory=RUNS_DIR):
+        """
+        Open a finished (or orphaned) log from disk; None if it doesn't exist.
+        """
+        if not valid_run_id(run_id):
+            return None
+        log = cls(run_id, directory)
+        try:
+            log.size = os.path.getsize(log.path)
+        except OSError:
+            return None
+        try:
+            with open(log.meta_path, "r", encoding="utf-8") as fh:
+                log.meta = json.load(fh)
+            log.lines = log.meta.get("lines", 0)
+        except (OSError, ValueError):
+            pass
+        # Nothing is writing to it from this process: treat it as complete.
+        log.complete = True
+        return log
+
+    def read(self, offset, length=READ_SIZE):
+        if offset >= self.size:
+            return b""
+        with open(self.path, "rb") as fh:
+            return os.pread(fh.fileno(), min(length, self.size - offset), offset)
+
+    def _read_recent(self, offset, length):
+        # Called with the condition held; None if `offset` is no longer in
+        # memory (or the log is closed).
+        if offset < self._recent_start or not self._recent:
+            return None
+        start = offset - self._recent_start
+        return bytes(self._recent[start:start + length])
+
+    def read_progress(self):
+        """
+        The progress the run reported last, or None. The file is replaced
+        on every write, so it is only parsed again when it changed.
+        """
+        try:
+            st = os.stat(self.progress_path)
+        except OSError:
+            return None
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        cached_key, state = self._progress
+        if key != cached_key:
+            try:
+                with open(self.progress_path, "r", encoding="utf-8") as fh:
+                    state = json.load(fh)
+            except (OSError, ValueError):
+                return state  # replaced while reading; keep the last state
+            self._progress = (key, state)
+        return state
+
+    def index(self):
+        """
+        Return the sparse index as [(offset, line, timestamp), ...].
+        """
+        try:
+            with open(self.index_path, "rb") as fh:
+                raw = fh.read()
+        except OSError:
+            return []
+        usable = len(raw) - len(raw) % _INDEX_ENTRY.size
+        return list(_INDEX_ENTRY.iter_unpack(raw[:usable]))
+
+    def follow(self, offset=0, timeout=None):
+        """
+        Yield (offset, bytes) chunks starting at byte `offset`, blocking for
+        new output until the log is closed. Chunk boundaries never split a
+        UTF-8 character, so each chunk decodes on its own. With `timeout`,
+        yields (offset, b"") after that many idle seconds (for keep-alives).
+        """
+        with open(self.path, "rb") as fh:
+            while True:
+                with self._cond:
+                    if offset >= self.size and not self.complete:
+                        self._cond.wait(timeout)
+                    size, complete = self.size, self.complete
+                    data = self._read_recent(offset, min(READ_SIZE, size - offset))
+                if offset < size:
+                    if data is None:
+                        data = os.pread(fh.fileno(), min(READ_SIZE, size - offset), offset)
+                    if not (complete and offset + len(data) >= size):
+                        data = data[:utf8_safe_end(data)]
+                    if not data:
+                        # Only half a character so far; wait for the rest.
+                        with self._cond:
+                            self._cond.wait(0.05)
+                        continue
+                    offset += len(data)
+                    yield offset - len(data), data
+                elif complete:
+                    return
+                else:
+                    yield offset, b""
+
+    async def afollow(self, offset=0, timeout=None):
+        """
+        Async version of `follow()` for event-loop servers: waiting for new
+        output doesn't tie up a thread.
+        """
+        event = asyncio.Event()
+        watcher = (asyncio.get_running_loop(), event)
+        with self._cond:
+            self._watchers.add(watcher)
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            while True:
+                event.clear()
+                with self._cond:
+                    size, complete = self.size, self.complete
+                    data = self._read_recent(offset, min(READ_SIZE, size - offset))
+                if offset < size:
+                    if data is None:
+                        data = os.pread(fd, min(READ_SIZE, size - offset), offset)
+                    if not (complete and offset + len(data) >= size):
+                        data = data[:utf8_safe_end(data)]
+                    if not data:
+                        await asyncio.sleep(0.05)
+                        continue
+                    offset += len(data)
+                    yield offset - len(data), data
+                elif complete:
+                    return
+                else:
+                    try:
+                        await asyncio.wait_for(event.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        yield offset, b""
+        finally:
+            os.close(fd)
+            with self._cond:
+                self._watchers.discard(watcher)
@@ -0,0 +1,294 @@
+"""
+Helpers for scripts run by Scripter.
+
+Scripts are executed by `dispatcher.py`, whose folder is on `sys.path`, so a
+script can simply `from scripter import cached, requires, side_effects`
+(or `resource_limits`, `in_process`, `progress`).
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+
+# Set by the executor: where the run's progress is written.
+PROGRESS_FILE_ENV = "SCRIPTER_PROGRESS_FILE"
+# Minimum seconds between two writes of a run's progress; updates in
+# between are coalesced into the next write.
+PROGRESS_INTERVAL = float(os.environ.get("SCRIPTER_PROGRESS_INTERVAL", "0.25"))
+# Number of most recent partial results kept.
+PROGRESS_PARTIALS = 20
+
+
+def cached(ttl=None):
+    """
+    Mark a function's results as cacheable:
+
+        @cached(ttl=600)
+        def lookup(name: str): ...
+
+    Runs with the same arguments (and the same script content) within `ttl`
+    seconds replay the stored output and return value instead of calling the
+    function; the default TTL is SCRIPTER_CACHE_TTL and `ttl=0` never expires.
+    The dispatcher reads the decorator from the script's source, so at runtime
+    it only records the setting. Also usable bare, as `@cached`.
+    """
+    if callable(ttl):
+        func, ttl = ttl, None
+        func.__scripter_cache__ = {"ttl": ttl}
+        return func
+
+    def decorate(func):
+        func.__scripter_cache__ = {"ttl": ttl}
+        return func
+
+    return decorate
+
+
+def side_effects(func):
+    """
+    Mark a function as having side effects (sending mail, writing to a
+    database, ...):
+
+        @side_effects
+        def notify(channel: str): ...
+
+    By default, a run requested while an identical run (same script content,
+    function and parameters) is queued or running attaches to that run and
+    shares its output instead of starting another process. Runs of functions
+    marked with `@side_effects` always start their own process. Like
+    `cached`, the setting is read from the script's source.
+    """
+    func.__scripter_side_effects__ = True
+    return func
+
+
+def requires(*tags):
+    """
+    Only run a function on a worker agent that advertises all of `tags`:
+
+        @requires("boto3")
+        def list_buckets(region: str): ...
+
+    Tags are free-form labels an agent is started with (`python agents.py
+    --tags boto3,gpu`); the server itself offers SCRIPTER_LOCAL_TAGS. Without
+    distributed execution enabled the requirement is ignored. Like `cached`,
+    the setting is read from the script's source.
+    """
+    def decorate(func):
+        func.__scripter_requires__ = tuple(tags)
+        return func
+
+    return decorate
+
+
+def resource_limits(**limits):
+    """
+    Limit the resources a run of the function may use:
+
+        @resource_limits(cpu_seconds=60, memory_mb=512, wall_seconds=300, nice=10)
+        def crunch(path: str): ...
+
+    Keys: cpu_seconds, memory_mb, address_space_mb, open_files, wall_seconds
+    and nice. They can only tighten the server's own limits (see
+    resources.py); a run that exceeds one is stopped. Like `cached`, the
+    setting is read from the script's source.
+    """
+    def decorate(func):
+        func.__scripter_resource_limits__ = dict(limits)
+        return func
+
+    return decorate
+
+
+def in_process(func):
+    """
+    Run a trusted, lightweight function inside the server instead of in a
+    process of its own:
+
+        @in_process
+        def add(a: int, b: int): ...
+
+    Calls skip the interpreter start-up and import (the module is imported
+    once, and again when the file changes) and run on a small thread pool
+    (SCRIPTER_IN_PROCESS_THREADS) with their output captured per run. The
+    function is not isolated from the server: a crash or a leak is the
+    server's. Runs needing a process of their own (resource limits other
+    than a deadline, `@cached`, `@requires`, profiling, batches) still get
+    one. Like `cached`, the setting is read from the script's source.
+    """
+    func.__scripter_in_process__ = True
+    return func
+
+
+# -----------------------------------------------------------------------------
+# Progress reporting
+# -----------------------------------------------------------------------------
+class Progress:
+    """
+    A run's progress: named bars, counters and its most recent partial
+    results. Updates only change the state in memory; it is written (as
+    JSON, replacing the previous state) at most every `interval` seconds,
+    plus once when the run ends, so reporting on every iteration of a tight
+    loop is cheap. Without a `path` nothing is written.
+    """
+
+    def __init__(self, path=None, interval=PROGRESS_INTERVAL):
+        self.path = path
+        self.pid = os.getpid()
+        self.interval = interval
+        self._state = {"seq": 0, "updated_at": None, "bars": {}, "counters": {}, "partial": [], "partial_count": 0}
+        self._written = 0.0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def update(self, done, total=None, message=None, bar="main"):
+        """
+        Set how far bar `bar` is: `done` out of `total` (None if unknown),
+        with an optional status message.
+        """
+        with self._lock:
+            state = self._state["bars"].setdefault(bar, {"done": 0, "total": None, "message": None})
+            state["done"] = done
+            if total is not None:
+                state["total"] = total
+            if message is not None:
+                state["message"] = str(message)
+            self._changed()
+
+    def advance(self, n=1, bar="main"):
+        """
+        Move bar `bar` forward by `n`.
+        """
+        with self._lock:
+            state = self._state["bars"].setdefault(bar, {"done": 0, "total": None, "message": None})
+            state["done"] += n
+            self._changed()
+
+    def count(self, name, n=1):
+        """
+        Add `n` to counter `name` (e.g. rows written, errors skipped).
+        """
+        with self._lock:
+            counters = self._state["counters"]
+            counters[name] = counters.get(name, 0) + n
+            self._changed()
+
+    def partial(self, value):
+        """
+        Report a partial result (anything JSON can represent; other values
+        are shown as text). Only the last PROGRESS_PARTIALS are kept.
+        """
+        with self._lock:
+            partials = self._state["partial"]
+            partials.append(value)
+            del partials[:-PROGRESS_PARTIALS]
+            self._state["partial_count"] += 1
+            self._changed()
+
+    def snapshot(self):
+        with self._lock:
+            return json.loads(json.dumps(self._state, default=str))
+
+    def flush(self):
+        """
+        Write pending updates now.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._state["seq"]:
+                self._write()
+
+    def _changed(self):
+        # Called with the lock held.
+        self._state["seq"] += 1
+        self._state["updated_at"] = time.time()
+        if self.path is None or self._timer is not None:
+            return
+        wait = self._written + self.interval - time.monotonic()
+        if wait <= 0:
+            self._write()
+        else:
+            self._timer = threading.Timer(wait, self._write_later)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _write_later(self):
+        with self._lock:
+            self._timer = None
+            self._write()
+
+    def _write(self):
+        # Called with the lock held.
+        self._written = time.monotonic()
+        if self.path is None:
+            return
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump(self._state, fh, default=str)
+            os.replace(tmp, self.path)
+        except (OSError, TypeError, ValueError):
+            pass  # progress is best effort; never fail the run over it
+
+
+_run_progress = contextvars.ContextVar("scripter_progress", default=None)
+_process_progress = None
+_no_progress = Progress()
+
+
+def start_progress(path=None):
+    """
+    Start reporting this process's progress to `path` (default: the file
+    named by SCRIPTER_PROGRESS_FILE). Called by the dispatcher; reports made
+    in processes it forks (e.g. batch workers) are ignored.
+    """
+    global _process_progress
+    path = path or os.environ.get(PROGRESS_FILE_ENV)
+    _process_progress = Progress(path) if path else None
+    return _process_progress
+
+
+def set_run_progress(reporter):
+    """
+    Report the calling context's progress to `reporter` (used for runs
+    inside the server, where many runs share the process).
+    """
+    _run_progress.set(reporter)
+
+
+def current_progress():
+    """
+    The Progress of the run calling this (a no-op one outside a run).
+    """
+    reporter = _run_progress.get() or _process_progress
+    if reporter is None or reporter.pid != os.getpid():
+        return _no_progress
+    return reporter
+
+
+class _CurrentProgress:
+    """
+    Reports to the progress of whichever run is calling:
+
+        from scripter import progress
+
+        def convert(folder: str):
+            files = sorted(os.listdir(folder))
+            for done, name in enumerate(files, start=1):
+                ...
+                progress.update(done, total=len(files), message=name)
+                progress.count("bytes", os.path.getsize(os.path.join(folder, name)))
+
+    Bars (`update`, `advance`), counters (`count`) and partial results
+    (`partial`) show up live on the run page and are kept in the run
+    history. Runs on worker agents don't report progress.
+    """
+
+    def __getattr__(self, name):
+        return getattr(current_progress(), name)
+
+
+progress = _CurrentProgress()
@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+"""
+Pre-forked warm worker pool for script runs.
+
+A pool master imports the dispatcher machinery (and optionally a set of hot
+modules such as boto3) once, listens on a local Unix socket and forks
+`size` workers that share the listening socket. Each worker accepts one job
+at a time, forks a clean child to run it through `dispatcher.main` in its
+own process group, and relays the child's output back as length-prefixed
+frames. The client can stop the run with a cancel frame, or by going away.
+
+Run standalone with:
+    python workers.py --socket .scripter/workers.sock --size 4 --preload boto3
+"""
+import argparse
+import importlib
+import json
+import logging
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+import channel
+import pump
+import resources
+import scripter
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_DIR = os.environ.get("SCRIPTER_STATE_DIR", os.path.join(BASE_DIR, ".scripter"))
+SOCKET_PATH = os.environ.get("SCRIPTER_POOL_SOCKET", os.path.join(STATE_DIR, "workers.sock"))
+POOL_SIZE = int(os.environ.get("SCRIPTER_POOL_SIZE", "4"))
+PRELOAD = [m for m in os.environ.get("SCRIPTER_PRELOAD", "").split(",") if m]
+
+# Seconds to wait for a freshly started pool to open its socket.
+START_TIMEOUT = 10.0
+
+# -----------------------------------------------------------------------------
+# Framing: 1-byte kind + 4-byte big-endian length + payload
+# -----------------------------------------------------------------------------
+FRAME_JOB = b"J"
+FRAME_OUTPUT = b"O"
+FRAME_EXIT = b"X"
+FRAME_RESULT = b"R"  # payload: the child's result channel bytes (see channel.py)
+FRAME_USAGE = b"U"  # payload: JSON resource usage of the run (see resources.wait4)
+FRAME_CANCEL = b"C"  # client -> worker: stop the run
+_HEADER = struct.Struct("!cI")
+
+
+def write_frame(sock, kind, payload=b""):
+    sock.sendall(_HEADER.pack(kind, len(payload)) + payload)
+
+
+def _recv_exact(sock, size):
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise EOFError("connection closed mid-frame")
+        buf += chunk
+    return bytes(buf)
+
+
+def read_frame(sock):
+    """
+    Read one (kind, payload) frame. Returns None on a clean EOF.
+    """
+    first = sock.recv(_HEADER.size)
+    if not first:
+        return None
+    if len(first) < _HEADER.size:
+        first += _recv_exact(sock, _HEADER.size - len(first))
+    kind, length = _HEADER.unpack(first)
+    return kind, _recv_exact(sock, length) if length else b""
+
+
+def watch_cancel(sock, stop):
+    """
+    Call `stop` (from a background thread) once the peer on `sock` sends a
+    cancel frame or goes away. The side running the job only writes to
+    `sock`, so this thread is its only reader.
+    """
+
+    def watch():
+        while True:
+            try:
+                frame = read_frame(sock)
+            except (OSError, EOFError):
+                frame = None
+            if frame is None or frame[0] == FRAME_CANCEL:
+                stop()
+                return
+
+    threading.Thread(target=watch, name="cancel-watch", daemon=True).start()
+
+
+# -----------------------------------------------------------------------------
+# Pool master / workers (run inside `python workers.py`)
+# -----------------------------------------------------------------------------
+def _exit_code(exc):
+    if exc.code is None:
+        return 0
+    if isinstance(exc.code, int):
+        return exc.code
+    print(exc.code, file=sys.stderr)
+    return 1
+
+
+def _run_child(job):
+    """
+    Body of the per-job child: behave exactly like `python dispatcher.py ...`.
+    """
+    import dispatcher
+
+    sys.stdout.reconfigure(line_buffering=True)
+    sys.stderr.reconfigure(line_buffering=True)
+    dispatcher.configure_logging(force=True)
+    argv = ["--script", job["script"], "--function", job["function"]] + job["args"]
+    sys.argv = [dispatcher.__file__] + argv
+    try:
+        dispatcher.main(argv)
+        return 0
+    except SystemExit as e:
+        return _exit_code(e)
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+
+def _handle(conn, listener):
+    frame = read_frame(conn)
+    if frame is None or frame[0] != FRAME_JOB:
+        return
+    job = json.loads(frame[1])
+
+    read_fd, write_fd = os.pipe()
+    result_read, result_write = channel.open_channel()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        # Child: fresh copy of the warm worker, output goes to the pipe.
+        code = 1
+        try:
+            os.setsid()
+            listener.close()
+            conn.close()
+            os.close(read_fd)
+            os.close(result_read)
+            os.environ[channel.RESULT_FD_ENV] = str(result_write)
+            if job.get("limits"):
+                os.environ.update(resources.child_env(job["limits"], {}))
+            if job.get("progress"):
+                os.environ[scripter.PROGRESS_FILE_ENV] = job["progress"]
+            os.dup2(write_fd, 1)
+            os.dup2(write_fd, 2)
+            os.close(write_fd)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            os.chdir(job["cwd"])
+            code = _run_child(job)
+        finally:
+            os._exit(code)
+
+    os.close(write_fd)
+    os.close(result_write)
+    group = resources.ProcessGroup(pid)
+    watch_cancel(conn, group.terminate)
+    deadline = resources.Deadline(job.get("limits"), group.terminate)
+    try:
+        for chunk in pump.read_chunks(read_fd):
+            write_frame(conn, FRAME_OUTPUT, chunk)
+    except OSError:
+        # Client went away; don't leave the child running unattended.
+        group.terminate()
+    finally:
+        os.close(read_fd)
+        deadline.cancel()
+    return_code, usage = resources.wait4(pid)
+    group.close()
+    result = channel.read_available(result_read)
+    try:
+        note = resources.exit_note(job.get("limits"), return_code, deadline)
+        if note:
+            write_frame(conn, FRAME_OUTPUT, note.encode("utf-8"))
+        write_frame(conn, FRAME_USAGE, json.dumps(usage).encode("utf-8"))
+        if result:
+            write_frame(conn, FRAME_RESULT, result)
+        write_frame(conn, FRAME_EXIT, str(return_code).encode())
+        # Wakes up the cancel watcher.
+        conn.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def _worker_loop(listener):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    while True:
+        conn, _ = listener.accept()
+        with conn:
+            try:
+                _handle(conn, listener)
+            except Exception:
+                logger.exception("Worker %s failed to handle a job", os.getpid())
+
+
+def _spawn_worker(listener):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _worker_loop(listener)
+        except BaseException:
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def serve(socket_path=SOCKET_PATH, size=POOL_SIZE, preload=PRELOAD):
+    """
+    Preload modules, bind the socket and supervise `size` forked workers.
+    Exits when the process that started it goes away.
+    """
+    import dispatcher  # noqa: F401  (warm the dispatcher machinery)
+
+    for name in preload:
+        try:
+            importlib.import_module(name)
+            logger.info("Preloaded module '%s'", name)
+        except Exception as e:
+            logger.warning("Could not preload module '%s': %s", name, e)
+
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    listener.listen(128)
+
+    parent = os.getppid()
+    workers = {_spawn_worker(listener) for _ in range(size)}
+    logger.info("Worker pool ready on %s with %d workers", socket_path, size)
+
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    try:
+        while not stopping and os.getppid() == parent:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid in workers:
+                workers.discard(pid)
+                workers.add(_spawn_worker(listener))
+            elif pid == 0:
+                time.sleep(0.5)
+    finally:
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        listener.close()
+        try:
+            os.unlink(socket_path)
+        except OSError:
+            pass
+
+
+# -----------------------------------------------------------------------------
+# Client side (used by the Flask app)
+# -----------------------------------------------------------------------------
+class PoolUnavailable(Exception):
+    """
+    Raised when the worker pool cannot accept a job; callers fall back to a
+    plain subprocess.
+    """
+
+
+class WorkerPool:
+    """
+    Handle to a pool master started (lazily) by this process.
+    """
+
+    def __init__(self, socket_path=SOCKET_PATH, size=POOL_SIZE, preload=PRELOAD):
+        self.socket_path = socket_path
+        self.size = size
+        self.preload = list(preload)
+        self._proc = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def start(self):
+        """
+        Start the pool master unless one is already listening on the socket.
+        """
+        with self._lock:
+            if self._proc is not None and self._proc.poll() is None:
+                return
+            try:
+                self._connect().close()
+                return
+            except OSError:
+                pass
+            cmd = [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--socket", self.socket_path,
+                "--size", str(self.size),
+            ]
+            if self.preload:
+                cmd += ["--preload", ",".join(self.preload)]
+            self._proc = subprocess.Popen(cmd, cwd=BASE_DIR)
+            deadline = time.monotonic() + START_TIMEOUT
+            while time.monotonic() < deadline:
+                if self._proc.poll() is not None:
+                    raise PoolUnavailable(f"pool exited with code {self._proc.returncode}")
+                try:
+                    self._connect().close()
+                    return
+                except OSError:
+                    time.sleep(0.05)
+            raise PoolUnavailable("timed out waiting for the worker pool to start")
+
+    def stop(self):
+        with self._lock:
+            if self._proc is not None and self._proc.poll() is None:
+                self._proc.terminate()
+                self._proc.wait()
+            self._proc = None
+
+    def submit(self, script_arg, function, args, workdir, limits=None, progress_path=None):
+        """
+        Hand a job to a warm worker and return the connected socket.
+        `limits` are the run's resource limits and `progress_path` where it
+        writes its progress. Raises PoolUnavailable if the pool can't be
+        reached.
+        """
+        try:
+            self.start()
+            sock = self._connect()
+        except (OSError, PoolUnavailable) as e:
+            raise PoolUnavailable(str(e)) from e
+        job = {
+            "script": script_arg,
+            "function": function,
+            "args": [str(a) for a in args],
+            "cwd": workdir,
+            "limits": limits or {},
+            "progress": progress_path,
+        }
+        write_frame(sock, FRAME_JOB, json.dumps(job).encode("utf-8"))
+        return sock
+
+    def cancel(self, sock):
+        """
+        Ask the worker running the job submitted on `sock` to stop it.
+        """
+        try:
+            write_frame(sock, FRAME_CANCEL)
+        except OSError:
+            pass
+
+    def stream(self, sock, on_result=None, on_usage=None):
+        """
+        Yield output chunks (bytes) of a submitted job, like
+        `stream_subprocess`; the generator's return value is the exit code.
+        `on_result` receives the bytes of the job's result channel, if it
+        sent a result, and `on_usage` the run's JSON resource usage.
+        """
+        return_code = None
+        try:
+            while True:
+                frame = read_frame(sock)
+                if frame is None:
+                    break
+                kind, payload = frame
+                if kind == FRAME_OUTPUT:
+                    yield payload
+                elif kind == FRAME_RESULT:
+                    if on_result is not None:
+                        on_result(payload)
+                elif kind == FRAME_USAGE:
+                    if on_usage is not None:
+                        on_usage(payload)
+                elif kind == FRAME_EXIT:
+                    return_code = int(payload)
+                    break
+        finally:
+            sock.close()
+        if return_code is None:
+            yield b"\n[Worker connection lost]\n"
+            return 1
+        if return_code != 0:
+            yield f"\n[Process exited with code {return_code}]\n".encode("utf-8")
+        return return_code
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Return the process-wide worker pool handle.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool()
+        return _pool
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s [workers]: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    parser = argparse.ArgumentParser(description="Pre-forked worker pool for Scripter runs.")
+    parser.add_argument("--socket", default=SOCKET_PATH, help="Unix socket to listen on.")
+    parser.add_argument("--size", type=int, default=POOL_SIZE, help="Number of workers.")
+    parser.add_argument(
+        "--preload",
+        default=",".join(PRELOAD),
+        help="Comma-separated modules to import once in the master (e.g. 'boto3').",
+    )
+    cli = parser.parse_args()
+    serve(cli.socket, cli.size, [m for m in cli.preload.split(",") if m])